@@ -0,0 +1,298 @@
+"""
+Per-patient vital sign aggregates, cached and kept current as visits are added.
+
+An aggregate holds, for each of the six vital signs, the count, sum, sum of squares,
+minimum and maximum of one patient's visits, plus the patient's last visit. Aggregates
+of several patients merge by adding up these partials, so statistics over any set of
+cached patients cost O(1) per patient instead of a pass over their visits. The
+aggregate of the whole population is kept as well, so repeated population statistics
+cost nothing until a patient is deleted.
+
+The AggregateCache is one of the indexes of a patients collection (see
+patient_records): appending a visit updates a cached aggregate in place, deleting a
+patient drops it, and a patient that is not cached is aggregated from its visits on
+first use. The least recently used aggregates are evicted once the cache outgrows its
+memory budget.
+"""
+import gc
+import math
+import sys
+import threading
+from collections import OrderedDict
+from itertools import chain
+from operator import eq, mul
+
+from instrumentation import metrics
+from visit_record import vitalColumns
+
+# Default number of bytes the cached aggregates may take
+DEFAULT_MEMORY_BUDGET = 64 << 20
+
+
+class PatientAggregate:
+    """
+    Count, sums, sums of squares, minimums and maximums of the six vital signs
+    (temperature, heart rate, respiratory rate, systolic and diastolic blood pressure,
+    oxygen saturation) over a set of visits, and the last of those visits.
+    """
+
+    __slots__ = ('count', 'sums', 'squares', 'minimums', 'maximums', 'lastVisit')
+
+    def __init__(self):
+        self.count = 0
+        self.sums = [0] * 6
+        self.squares = [0] * 6
+        self.minimums = [None] * 6
+        self.maximums = [None] * 6
+        self.lastVisit = None
+
+    @classmethod
+    def fromColumns(cls, columns, lastVisit=None):
+        """
+        Aggregates visits given as six vital sign columns.
+        """
+        aggregate = cls()
+        aggregate.count = len(columns[0])
+        if aggregate.count:
+            aggregate.sums = [math.fsum(column) for column in columns]
+            aggregate.squares = [math.fsum(map(mul, column, column)) for column in columns]
+            aggregate.minimums = [min(column) for column in columns]
+            aggregate.maximums = [max(column) for column in columns]
+        aggregate.lastVisit = lastVisit
+        return aggregate
+
+    def add(self, visit):
+        """
+        Adds one visit, which becomes the last visit.
+        """
+        self.count += 1
+        for i, value in enumerate(visit[1:7]):
+            self.sums[i] += value
+            self.squares[i] += value * value
+            if self.minimums[i] is None or value < self.minimums[i]:
+                self.minimums[i] = value
+            if self.maximums[i] is None or value > self.maximums[i]:
+                self.maximums[i] = value
+        self.lastVisit = visit
+
+    def subtract(self, other):
+        """
+        Removes the visits aggregated by another PatientAggregate from this one. Minimums
+        and maximums cannot be taken back, so they are left as they are.
+        """
+        self.count -= other.count
+        for i in range(6):
+            self.sums[i] -= other.sums[i]
+            self.squares[i] -= other.squares[i]
+
+    def merge(self, other):
+        """
+        Adds the visits aggregated by another PatientAggregate to this one.
+        """
+        if not other.count:
+            return
+        self.count += other.count
+        for i in range(6):
+            self.sums[i] += other.sums[i]
+            self.squares[i] += other.squares[i]
+            if self.minimums[i] is None or other.minimums[i] < self.minimums[i]:
+                self.minimums[i] = other.minimums[i]
+            if self.maximums[i] is None or other.maximums[i] > self.maximums[i]:
+                self.maximums[i] = other.maximums[i]
+
+    def means(self):
+        """
+        Returns the average of every vital sign, or None for each if there are no visits.
+        """
+        if not self.count:
+            return [None] * 6
+        return [total / self.count for total in self.sums]
+
+    def stdevs(self):
+        """
+        Returns the population standard deviation of every vital sign, or None for each
+        if there are no visits.
+        """
+        if not self.count:
+            return [None] * 6
+        return [math.sqrt(max(squares / self.count - (total / self.count) ** 2, 0.0))
+                for total, squares in zip(self.sums, self.squares)]
+
+
+def _aggregateSize():
+    """
+    Estimates the bytes a cached PatientAggregate takes, including its cache entry.
+    """
+    aggregate = PatientAggregate.fromColumns([[37.0], [70], [18], [120], [80], [95]], ['2000-01-01'])
+    size = sys.getsizeof(aggregate) + 4 * sys.getsizeof(aggregate.sums) + 4 * 6 * sys.getsizeof(1.0)
+    # An OrderedDict entry: hash table slot, linked list node and the key
+    return size + 100
+
+
+AGGREGATE_SIZE = _aggregateSize()
+
+
+class AggregateCache:
+    """
+    A least recently used cache of PatientAggregates over a patients collection.
+
+    hits and misses count the lookups answered from the cache and those that had to
+    aggregate a patient's visits.
+
+    Lookups reorder the cache, so get takes a lock: concurrent readers of a collection
+    (see concurrent_access) may share the cache. Changes to the collection, and the
+    index updates they cause, must not run alongside lookups.
+    """
+
+    def __init__(self, patients, memoryBudget=DEFAULT_MEMORY_BUDGET):
+        """
+        patients: The dictionary of patient IDs to lists of visits, or VisitStore, to aggregate.
+        memoryBudget: The number of bytes the cached aggregates may take.
+        """
+        self._patients = patients
+        self._entries = OrderedDict()
+        self._population = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.setMemoryBudget(memoryBudget)
+
+    def setMemoryBudget(self, memoryBudget):
+        """
+        Changes the memory budget, evicting aggregates if the cache is now over it.
+        """
+        self.memoryBudget = memoryBudget
+        self.capacity = max(1, memoryBudget // AGGREGATE_SIZE)
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def _aggregate(self, patientId):
+        """
+        Aggregates all visits of a patient.
+        """
+        patients = self._patients
+        if hasattr(patients, 'patientColumns'):
+            columns = patients.patientColumns([patientId])
+            last = patients.visitAt(patients.lastRow(patientId)) if columns[0] else None
+        else:
+            visits = list(patients[patientId])
+            columns = vitalColumns(visits)
+            last = visits[-1] if visits else None
+        return PatientAggregate.fromColumns(columns, last)
+
+    def _aggregateAll(self):
+        """
+        Aggregates the visits of all patients in one pass over whole columns.
+        """
+        patients = self._patients
+        if hasattr(patients, 'liveColumns'):
+            return PatientAggregate.fromColumns(patients.liveColumns())
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            columns = vitalColumns(list(chain.from_iterable(patients.values())))
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        return PatientAggregate.fromColumns(columns)
+
+    def get(self, patientId):
+        """
+        Returns the aggregate of a patient's visits.
+
+        Raises KeyError if the patient is not in the patients collection.
+        """
+        with self._lock:
+            aggregate = self._entries.get(patientId)
+            if aggregate is not None:
+                self.hits += 1
+                self._entries.move_to_end(patientId)
+            elif patientId in self._patients:
+                self.misses += 1
+        if aggregate is not None:
+            metrics.count('cache.aggregates.hits')
+            return aggregate
+        if patientId not in self._patients:
+            raise KeyError(patientId)
+        metrics.count('cache.aggregates.misses')
+        aggregate = self._aggregate(patientId)
+        with self._lock:
+            self._entries[patientId] = aggregate
+            self._evict()
+        return aggregate
+
+    def merged(self, patientIds=None):
+        """
+        Merges the aggregates of some patients, or of all patients if patientIds is None.
+        IDs that are not in the patients collection are ignored.
+
+        The aggregate of all patients is computed in one pass over the visits rather than
+        from the cache, kept independently of the memory budget, and updated as visits are
+        added and patients deleted. It must not be modified by the caller.
+
+        Returns a PatientAggregate, whose lastVisit is None.
+        """
+        if patientIds is None:
+            if self._population is None:
+                metrics.count('cache.population.misses')
+                self._population = self._aggregateAll()
+            else:
+                metrics.count('cache.population.hits')
+            return self._population
+        total = PatientAggregate()
+        for patientId in patientIds:
+            if patientId in self._patients:
+                total.merge(self.get(patientId))
+        return total
+
+    def rebuild(self, patients):
+        """
+        Forgets every cached aggregate; patients are aggregated again on demand.
+        """
+        self._patients = patients
+        self._entries.clear()
+        self._population = None
+
+    def visitAdded(self, patientId, visit):
+        """
+        Updates a cached aggregate after a visit was appended.
+        """
+        aggregate = self._entries.get(patientId)
+        if aggregate is not None:
+            aggregate.add(visit)
+        if self._population is not None:
+            self._population.add(visit)
+            self._population.lastVisit = None
+
+    def visitsAdded(self, visits):
+        """
+        Updates cached aggregates after (patientId, visit) pairs were appended.
+        """
+        for patientId, visit in visits:
+            self.visitAdded(patientId, visit)
+
+    def patientDeleted(self, patientId):
+        """
+        Drops the aggregate of a deleted patient.
+        """
+        aggregate = self._entries.pop(patientId, None)
+        population = self._population
+        if population is None:
+            return
+        # Without the patient's aggregate, or if the patient held an extreme value, the
+        # population aggregate cannot be corrected and is recomputed on next use
+        if aggregate is None or aggregate.count and (
+                any(map(eq, population.minimums, aggregate.minimums))
+                or any(map(eq, population.maximums, aggregate.maximums))):
+            self._population = None
+        else:
+            population.subtract(aggregate)
+
+    def __contains__(self, patientId):
+        return patientId in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,68 @@
+"""
+Compares adding visits one call at a time (addPatientData) with the batch API
+(addPatientVisits) under each durability policy, appending to an empty patients file.
+
+Usage: python benchmarks/bench_add_visits.py [number of visits]
+"""
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main_22BECD87 import addPatientData, addPatientVisits
+from patient_records import PatientRecords
+from visit_writer import DURABILITY_POLICIES
+
+
+def syntheticVisits(numVisits, seed=0):
+    """
+    Returns numVisits random, valid visits as addPatientData arguments.
+    """
+    rng = random.Random(seed)
+    return [(rng.randint(1, max(1, numVisits // 5)),
+             "%04d-%02d-%02d" % (rng.randint(2015, 2024), rng.randint(1, 12), rng.randint(1, 28)),
+             round(rng.uniform(35.5, 39.0), 1), rng.randint(50, 120), rng.randint(10, 25),
+             rng.randint(90, 160), rng.randint(55, 100), rng.randint(88, 100))
+            for _ in range(numVisits)]
+
+
+def timeAdd(add, directory, visits):
+    """
+    Returns the seconds taken by add(patients, visits, fileName) on a new file, with its
+    printed output discarded.
+    """
+    fileName = os.path.join(directory, 'patients.txt')
+    open(fileName, 'w').close()
+    patients = PatientRecords()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        add(patients, visits, fileName)
+    return time.perf_counter() - start
+
+
+def addOneByOne(patients, visits, fileName):
+    for visit in visits:
+        addPatientData(patients, *visit, fileName)
+
+
+def main():
+    numVisits = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    visits = syntheticVisits(numVisits)
+    adders = [("addPatientData", addOneByOne)]
+    for policy in DURABILITY_POLICIES:
+        adders.append((f"addPatientVisits {policy}",
+                       lambda patients, visits, fileName, policy=policy:
+                       addPatientVisits(patients, visits, fileName, durability=policy)))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, add in adders:
+            seconds = timeAdd(add, directory, visits)
+            print(f"{name:24} {seconds:8.3f} s  {numVisits / seconds:12,.0f} visits/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Measures read throughput of a QueryExecutor (see concurrent_access) with 1 to 8 worker
+threads, while a writer adds visits and deletes patients, on a generated file (see
+synthetic.py), for the text file loaded into a VisitStore and for the SQLite backend.
+The reads are a mix of single patient statistics, month queries, yearly trends and
+follow-up screening.
+
+Also runs the same mix on threads without the executor, against the dictionary
+returned by readPatientsFromFile, and counts the reads that failed because a write
+changed the collection under them.
+
+Reads run in parallel only as far as the GIL and the number of CPUs allow; the
+number of CPUs is printed with the results.
+
+Usage: python benchmarks/bench_concurrency.py [number of visits]
+"""
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from concurrent_access import QueryExecutor, SharedPatients
+from main_22BECD87 import (addPatientData, deleteAllVisitsOfPatient, displayStats, findPatientsWhoNeedFollowUp,
+                           findVisitsByDate, readPatientsFromFile)
+from monthly_rollups import vitalTrends
+from snapshot import loadPatients
+from sqlite_store import SqliteStore
+from synthetic import writePatientsFile
+
+# Number of reads per run
+READS = 1000
+# Number of reads per write
+READS_PER_WRITE = 100
+# Numbers of worker threads compared
+WORKERS = (1, 2, 4, 8)
+# Seconds a thread runs before the interpreter switches to another during the runs
+# without synchronization, short so that reads and writes interleave often
+SWITCH_INTERVAL = 1e-5
+
+
+def statsOfOne(patients, patientId):
+    displayStats(patients, patientId)
+    return patientId
+
+
+def visitsOfMonth(patients, year, month):
+    return len(findVisitsByDate(patients, year, month))
+
+
+def trendsOfYears(patients, startYear, endYear):
+    return [(period, rollup.count) for period, rollup in vitalTrends(patients, startYear, endYear)]
+
+
+def followUps(patients):
+    return len(findPatientsWhoNeedFollowUp(patients))
+
+
+def readMix(patientIds, years, seed=1):
+    """
+    Returns READS (function, args) pairs: statistics of one patient, visits of one month
+    and trends over a few years, with one follow-up screening in fifty.
+    """
+    rng = random.Random(seed)
+    reads = []
+    for number in range(READS):
+        if number % 50 == 0:
+            reads.append((followUps, ()))
+            continue
+        kind = number % 3
+        if kind == 0:
+            reads.append((statsOfOne, (rng.choice(patientIds),)))
+        elif kind == 1:
+            reads.append((visitsOfMonth, (rng.choice(years), rng.randint(1, 12))))
+        else:
+            start = rng.choice(years)
+            reads.append((trendsOfYears, (start, start + 2)))
+    return reads
+
+
+def writeOne(patients, number, deleted, fileName):
+    """
+    Adds a visit for a new patient and deletes a patient.
+    """
+    addPatientData(patients, 20_000_000 + number, '2021-%02d-10' % (number % 12 + 1),
+                   37.0, 70, 16, 120, 80, 97, fileName)
+    deleteAllVisitsOfPatient(patients, deleted, fileName)
+
+
+def runShared(patients, fileName, reads, deletions, workers):
+    """
+    Runs the reads on a QueryExecutor while writes are submitted between them.
+
+    Returns (seconds, number of failed reads).
+    """
+    shared = SharedPatients(patients, fileName)
+    with QueryExecutor(shared, workers) as executor:
+        start = time.perf_counter()
+        futures = []
+        for number, (function, args) in enumerate(reads):
+            if number % READS_PER_WRITE == 0 and deletions:
+                futures.append(executor.submitWrite(writeOne, number, deletions.pop(), fileName))
+            futures.append(executor.submit(function, *args))
+        failed = sum(future.exception() is not None for future in futures)
+        elapsed = time.perf_counter() - start
+    return elapsed, failed
+
+
+def runUnsynchronized(patients, fileName, reads, deletions, workers):
+    """
+    Runs the reads on plain threads while a writer changes the collection under them
+    until the reads are done, deleting the patient it added last once deletions runs out.
+
+    Returns (seconds, number of failed reads).
+    """
+    done = threading.Event()
+
+    def writer():
+        number = 0
+        while not done.is_set():
+            deleted = deletions.pop() if deletions else 20_000_000 + number - 1
+            writeOne(patients, number, deleted, fileName)
+            number += 1
+
+    def read(read):
+        function, args = read
+        try:
+            function(patients, *args)
+            return 0
+        except (RuntimeError, KeyError, IndexError, ValueError):
+            return 1
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(SWITCH_INTERVAL)
+    writing = threading.Thread(target=writer)
+    start = time.perf_counter()
+    try:
+        writing.start()
+        with ThreadPoolExecutor(workers) as pool:
+            failed = sum(pool.map(read, reads))
+        elapsed = time.perf_counter() - start
+    finally:
+        done.set()
+        writing.join()
+        sys.setswitchinterval(interval)
+    return elapsed, failed
+
+
+def report(out, name, run, load, fileName, reads, patientIds):
+    """
+    Prints the throughput of a run with each number of workers to out, on a fresh copy
+    of the patients.
+    """
+    print(f"  {name}", file=out)
+    for workers in WORKERS:
+        patients = load()
+        deletions = patientIds[:READS // READS_PER_WRITE + 1]
+        elapsed, failed = run(patients, fileName, reads, deletions, workers)
+        if isinstance(patients, SqliteStore):
+            patients.close()
+        print(f"    {workers} workers {READS / elapsed:10,.0f} reads/s  {failed:5} failed", file=out)
+
+
+def main():
+    numVisits = int(float(sys.argv[1])) if len(sys.argv) > 1 else 200_000
+    with tempfile.TemporaryDirectory() as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            textFile = os.path.join(directory, 'patients.txt')
+            database = os.path.join(directory, 'patients.db')
+            writePatientsFile(textFile, numVisits)
+            with SqliteStore(database) as store:
+                store.importTextFile(textFile)
+            patients = loadPatients(textFile)
+            years = sorted({visit.date.year for _, visit in findVisitsByDate(patients)})
+            patientIds = list(patients)
+        reads = readMix(patientIds, years)
+        print(f"{numVisits:,} visits, {READS:,} reads, one write per {READS_PER_WRITE} reads, "
+              f"{os.cpu_count()} CPUs")
+
+        # Every run changes the files, so each starts from a copy of the originals
+        def copyOf(fileName):
+            copy = fileName + '.run'
+            shutil.copyfile(fileName, copy)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(copy + '.snap')
+            return copy
+
+        runs = (
+            ('text file (VisitStore), QueryExecutor', runShared,
+             lambda: loadPatients(copyOf(textFile)), textFile + '.run'),
+            ('SQLite, QueryExecutor', runShared,
+             lambda: SqliteStore(copyOf(database)), database + '.run'),
+            ('text file (dictionary), no synchronization', runUnsynchronized,
+             lambda: readPatientsFromFile(copyOf(textFile)), textFile + '.run'),
+        )
+        out = sys.stdout
+        # The patient functions print their results, which are discarded
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, run, load, fileName in runs:
+                report(out, name, run, load, fileName, reads, patientIds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Compares findVisitsByDate on a plain dictionary (full scan) with the same call on the
+PatientRecords returned by readPatientsFromFile (date index), on a generated patients file.
+
+Usage: python benchmarks/bench_find_visits.py [number of visits]
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_ingest import writeSyntheticFile
+from main_22BECD87 import findVisitsByDate, readPatientsFromFile
+
+QUERIES = ((2020, None), (2023, 6), (None, 2), (None, None))
+
+
+def timeQuery(patients, year, month, repeat=5):
+    """
+    Returns the best time in seconds of findVisitsByDate(patients, year, month) and its result size.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        visits = findVisitsByDate(patients, year, month)
+        best = min(best, time.perf_counter() - start)
+    return best, len(visits)
+
+
+def main():
+    numVisits = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'patients.txt')
+        writeSyntheticFile(fileName, numVisits)
+        with contextlib.redirect_stdout(io.StringIO()):
+            indexed = readPatientsFromFile(fileName)
+        plain = dict(indexed)
+        print(f"{'year':>6} {'month':>6} {'matches':>9} {'scan':>10} {'index':>10}")
+        for year, month in QUERIES:
+            scan_time, matches = timeQuery(plain, year, month)
+            index_time, _ = timeQuery(indexed, year, month)
+            print(f"{str(year):>6} {str(month):>6} {matches:>9} {scan_time * 1000:8.2f}ms {index_time * 1000:8.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
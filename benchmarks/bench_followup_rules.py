@@ -0,0 +1,64 @@
+"""
+Compares evaluating follow-up rules patient by patient (RuleSet.severityOf) with
+screening all patients at once (RuleSet.screen), for the default criteria and for the
+rule set in followup_rules.json, on a dictionary and on a VisitStore.
+
+Usage: python benchmarks/bench_followup_rules.py [number of visits]
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_ingest import writeSyntheticFile
+from bulk_ingest import readPatientsBulk
+from followup_rules import DEFAULT_RULES, loadRules
+from visit_store import VisitStore
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'followup_rules.json')
+
+
+def screenOneByOne(rules, patients):
+    """
+    Returns the same list as rules.screen, evaluating every patient's visits in turn.
+    """
+    found = []
+    for patientId, visits in patients.items():
+        severity = rules.severityOf(list(visits[-rules.depth:]))
+        if severity is not None:
+            found.append((patientId, severity))
+    return found
+
+
+def timeCall(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    numVisits = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'patients.txt')
+        writeSyntheticFile(fileName, numVisits)
+        with contextlib.redirect_stdout(io.StringIO()):
+            patients = readPatientsBulk(fileName)
+    store = VisitStore.fromPatients(patients)
+    print(f"{len(patients)} patients, {numVisits} visits")
+
+    for name, rules in (("default rules", DEFAULT_RULES), ("followup_rules.json", loadRules(RULES_FILE))):
+        print(f"{name} ({len(rules.rules)} rules):")
+        one_time, expected = timeCall(screenOneByOne, rules, patients)
+        print(f"  one by one           {one_time:8.3f} s")
+        for label, collection in (("dictionary", patients), ("VisitStore", store)):
+            seconds, found = timeCall(rules.screen, collection)
+            assert found == expected
+            print(f"  screen {label:<13} {seconds:8.3f} s  ({one_time / seconds:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
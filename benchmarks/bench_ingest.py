@@ -0,0 +1,128 @@
+"""
+Compares the original line-by-line loader, kept here as readPatientsLineByLine for
+reference, with the loaders of the package on a generated patients file: the
+dictionary loaders (readPatientsFromFile and readPatientsBulk), which also validate
+dates and create Visit records, and loading straight into a VisitStore
+(loadVisitStore). It reports the CPU time and the peak memory of each, the latter
+measured with tracemalloc in a second run.
+
+Usage: python benchmarks/bench_ingest.py [number of visits]
+"""
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bulk_ingest import readPatientsBulk
+from main_22BECD87 import readPatientsFromFile
+from visit_store import loadVisitStore
+
+
+def writeSyntheticFile(fileName, numVisits, seed=0):
+    """
+    Writes a patients file with numVisits random, valid visits.
+    """
+    rng = random.Random(seed)
+    with open(fileName, 'w') as file:
+        for _ in range(numVisits):
+            file.write("%d,%04d-%02d-%02d,%.1f,%d,%d,%d,%d,%d\n" % (
+                rng.randint(1, max(1, numVisits // 5)), rng.randint(2015, 2024), rng.randint(1, 12),
+                rng.randint(1, 28), rng.uniform(35.5, 39.0), rng.randint(50, 120), rng.randint(10, 25),
+                rng.randint(90, 160), rng.randint(55, 100), rng.randint(88, 100)))
+
+
+def readPatientsLineByLine(fileName):
+    """
+    The loader readPatientsFromFile replaced: one line at a time, visits as lists.
+    """
+    patients = {}
+    try:
+        with open(fileName, 'r') as file:
+            for line_num, line in enumerate(file, start=1):
+                try:
+                    patient_data = line.strip().split(',')
+                    if len(patient_data) != 8:
+                        raise ValueError(f"Invalid number of fields ({len(patient_data)}) in line: {line_num}")
+                    patient_id = int(patient_data[0])
+                    date = patient_data[1]
+                    temp = float(patient_data[2])
+                    hr = int(patient_data[3])
+                    rr = int(patient_data[4])
+                    sbp = int(patient_data[5])
+                    dbp = int(patient_data[6])
+                    spo2 = int(patient_data[7])
+                    if not (35 <= temp <= 42):
+                        raise ValueError(f"Invalid temperature value ({temp}) in line: {line_num}")
+                    if not (30 <= hr <= 180):
+                        raise ValueError(f"Invalid heart rate value ({hr}) in line: {line_num}")
+                    if not (5 <= rr <= 40):
+                        raise ValueError(f"Invalid respiratory rate value ({rr}) in line: {line_num}")
+                    if not (70 <= sbp <= 200):
+                        raise ValueError(f"Invalid systolic blood pressure value ({sbp}) in line: {line_num}")
+                    if not (40 <= dbp <= 120):
+                        raise ValueError(f"Invalid diastolic blood pressure value ({dbp}) in line: {line_num}")
+                    if not (70 <= spo2 <= 100):
+                        raise ValueError(f"Invalid oxygen saturation value ({spo2}) in line: {line_num}")
+                    if patient_id not in patients:
+                        patients[patient_id] = []
+                    patients[patient_id].append([date, temp, hr, rr, sbp, dbp, spo2])
+                except ValueError as ve:
+                    print(ve)
+                except Exception as e:
+                    print(f"An unexpected error occurred while reading line {line_num}: {e}")
+    except FileNotFoundError:
+        print(f"The file '{fileName}' could not be found.")
+    return patients
+
+
+def timeLoader(loader, fileName, repeat=3):
+    """
+    Returns the least CPU seconds taken by loader(fileName) in repeat runs, with its
+    printed output discarded.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            loader(fileName)
+        times.append(time.process_time() - start)
+    return min(times)
+
+
+def peakMemory(loader, fileName):
+    """
+    Returns the peak memory in MiB allocated by loader(fileName), as seen by tracemalloc.
+    """
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        loader(fileName)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / (1 << 20)
+
+
+def main():
+    numVisits = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'patients.txt')
+        writeSyntheticFile(fileName, numVisits)
+        loaders = (("readPatientsLineByLine", readPatientsLineByLine),
+                   ("readPatientsFromFile", readPatientsFromFile),
+                   ("readPatientsBulk", readPatientsBulk),
+                   ("loadVisitStore", loadVisitStore))
+        baseline = None
+        for name, loader in loaders:
+            seconds = timeLoader(loader, fileName)
+            baseline = baseline or seconds
+            print(f"{name:22} {seconds:8.3f} s  {numVisits / seconds:12,.0f} rows/s  "
+                  f"{seconds / baseline:5.2f}x line by line  peak {peakMemory(loader, fileName):7.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Times the parallel loader (readPatientsParallel) with an increasing number of worker
+processes against the single-process block-wise loader (readPatientsBulk), on a
+generated patients file.
+
+Usage: python benchmarks/bench_parallel_ingest.py [number of visits] [max workers]
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_ingest import timeLoader, writeSyntheticFile
+from bulk_ingest import readPatientsBulk
+from parallel_ingest import readPatientsParallel
+
+
+def main():
+    numVisits = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    maxWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'patients.txt')
+        writeSyntheticFile(fileName, numVisits)
+        baseline = timeLoader(readPatientsBulk, fileName)
+        print(f"{'readPatientsBulk':26} {baseline:8.3f} s  {numVisits / baseline:12,.0f} rows/s")
+        workers = 1
+        while workers <= maxWorkers:
+            seconds = timeLoader(lambda name: readPatientsParallel(name, workers), fileName)
+            print(f"{f'readPatientsParallel x{workers}':26} {seconds:8.3f} s  {numVisits / seconds:12,.0f} rows/s"
+                  f"  speedup {baseline / seconds:5.2f}")
+            workers *= 2
+
+
+if __name__ == '__main__':
+    main()
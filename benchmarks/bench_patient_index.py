@@ -0,0 +1,70 @@
+"""
+Compares the single-patient commands of cli.py with and without the patient index (see
+patient_index), on generated files (see synthetic.py) of growing size.
+
+Without the index, a command loads the whole file (from its snapshot, see snapshot)
+before looking at one patient; with it, the command reads only that patient's lines, so
+its time barely depends on the size of the file.
+
+Usage: python benchmarks/bench_patient_index.py [number of visits of the largest file]
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main_22BECD87 import displayStats
+from patient_index import IndexedPatients, PatientIndex, buildIndex
+from snapshot import loadPatients
+from synthetic import writePatientsFile
+
+# Number of patients looked up on each file
+LOOKUPS = 50
+
+
+def timeCall(function, *args):
+    """
+    Returns (seconds, result) of function(*args), with its printed output discarded.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args)
+        return time.perf_counter() - start, result
+
+
+def statsLoaded(fileName, patientIds):
+    for patientId in patientIds:
+        displayStats(loadPatients(fileName), patientId)
+
+
+def statsIndexed(fileName, patientIds):
+    for patientId in patientIds:
+        patients = IndexedPatients(fileName)
+        displayStats(patients, patientId)
+        patients.close()
+
+
+def main():
+    largest = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1_000_000
+    print(f"  {'visits':>10} {'build index':>12} {'full load':>12} {'indexed':>12}   (per lookup)")
+    with tempfile.TemporaryDirectory() as directory:
+        for numVisits in (largest // 100, largest // 10, largest):
+            fileName = os.path.join(directory, f'patients{numVisits}.txt')
+            writePatientsFile(fileName, numVisits)
+            build = timeCall(buildIndex, fileName)[0]
+            timeCall(loadPatients, fileName)  # writes the snapshot
+            index = PatientIndex.open(fileName)
+            patientIds = list(index.patientIds())
+            index.close()
+            patientIds = patientIds[::max(1, len(patientIds) // LOOKUPS)][:LOOKUPS]
+            loaded = timeCall(statsLoaded, fileName, patientIds[:5])[0] / len(patientIds[:5])
+            indexed = timeCall(statsIndexed, fileName, patientIds)[0] / len(patientIds)
+            print(f"  {numVisits:>10,} {build:10.3f} s {loaded:10.4f} s {indexed:10.6f} s")
+
+
+if __name__ == '__main__':
+    main()
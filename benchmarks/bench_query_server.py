@@ -0,0 +1,182 @@
+"""
+Load-tests the query server at a target rate of requests per second and reports the
+latency percentiles.
+
+Requests are sent on a fixed schedule (open loop) over several connections, and the
+latency of a request is measured from the time it was due to be sent. A server that
+falls behind therefore shows the queueing delay in its latencies instead of slowing the
+test down to its own pace.
+
+Without --port or --socket, a server is started on a generated patients file of
+--visits visits. The default mix is read-only; --writes sends that fraction of add
+requests (against the generated file, or the running server's file).
+
+Usage: python benchmarks/bench_query_server.py [--qps 500] [--duration 10] [--connections 8]
+           [--port PORT | --socket PATH] [--visits 100000] [--writes 0.0]
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_ingest import writeSyntheticFile
+from query_server import DEFAULT_HOST, QueryClient
+
+# (share of requests, op, function of a random generator and the patient IDs to the request parameters)
+READ_MIX = (
+    (0.55, 'patient', lambda rng, ids: {'patientId': rng.choice(ids), 'limit': 20}),
+    (0.25, 'stats', lambda rng, ids: {'patientId': rng.choice(ids)}),
+    (0.10, 'findVisits', lambda rng, ids: {'year': rng.randint(2015, 2024), 'month': rng.randint(1, 12), 'limit': 50}),
+    (0.05, 'followUp', lambda rng, ids: {}),
+    (0.05, 'stats', lambda rng, ids: {}),
+)
+
+
+def _addParams(rng, ids):
+    return {'patientId': rng.choice(ids), 'date': '%04d-%02d-%02d' % (rng.randint(2015, 2024), rng.randint(1, 12), rng.randint(1, 28)),
+            'temp': round(rng.uniform(35.5, 39.0), 1), 'hr': rng.randint(50, 120), 'rr': rng.randint(10, 25),
+            'sbp': rng.randint(90, 160), 'dbp': rng.randint(55, 100), 'spo2': rng.randint(88, 100)}
+
+
+def percentileOf(sortedValues, q):
+    """
+    Returns the q-th percentile of sorted values by the nearest-rank method.
+    """
+    if not sortedValues:
+        return math.nan
+    return sortedValues[max(0, math.ceil(q / 100 * len(sortedValues)) - 1)]
+
+
+def chooseRequest(rng, patientIds, writes):
+    """
+    Returns an (op, params) pair drawn from the request mix.
+    """
+    if rng.random() < writes:
+        return 'add', _addParams(rng, patientIds)
+    draw = rng.random()
+    for share, op, params in READ_MIX:
+        draw -= share
+        if draw < 0:
+            break
+    return op, params(rng, patientIds)
+
+
+async def _runConnection(client, schedule, latencies, errors):
+    """
+    Sends the requests of one connection at their due times while a second task reads
+    the responses, which arrive in the order the requests were sent.
+    """
+    due_times = asyncio.Queue()
+
+    async def receive():
+        for _ in range(len(schedule)):
+            response = await client.receive()
+            latencies.append(time.perf_counter() - await due_times.get())
+            if not response.get('ok'):
+                errors.append(response.get('error'))
+
+    receiver = asyncio.ensure_future(receive())
+    for due, op, params in schedule:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        due_times.put_nowait(due)
+        client.send(op, **params)
+    await receiver
+
+
+async def loadTest(address, qps, duration, connections, writes=0.0, seed=0):
+    """
+    Sends qps requests per second for duration seconds, spread over a number of connections.
+    Patient requests ask for patients the server has, so that every failure is unexpected.
+
+    address: A (host, port) pair, or the path of a Unix socket.
+    writes: The fraction of requests that add a visit.
+    Returns a tuple (sorted latencies in seconds, error messages, seconds taken).
+    """
+    if isinstance(address, str):
+        clients = [await QueryClient.connect(socketPath=address) for _ in range(connections)]
+    else:
+        clients = [await QueryClient.connect(*address) for _ in range(connections)]
+    visits = await clients[0].request('findVisits')
+    patientIds = sorted({patientId for patientId, _ in visits}) or [1]
+    rng = random.Random(seed)
+    total = int(qps * duration)
+    start = time.perf_counter() + 0.1
+    schedules = [[] for _ in clients]
+    for i in range(total):
+        schedules[i % connections].append((start + i / qps,) + chooseRequest(rng, patientIds, writes))
+
+    latencies = []
+    errors = []
+    await asyncio.gather(*(_runConnection(client, schedule, latencies, errors)
+                           for client, schedule in zip(clients, schedules)))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.close()
+    latencies.sort()
+    return latencies, errors, elapsed
+
+
+def startServer(fileName):
+    """
+    Starts query_server.py on a free port in a child process; returns (process, port).
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'query_server.py')
+    process = subprocess.Popen([sys.executable, script, '--file', fileName, '--port', '0'],
+                               stdout=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        if line.startswith("Serving"):
+            return process, int(line.rsplit(':', 1)[1])
+    raise RuntimeError("The query server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the query server.")
+    parser.add_argument('--qps', type=float, default=500)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--socket')
+    parser.add_argument('--visits', type=int, default=100_000)
+    parser.add_argument('--writes', type=float, default=0.0)
+    args = parser.parse_args()
+
+    process = None
+    with tempfile.TemporaryDirectory() as directory:
+        if args.socket:
+            address = args.socket
+        elif args.port:
+            address = (args.host, args.port)
+        else:
+            fileName = os.path.join(directory, 'patients.txt')
+            writeSyntheticFile(fileName, args.visits)
+            process, port = startServer(fileName)
+            address = (DEFAULT_HOST, port)
+        try:
+            latencies, errors, elapsed = asyncio.run(
+                loadTest(address, args.qps, args.duration, args.connections, args.writes))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    print(f"{len(latencies)} requests in {elapsed:.2f} s ({len(latencies) / elapsed:.0f} per second, "
+          f"target {args.qps:.0f}), {len(errors)} failed")
+    for q in (50, 90, 99, 99.9):
+        print(f"  p{q:<5} {percentileOf(latencies, q) * 1000:8.2f} ms")
+    print(f"  max    {latencies[-1] * 1000 if latencies else math.nan:8.2f} ms")
+    for error in sorted(set(errors))[:5]:
+        print("  error:", error)
+
+
+if __name__ == '__main__':
+    main()
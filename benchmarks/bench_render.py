@@ -0,0 +1,66 @@
+"""
+Compares dumping every visit with one print call per line (the way displayPatientData
+used to) with renderPatients in each output format, writing to a temporary file.
+
+Usage: python benchmarks/bench_render.py [number of visits]
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_ingest import writeSyntheticFile
+from bulk_ingest import readPatientsBulk
+from visit_render import FORMATS, renderPatients
+
+
+def printPatients(patients, out):
+    """
+    Writes all patients with the print calls displayPatientData made before renderPatients.
+    """
+    with contextlib.redirect_stdout(out):
+        for patient_id, visits in patients.items():
+            print(f"Patient ID: {patient_id}")
+            for visit in visits:
+                print(" Visit Date:", visit[0])
+                print(" " * 2, "Temperature:", "%.2f" % visit[1], "C")
+                print(" " * 2, "Heart Rate:", visit[2], "bpm")
+                print(" " * 2, "Respiratory Rate:", visit[3], "bpm")
+                print(" " * 2, "Systolic Blood Pressure:", visit[4], "mmHg")
+                print(" " * 2, "Diastolic Blood Pressure:", visit[5], "mmHg")
+                print(" " * 2, "Oxygen Saturation:", visit[6], "%")
+                print()
+
+
+def timeDump(dump, fileName):
+    """
+    Returns the seconds taken by dump(out) writing to a new file.
+    """
+    start = time.perf_counter()
+    with open(fileName, 'w') as out:
+        dump(out)
+    return time.perf_counter() - start
+
+
+def main():
+    numVisits = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'patients.txt')
+        writeSyntheticFile(fileName, numVisits)
+        with contextlib.redirect_stdout(io.StringIO()):
+            patients = readPatientsBulk(fileName)
+        outName = os.path.join(directory, 'dump')
+        dumps = [("print per line", lambda out: printPatients(patients, out))]
+        for fmt in FORMATS:
+            dumps.append((f"renderPatients {fmt}", lambda out, fmt=fmt: renderPatients(patients, fmt=fmt, out=out)))
+        for name, dump in dumps:
+            seconds = timeDump(dump, outName)
+            print(f"{name:22} {seconds:8.3f} s  {numVisits / seconds:12,.0f} visits/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Compares a multi-year trend report built from monthly rollups (see monthly_rollups) with
+the same report built by calling findVisitsByDate for every month and averaging by hand,
+on a generated file (see synthetic.py). Also times the first roll-up and the report
+after visits were added and patients deleted, which refreshes only the months they
+touched.
+
+Usage: python benchmarks/bench_rollups.py [number of visits]
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main_22BECD87 import addPatientData, deleteAllVisitsOfPatient, findVisitsByDate
+from monthly_rollups import vitalTrends
+from snapshot import loadPatients
+from synthetic import writePatientsFile
+from visit_record import vitalColumns
+
+# Number of visits added, and of patients deleted, between two reports
+CHANGES = 100
+
+
+def timeCall(function, *args):
+    """
+    Returns (seconds, result) of function(*args), with its printed output discarded.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args)
+        return time.perf_counter() - start, result
+
+
+def scanTrends(patients, years):
+    """
+    Averages every vital sign per month with one findVisitsByDate call per month.
+    """
+    trends = []
+    for year in years:
+        for month in range(1, 13):
+            visits = [visit for _, visit in findVisitsByDate(patients, year, month)]
+            if visits:
+                trends.append(("%04d-%02d" % (year, month), len(visits),
+                               [sum(column) / len(visits) for column in vitalColumns(visits)]))
+    return trends
+
+
+def rollupTrends(patients, years):
+    """
+    Averages every vital sign per month from the monthly rollups.
+    """
+    return [(period, rollup.count, rollup.means())
+            for period, rollup in vitalTrends(patients, years[0], years[-1], monthly=True)]
+
+
+def change(patients, fileName):
+    """
+    Adds CHANGES visits and deletes CHANGES patients.
+    """
+    for number in range(CHANGES):
+        addPatientData(patients, 10_000_000 + number, '2020-%02d-15' % (number % 12 + 1),
+                       37.0, 70, 16, 120, 80, 97, fileName)
+    for patientId in list(patients)[:CHANGES]:
+        deleteAllVisitsOfPatient(patients, patientId, fileName)
+
+
+def main():
+    numVisits = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'patients.txt')
+        writePatientsFile(fileName, numVisits)
+        patients = timeCall(loadPatients, fileName)[1]
+        years = {visit.date.year for _, visit in findVisitsByDate(patients)}
+        years = list(range(min(years), max(years) + 1))
+        print(f"{numVisits:,} visits, {len(years)} years")
+
+        scan, expected = timeCall(scanTrends, patients, years)
+        first, found = timeCall(rollupTrends, patients, years)
+        again, found = timeCall(rollupTrends, patients, years)
+        assert [(period, count) for period, count, _ in found] == [(period, count) for period, count, _ in expected]
+        changed = timeCall(change, patients, fileName)[0]
+        refreshed = timeCall(rollupTrends, patients, years)[0]
+        print(f"  {'findVisitsByDate per month':34} {scan:8.4f} s")
+        print(f"  {'rollups, first use':34} {first:8.4f} s")
+        print(f"  {'rollups, built':34} {again:8.4f} s")
+        print(f"  {f'{CHANGES} adds and {CHANGES} deletes':34} {changed:8.4f} s")
+        print(f"  {'rollups, after the changes':34} {refreshed:8.4f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the SQLite storage backend with the patients text file: loading (importing
+into the database, reopening it), statistics, date queries, follow-up screening and
+deletions, on a generated file (see synthetic.py).
+
+The text file is loaded into memory with loadPatients before it can be queried; the
+database is opened without reading its visits, and every query runs against it.
+
+Usage: python benchmarks/bench_sqlite.py [number of visits]
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main_22BECD87 import deleteAllVisitsOfPatient, displayStats, findPatientsWhoNeedFollowUp, findVisitsByDate
+from snapshot import loadPatients
+from sqlite_store import SqliteStore
+from synthetic import writePatientsFile
+
+# Number of patients deleted by the deletion case
+DELETIONS = 100
+
+
+def timeCall(function, *args):
+    """
+    Returns (seconds, result) of function(*args), with its printed output discarded.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args)
+        return time.perf_counter() - start, result
+
+
+def deleteSome(patients, patientIds, fileName):
+    for patientId in patientIds:
+        deleteAllVisitsOfPatient(patients, patientId, fileName)
+
+
+def main():
+    numVisits = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        textFile = os.path.join(directory, 'patients.txt')
+        database = os.path.join(directory, 'patients.db')
+        writePatientsFile(textFile, numVisits)
+        print(f"{numVisits:,} visits")
+
+        load, text = timeCall(loadPatients, textFile)
+        imported, store = timeCall(lambda: SqliteStore(database))
+        imported += timeCall(store.importTextFile, textFile)[0]
+        store.close()
+        opened, store = timeCall(SqliteStore, database)
+        print(f"  {'load text file':34} {load:8.3f} s")
+        print(f"  {'import into SQLite':34} {imported:8.3f} s  ({os.path.getsize(database):,} bytes)")
+        print(f"  {'open SQLite database':34} {opened:8.3f} s")
+
+        patientId = max(text, key=lambda patientId: len(text[patientId]))
+        deleted = list(text)[:DELETIONS]
+        cases = (
+            ('displayStats (all)', lambda patients, fileName: displayStats(patients, 0)),
+            ('displayStats (one)', lambda patients, fileName: displayStats(patients, patientId)),
+            ('findVisitsByDate (year)', lambda patients, fileName: findVisitsByDate(patients, 2020)),
+            ('findVisitsByDate (year, month)', lambda patients, fileName: findVisitsByDate(patients, 2020, 6)),
+            ('findPatientsWhoNeedFollowUp', lambda patients, fileName: findPatientsWhoNeedFollowUp(patients)),
+            (f'deleteAllVisitsOfPatient (x{DELETIONS})',
+             lambda patients, fileName: deleteSome(patients, deleted, fileName)),
+        )
+        print(f"  {'case':34} {'text':>10} {'SQLite':>10}")
+        for name, case in cases:
+            text_time, expected = timeCall(case, text, textFile)
+            sqlite_time, found = timeCall(case, store, database)
+            assert found == expected
+            print(f"  {name:34} {text_time:8.4f} s {sqlite_time:8.4f} s")
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
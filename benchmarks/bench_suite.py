@@ -0,0 +1,324 @@
+"""
+Benchmark suite of the public patient functions, writing its results as JSON.
+
+For every file size, a patients file is generated with benchmarks/synthetic.py (same
+seed, same file), and every case below is timed and its peak memory measured:
+
+    readPatientsFromFile, loadPatients (no snapshot / with snapshot), readPatientsBulk
+    displayStats (all patients / one patient), displayPatientData (one patient)
+    findVisitsByDate (year / year and month / month)
+    findPatientsWhoNeedFollowUp (on a fresh load, so including the index build)
+    addPatientData (single visits), addPatientVisits (a batch)
+    deleteAllVisitsOfPatient
+
+A case's time is the first, the best and the median of --repeat runs, each on fresh
+state for the cases that change data, with the setup excluded. Read-only cases share
+one loaded copy of the file, so the first run also pays for the indexes and caches it
+builds, and the best run shows the time once they exist. Its peak memory is measured in a
+separate run under tracemalloc (which slows it down), as the peak of memory allocated
+during the run above what was allocated before it. Printed output is discarded.
+
+The results file records the interpreter, the platform and the git commit, so that
+runs of different versions can be compared with --compare, which prints the ratio of
+every time and peak memory to the earlier run and flags slowdowns beyond --tolerance.
+
+Usage: python benchmarks/bench_suite.py [--sizes 1e3,1e4,1e5] [--repeat 3] [--seed 0]
+           [--invalid-rate 0.0] [--cases NAME,...] [--output results.json] [--compare earlier.json]
+"""
+import argparse
+import contextlib
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bulk_ingest import readPatientsBulk
+from main_22BECD87 import (addPatientData, addPatientVisits, deleteAllVisitsOfPatient, displayPatientData,
+                           displayStats, findPatientsWhoNeedFollowUp, findVisitsByDate, readPatientsFromFile)
+from snapshot import loadPatients
+from synthetic import writePatientsFile
+
+# Number of visits added or patients deleted by the cases that change data
+CHANGES = 100
+
+
+class Context:
+    """
+    The generated file of one size, and a loaded copy of it shared by read-only cases.
+    """
+
+    def __init__(self, directory, fileName, numVisits):
+        self.directory = directory
+        self.fileName = fileName
+        self.numVisits = numVisits
+        self._patients = None
+        self._copies = 0
+
+    @property
+    def patients(self):
+        if self._patients is None:
+            self._patients = quiet(readPatientsFromFile, self.fileName)
+        return self._patients
+
+    def somePatient(self):
+        """
+        Returns the ID of the patient with the most visits.
+        """
+        return max(self.patients, key=lambda patientId: len(self.patients[patientId]))
+
+    def copy(self):
+        """
+        Returns the name of a fresh copy of the generated file, without log or snapshot.
+        """
+        self._copies += 1
+        copyName = os.path.join(self.directory, f"copy{self._copies}.txt")
+        shutil.copyfile(self.fileName, copyName)
+        return copyName
+
+    def cleanCopies(self):
+        for name in os.listdir(self.directory):
+            if name.startswith('copy'):
+                os.remove(os.path.join(self.directory, name))
+
+
+def quiet(function, *args):
+    """
+    Calls function(*args) with its printed output discarded.
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return function(*args)
+
+
+def _loadFresh(ctx):
+    fileName = ctx.copy()
+    return lambda: readPatientsFromFile(fileName)
+
+
+def _loadSnapshotCold(ctx):
+    fileName = ctx.copy()
+    return lambda: loadPatients(fileName)
+
+
+def _loadSnapshotWarm(ctx):
+    fileName = ctx.copy()
+    quiet(loadPatients, fileName)
+    return lambda: loadPatients(fileName)
+
+
+def _addVisits(ctx):
+    fileName = ctx.copy()
+    patients = quiet(readPatientsFromFile, fileName)
+    patientIds = list(patients)[:CHANGES]
+
+    def run():
+        for i, patientId in enumerate(patientIds):
+            addPatientData(patients, patientId, '2025-01-%02d' % (i % 28 + 1), 37.2, 72, 16, 120, 80, 97, fileName)
+    return run
+
+
+def _addBatch(ctx):
+    fileName = ctx.copy()
+    patients = quiet(readPatientsFromFile, fileName)
+    visits = [(patientId, '2025-02-01', 37.2, 72, 16, 120, 80, 97) for patientId in list(patients)[:CHANGES]]
+    return lambda: addPatientVisits(patients, visits, fileName)
+
+
+def _deletePatients(ctx):
+    fileName = ctx.copy()
+    patients = quiet(readPatientsFromFile, fileName)
+    patientIds = list(patients)[:CHANGES]
+
+    def run():
+        for patientId in patientIds:
+            deleteAllVisitsOfPatient(patients, patientId, fileName)
+    return run
+
+
+def _statsOne(ctx):
+    patientId = ctx.somePatient()
+    return lambda: displayStats(ctx.patients, patientId)
+
+
+def _displayOne(ctx):
+    patientId = ctx.somePatient()
+    return lambda: displayPatientData(ctx.patients, patientId)
+
+
+def _followUp(ctx):
+    fileName = ctx.copy()
+    patients = quiet(readPatientsFromFile, fileName)
+    return lambda: findPatientsWhoNeedFollowUp(patients)
+
+
+# (name, setup) pairs; setup(ctx) prepares the state of one run and returns the function to time
+CASES = (
+    ('readPatientsFromFile', _loadFresh),
+    ('loadPatients (no snapshot)', _loadSnapshotCold),
+    ('loadPatients (snapshot)', _loadSnapshotWarm),
+    ('readPatientsBulk', lambda ctx: lambda: readPatientsBulk(ctx.fileName)),
+    ('displayStats (all)', lambda ctx: lambda: displayStats(ctx.patients, 0)),
+    ('displayStats (one)', _statsOne),
+    ('displayPatientData (one)', _displayOne),
+    ('findVisitsByDate (year)', lambda ctx: lambda: findVisitsByDate(ctx.patients, 2020)),
+    ('findVisitsByDate (year, month)', lambda ctx: lambda: findVisitsByDate(ctx.patients, 2020, 6)),
+    ('findVisitsByDate (month)', lambda ctx: lambda: findVisitsByDate(ctx.patients, None, 6)),
+    ('findPatientsWhoNeedFollowUp', _followUp),
+    (f'addPatientData (x{CHANGES})', _addVisits),
+    (f'addPatientVisits ({CHANGES})', _addBatch),
+    (f'deleteAllVisitsOfPatient (x{CHANGES})', _deletePatients),
+)
+
+
+def timeCase(ctx, setup, repeat):
+    """
+    Returns the run times in seconds of a case, each on freshly set up state.
+    """
+    times = []
+    for _ in range(repeat):
+        run = quiet(setup, ctx)
+        gc.collect()
+        start = time.perf_counter()
+        quiet(run)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def peakMemory(ctx, setup):
+    """
+    Returns the peak number of bytes allocated by one run of a case, beyond what was
+    allocated before it.
+    """
+    run = quiet(setup, ctx)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        quiet(run)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak - before
+
+
+def gitCommit():
+    """
+    Returns the commit the working tree is at, with '+' if it has changes, or None.
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                               capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+    return (commit + '+' if dirty else commit) or None
+
+
+def runSuite(sizes, repeat=3, seed=0, invalidRate=0.0, caseNames=None, report=print):
+    """
+    Runs the benchmark cases on generated files of the given numbers of visits.
+
+    Returns the results as a dictionary ready to be written as JSON.
+    """
+    cases = [case for case in CASES if caseNames is None or case[0] in caseNames]
+    results = []
+    for numVisits in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            fileName = os.path.join(directory, 'patients.txt')
+            start = time.perf_counter()
+            size = writePatientsFile(fileName, numVisits, seed, invalidRate)
+            report(f"{numVisits:,} visits ({size:,} bytes), generated in {time.perf_counter() - start:.1f} s")
+            report(f"  {'case':38} {'first':>12} {'best':>12} {'median':>12} {'peak memory':>14}")
+            ctx = Context(directory, fileName, numVisits)
+            for name, setup in cases:
+                times = timeCase(ctx, setup, repeat)
+                peak = peakMemory(ctx, setup)
+                ctx.cleanCopies()
+                results.append({'case': name, 'visits': numVisits, 'first': times[0], 'best': min(times),
+                                'median': statistics.median(times), 'runs': len(times), 'peakBytes': peak})
+                report(f"  {name:38} {times[0]:10.4f} s {min(times):10.4f} s {statistics.median(times):10.4f} s "
+                       f"{peak / 2 ** 20:10.1f} MiB")
+    return {
+        'suite': 'bench_suite',
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': gitCommit(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': seed,
+        'invalidRate': invalidRate,
+        'results': results,
+    }
+
+
+def compareResults(earlier, current, tolerance=0.1, report=print):
+    """
+    Prints the ratio of every time and peak memory of current to earlier results.
+
+    Returns the number of cases slower than earlier by more than tolerance (a fraction).
+    """
+    before = {(result['case'], result['visits']): result for result in earlier['results']}
+    report(f"Compared with {earlier.get('commit') or 'an earlier run'} of {earlier.get('date', '?')}:")
+    slower = 0
+    for result in current['results']:
+        old = before.get((result['case'], result['visits']))
+        if old is None:
+            continue
+        ratio = result['best'] / old['best'] if old['best'] else float('inf')
+        memory = result['peakBytes'] / old['peakBytes'] if old['peakBytes'] else float('nan')
+        flag = ''
+        if ratio > 1 + tolerance:
+            slower += 1
+            flag = '  SLOWER'
+        elif ratio < 1 - tolerance:
+            flag = '  faster'
+        report(f"  {result['case']:38} {result['visits']:>12,}  time x{ratio:6.2f}  memory x{memory:6.2f}{flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the public patient functions on generated files.")
+    parser.add_argument('--sizes', default='1e3,1e4,1e5',
+                        help="comma-separated numbers of visits, from 1e3 to 1e8")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--invalid-rate', type=float, default=0.0)
+    parser.add_argument('--cases', help="comma-separated case names to run (default: all)")
+    parser.add_argument('--output', help="file to write the results to, as JSON")
+    parser.add_argument('--compare', help="results file of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="fraction by which a case may be slower before --compare flags it")
+    args = parser.parse_args()
+
+    sizes = [int(float(size)) for size in args.sizes.split(',')]
+    caseNames = set(name.strip() for name in args.cases.split(',')) if args.cases else None
+    if caseNames:
+        unknown = caseNames - {name for name, _ in CASES}
+        if unknown:
+            parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    results = runSuite(sizes, args.repeat, args.seed, args.invalid_rate, caseNames)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            earlier = json.load(file)
+        if compareResults(earlier, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
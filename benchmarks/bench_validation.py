@@ -0,0 +1,72 @@
+"""
+Times the validation of visits (see visit_validation) on generated files with a growing
+share of invalid lines (see synthetic.py): the block parser of the loaders (parseLines),
+which converts and checks whole columns, against parsing line by line (parseFields),
+as the loaders did for every block with a field that is not a number. Also times the
+check of single visits by the writers, valid and invalid.
+
+Usage: python benchmarks/bench_validation.py [number of visits]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bulk_ingest import _parseLinesScalar, iterLineBlocks, parseLines
+from synthetic import writePatientsFile
+from visit_validation import checkVisit
+
+# Shares of invalid lines of the generated files
+INVALID_RATES = (0.0, 0.0001, 0.01, 0.1)
+
+# Visits checked by the writer case: a valid one, and one per kind of rejection
+WRITER_VISITS = (
+    ("valid", (12, '2024-02-29', 37.2, 72, 16, 120, 80, 97)),
+    ("patient ID", ('x', '2024-02-29', 37.2, 72, 16, 120, 80, 97)),
+    ("calendar date", (12, '2023-02-29', 37.2, 72, 16, 120, 80, 97)),
+    ("oxygen saturation", (12, '2024-02-29', 37.2, 72, 16, 120, 80, 101)),
+    ("not a number", (12, '2024-02-29', 37.2, 'seventy', 16, 120, 80, 97)),
+)
+
+# Number of calls per writer case
+WRITER_CALLS = 100_000
+
+
+def timeParser(parse, fileName):
+    """
+    Returns (seconds, number of rejected lines) of parsing a file block by block.
+    """
+    rejected = []
+    start = time.perf_counter()
+    line_num = 1
+    for lines, _ in iterLineBlocks(fileName):
+        parse(lines, line_num, rejected.append)
+        line_num += len(lines)
+    return time.perf_counter() - start, len(rejected)
+
+
+def main():
+    numVisits = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{numVisits:,} visits")
+        print(f"  {'invalid lines':14} {'rejected':>9} {'columns':>10} {'line by line':>14}")
+        for rate in INVALID_RATES:
+            fileName = os.path.join(directory, f'patients-{rate}.txt')
+            writePatientsFile(fileName, numVisits, invalidRate=rate)
+            columns, rejected = timeParser(parseLines, fileName)
+            lines = timeParser(_parseLinesScalar, fileName)[0]
+            print(f"  {rate:14.2%} {rejected:9,} {columns:8.3f} s {lines:12.3f} s")
+
+    print(f"checkVisit, {WRITER_CALLS:,} calls")
+    for name, visit in WRITER_VISITS:
+        start = time.perf_counter()
+        for _ in range(WRITER_CALLS):
+            checkVisit(*visit)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:20} {elapsed / WRITER_CALLS * 1e6:8.2f} us per visit")
+
+
+if __name__ == '__main__':
+    main()
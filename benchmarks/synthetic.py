@@ -0,0 +1,148 @@
+"""
+Seeded generator of realistic patients files for benchmarks.
+
+Unlike writeSyntheticFile in bench_ingest, which draws every line independently, the
+files written here look like the history of a clinic:
+
+    - the number of visits per patient follows a long-tailed distribution (most patients
+      come a few times, some many times), with meanVisits visits on average;
+    - every patient has a baseline for each vital sign, and its visits vary around it;
+    - a patient's visits are dated in increasing order, a week to half a year apart;
+    - visits of many patients are interleaved in date order, as they would be appended.
+
+Patients are generated in groups of GROUP_SIZE whose visits are sorted by date and
+written out, so memory stays bounded however large the file is (up to 10^8 visits and
+beyond, at roughly 100,000 lines a second).
+
+With invalidRate, that fraction of lines is replaced by a line the loaders reject: a
+wrong number of fields, a value out of range, a malformed date or a non-numeric field.
+
+The same arguments and seed always produce the same file.
+
+Usage: python benchmarks/synthetic.py FILE NUMBER_OF_VISITS [--seed N] [--invalid-rate R] [--mean-visits M]
+"""
+import argparse
+import datetime
+import random
+
+# Number of patients whose visits are interleaved and written together
+GROUP_SIZE = 20000
+
+# First and last day of generated visits
+FIRST_DAY = datetime.date(2015, 1, 1).toordinal()
+LAST_DAY = datetime.date(2024, 12, 31).toordinal()
+
+# (mean of patient baselines, spread of baselines, spread of visits around a baseline,
+#  lowest valid value, highest valid value) of each vital sign, in visit order
+VITALS = (
+    (36.9, 0.35, 0.35, 35.0, 42.0),
+    (76, 10, 8, 30, 180),
+    (16, 2, 2, 5, 40),
+    (122, 14, 10, 70, 200),
+    (78, 8, 6, 40, 120),
+    (97, 1.5, 1.2, 70, 100),
+)
+
+# Templates of invalid lines, filled with a patient ID and a date
+INVALID_LINES = (
+    "%d,%s,37.0,70,16,120",                  # too few fields
+    "%d,%s,37.0,70,16,120,80,97,1",          # too many fields
+    "%d,%s,45.5,70,16,120,80,97",            # temperature out of range
+    "%d,%s,37.0,250,16,120,80,97",           # heart rate out of range
+    "%d,%s,37.0,70,16,120,80,101",           # oxygen saturation out of range
+    "%d,%s,37.0,seventy,16,120,80,97",       # non-numeric field
+    "%d,%s/1,37.0,70,16,120,80,97",          # malformed date
+)
+
+
+def _visitCount(rng, meanVisits):
+    """
+    Draws a number of visits from a long-tailed distribution with the given mean.
+    """
+    return 1 + int(rng.expovariate(1 / max(meanVisits - 1, 1e-9))) if meanVisits > 1 else 1
+
+
+def _patientVisits(rng, patientId, count, dates):
+    """
+    Returns the (day, line) pairs of one patient's visits.
+    """
+    baselines = [rng.gauss(mean, spread) for mean, spread, _, _, _ in VITALS]
+    day = rng.randint(FIRST_DAY, LAST_DAY)
+    visits = []
+    for _ in range(count):
+        values = []
+        for baseline, (_, _, noise, low, high) in zip(baselines, VITALS):
+            values.append(min(max(rng.gauss(baseline, noise), low), high))
+        date = dates.get(day)
+        if date is None:
+            date = dates[day] = datetime.date.fromordinal(day).isoformat()
+        visits.append((day, "%d,%s,%.1f,%d,%d,%d,%d,%d\n" % (patientId, date, *values)))
+        day = min(day + rng.randint(7, 180), LAST_DAY)
+    return visits
+
+
+def generateLines(numVisits, seed=0, invalidRate=0.0, meanVisits=5.0):
+    """
+    Yields the lines of a generated patients file, each ending with a line break.
+
+    numVisits: The number of lines to generate.
+    seed: The seed of the random generator.
+    invalidRate: The fraction of lines to replace by invalid ones.
+    meanVisits: The average number of visits per patient.
+    """
+    rng = random.Random(seed)
+    dates = {}
+    patientId = 0
+    remaining = numVisits
+    while remaining > 0:
+        group = []
+        for _ in range(GROUP_SIZE):
+            if remaining <= 0:
+                break
+            patientId += 1
+            count = min(_visitCount(rng, meanVisits), remaining)
+            group.extend(_patientVisits(rng, patientId, count, dates))
+            remaining -= count
+        group.sort(key=lambda visit: visit[0])
+        for day, line in group:
+            if invalidRate and rng.random() < invalidRate:
+                line = rng.choice(INVALID_LINES) % (rng.randint(1, patientId), dates[day]) + "\n"
+            yield line
+
+
+def writePatientsFile(fileName, numVisits, seed=0, invalidRate=0.0, meanVisits=5.0):
+    """
+    Writes a generated patients file; see generateLines for the arguments.
+
+    Returns the number of bytes written.
+    """
+    size = 0
+    buffer = []
+    with open(fileName, 'w') as file:
+        for line in generateLines(numVisits, seed, invalidRate, meanVisits):
+            buffer.append(line)
+            if len(buffer) >= 100000:
+                chunk = ''.join(buffer)
+                file.write(chunk)
+                size += len(chunk)
+                buffer = []
+        chunk = ''.join(buffer)
+        file.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a generated patients file.")
+    parser.add_argument('fileName')
+    parser.add_argument('numVisits', type=float, help="number of visits, e.g. 1e6")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--invalid-rate', type=float, default=0.0)
+    parser.add_argument('--mean-visits', type=float, default=5.0)
+    args = parser.parse_args()
+    size = writePatientsFile(args.fileName, int(args.numVisits), args.seed, args.invalid_rate, args.mean_visits)
+    print(f"Wrote {int(args.numVisits):,} lines ({size:,} bytes) to {args.fileName}")
+
+
+if __name__ == '__main__':
+    main()
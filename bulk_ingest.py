@@ -0,0 +1,337 @@
+import gc
+from array import array
+from itertools import accumulate, chain, compress, repeat
+
+from instrumentation import metrics
+from patient_records import PatientRecords
+from visit_record import Visit
+from visit_log import isDeleted, readTombstones
+from visit_validation import (NOT_A_NUMBER, VALID, VITAL_CODES, WRONG_FIELD_COUNT, convertColumn, dateCodes,
+                              parseFields, rangeCodes, rejectionMessage)
+
+# Number of bytes read from the file per block. The split fields of a block take about
+# twelve times its size, so larger blocks only raise the peak memory of a load
+BLOCK_SIZE = 1 << 18
+
+class VisitColumns:
+    """
+    Parsed visits held column by column: one array per field plus the line number
+    each visit was read from.
+    """
+
+    __slots__ = ('lineNumbers', 'ids', 'dates', 'temps', 'heartRates', 'respRates',
+                 'systolic', 'diastolic', 'spo2')
+
+    def __init__(self):
+        self.lineNumbers = array('l')
+        self.ids = array('l')
+        self.dates = []
+        self.temps = array('d')
+        self.heartRates = array('h')
+        self.respRates = array('h')
+        self.systolic = array('h')
+        self.diastolic = array('h')
+        self.spo2 = array('h')
+
+    def vitals(self):
+        """
+        Returns the vital sign columns in visit order.
+        """
+        return (self.temps, self.heartRates, self.respRates,
+                self.systolic, self.diastolic, self.spo2)
+
+    def extend(self, other):
+        """
+        Appends all visits of another VisitColumns to this one.
+        """
+        for name in self.__slots__:
+            getattr(self, name).extend(getattr(other, name))
+
+    def compress(self, keep):
+        """
+        Returns a new VisitColumns holding only the visits whose entry in keep is true.
+        """
+        kept = VisitColumns()
+        keep = list(keep)
+        for name in self.__slots__:
+            column = getattr(self, name)
+            kept_values = compress(column, keep)
+            setattr(kept, name, array(column.typecode, kept_values) if isinstance(column, array) else list(kept_values))
+        return kept
+
+    def without(self, rows):
+        """
+        Returns a new VisitColumns without the visits at some rows, copying the runs of
+        visits between them at once, so the cost grows with the rows dropped.
+
+        rows: The row numbers to drop, in increasing order.
+        """
+        kept = VisitColumns()
+        starts = [row + 1 for row in rows]
+        starts.insert(0, 0)
+        ends = list(rows)
+        ends.append(len(self))
+        for name in self.__slots__:
+            column = getattr(self, name)
+            target = getattr(kept, name)
+            for start, end in zip(starts, ends):
+                target.extend(column[start:end])
+        return kept
+
+    def visits(self):
+        """
+        Returns an iterator of (patientId, Visit) pairs.
+        """
+        return zip(self.ids, map(Visit, self.dates, *self.vitals()))
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def iterLineBlocks(fileName, blockSize=BLOCK_SIZE, start=0, withOffsets=False, end=None):
+    """
+    Reads a text file in large blocks and yields lists of complete lines.
+
+    fileName: The name of the file to read.
+    blockSize: The number of bytes to read per block.
+    start: The byte offset to start reading at; it should be the start of a line.
+    withOffsets: If True, also compute the byte offset at which each line starts.
+    end: The byte offset to stop reading at, or None to read to the end of the file;
+         it should be the start of a line.
+    Yields tuples (lines, offsets): the lines without their '\n' line endings, and an
+    array of their starting byte offsets (None unless withOffsets is set).
+    """
+    with open(fileName, 'rb') as file:
+        file.seek(start)
+        position = start
+        carry = b''
+        remaining = end - start if end is not None else None
+        while True:
+            if remaining is None:
+                chunk = file.read(blockSize)
+            else:
+                chunk = file.read(min(blockSize, remaining))
+                remaining -= len(chunk)
+            if not chunk:
+                break
+            metrics.count('load.bytesRead', len(chunk))
+            pieces = (carry + chunk).split(b'\n')
+            carry = pieces.pop()
+            if not pieces:
+                continue
+            offsets = None
+            if withOffsets:
+                offsets = array('q', accumulate(map((1).__add__, map(len, pieces)), initial=position))
+                position = offsets.pop()
+            yield b'\n'.join(pieces).decode().split('\n'), offsets
+        if carry:
+            yield [carry.decode()], array('q', [position]) if withOffsets else None
+
+
+def iterColumnBlocks(fileName, blockSize=BLOCK_SIZE, report=print, start=0, firstLine=1, end=None):
+    """
+    Reads a patients file block by block and yields the valid visits of each block.
+
+    Lines removed by the deletion log of the file (see visit_log) are dropped.
+
+    fileName: The name of the file to read patient data from.
+    blockSize: The number of bytes to read per block.
+    report: A function called with each error message.
+    start: The byte offset to start reading at.
+    firstLine: The line number of the line at start.
+    end: The byte offset to stop reading at, or None to read to the end of the file.
+    Yields a VisitColumns per block. Raises FileNotFoundError if the file does not exist.
+    """
+    cutoffs, _ = readTombstones(fileName)
+    line_num = firstLine
+    for lines, offsets in iterLineBlocks(fileName, blockSize, start, bool(cutoffs), end):
+        columns = parseLines(lines, line_num, report)
+        if cutoffs and not cutoffs.keys().isdisjoint(columns.ids):
+            columns = columns.compress(
+                not isDeleted(cutoffs, patientId, offsets[row_line - line_num])
+                for patientId, row_line in zip(columns.ids, columns.lineNumbers))
+        line_num += len(lines)
+        if metrics.enabled:
+            metrics.count('load.lines', len(lines))
+            metrics.count('load.visits', len(columns))
+        yield columns
+
+
+def _parseLinesScalar(lines, first_line_num, report):
+    """
+    Parses lines one at a time with parseFields. Used for blocks with values that do not
+    fit the column arrays, so that messages match readPatientsFromFile.
+    """
+    columns = VisitColumns()
+    vitals = columns.vitals()
+    codes = []
+    for line_num, line in enumerate(lines, start=first_line_num):
+        code, detail = parseFields(line.strip().split(','))
+        if code != VALID:
+            codes.append(code)
+            report(rejectionMessage(code, detail, line_num))
+            continue
+        patient_id, date, *values = detail
+        columns.lineNumbers.append(line_num)
+        columns.ids.append(patient_id)
+        columns.dates.append(date)
+        for column, value in zip(vitals, values):
+            column.append(value)
+    if codes and metrics.enabled:
+        metrics.countRejections(codes)
+    return columns
+
+
+def _reportErrors(errors, rejected, wrongFieldCounts, report):
+    """
+    Reports the errors of a block in line order and counts the rejected lines.
+
+    errors: A dictionary of line number -> error message.
+    rejected: A dictionary of row -> rejection code of the lines with 8 fields.
+    wrongFieldCounts: The number of lines rejected for their number of fields.
+    """
+    for line_num in sorted(errors):
+        report(errors[line_num])
+    if errors and metrics.enabled:
+        metrics.countRejections(chain(repeat(WRONG_FIELD_COUNT, wrongFieldCounts), rejected.values()))
+
+
+def parseLines(lines, first_line_num=1, report=print):
+    """
+    Parses a block of patient lines column by column.
+
+    Field counts, type conversions, date and range checks are applied to whole columns
+    rather than to one line at a time (see visit_validation). Invalid lines are reported
+    through report with the same messages readPatientsFromFile prints, in line order,
+    and are dropped.
+
+    lines: The lines to parse, without line endings.
+    first_line_num: The line number of the first line.
+    report: A function called with each error message.
+    Returns a VisitColumns with the valid visits.
+    """
+    errors = {}
+
+    # Check the field count of every line; the common case is that all lines have 8
+
+    counts = list(map(str.count, lines, repeat(',')))
+    if counts.count(7) == len(counts):
+        good = lines
+        line_nums = array('l', range(first_line_num, first_line_num + len(lines)))
+    else:
+        for i, count in enumerate(counts):
+            if count != 7:
+                errors[first_line_num + i] = f"Invalid number of fields ({count + 1}) in line: {first_line_num + i}"
+        has_eight = list(map((7).__eq__, counts))
+        good = list(compress(lines, has_eight))
+        line_nums = array('l', compress(range(first_line_num, first_line_num + len(lines)), has_eight))
+
+    columns = VisitColumns()
+    if not good:
+        _reportErrors(errors, {}, len(lines), report)
+        return columns
+
+    # Convert whole columns at once; a field that is not a number only costs its own
+    # column a second, field by field pass. Like a line, a row is reported for the first
+    # field that fails, in field order, and only then for its date or a vital sign out
+    # of range.
+
+    fields = ','.join(good).split(',')
+    rejected = {}
+    try:
+        columns.ids, failed = convertColumn(fields[0::8], int, 'l')
+        rejected.update(failed)
+        columns.temps, failed = convertColumn(fields[2::8], float, 'd')
+        for row, message in failed.items():
+            rejected.setdefault(row, message)
+        for index, name in enumerate(('heartRates', 'respRates', 'systolic', 'diastolic', 'spo2'), start=3):
+            column, failed = convertColumn(fields[index::8], int, 'h')
+            setattr(columns, name, column)
+            for row, message in failed.items():
+                rejected.setdefault(row, message)
+    except OverflowError:
+        return _parseLinesScalar(lines, first_line_num, report)
+    columns.dates = fields[1::8]
+    columns.lineNumbers = line_nums
+
+    for row, message in rejected.items():
+        errors[line_nums[row]] = rejectionMessage(NOT_A_NUMBER, message, line_nums[row])
+        rejected[row] = NOT_A_NUMBER
+    for row, code in dateCodes(columns.dates).items():
+        if row not in rejected:
+            rejected[row] = code
+            errors[line_nums[row]] = rejectionMessage(code, columns.dates[row], line_nums[row])
+    vitals = columns.vitals()
+    for row, code in rangeCodes(vitals).items():
+        if row not in rejected:
+            rejected[row] = code
+            value = vitals[VITAL_CODES.index(code)][row]
+            errors[line_nums[row]] = rejectionMessage(code, value, line_nums[row])
+
+    _reportErrors(errors, rejected, len(lines) - len(good), report)
+    if rejected:
+        columns = columns.without(sorted(rejected))
+    return columns
+
+
+def readColumns(fileName, blockSize=BLOCK_SIZE, report=print, start=0, firstLine=1, end=None):
+    """
+    Reads and validates a whole patients file into a single VisitColumns.
+
+    fileName: The name of the file to read patient data from.
+    blockSize: The number of bytes to read per block.
+    report: A function called with each error message.
+    start: The byte offset to start reading at.
+    firstLine: The line number of the line at start.
+    end: The byte offset to stop reading at, or None to read to the end of the file.
+    Returns a VisitColumns. If the file does not exist, the columns are empty.
+    """
+    columns = VisitColumns()
+    try:
+        for block in iterColumnBlocks(fileName, blockSize, report, start, firstLine, end):
+            columns.extend(block)
+    except FileNotFoundError:
+        report(f"The file '{fileName}' could not be found.")
+    return columns
+
+
+def readPatientsBulk(fileName, blockSize=BLOCK_SIZE):
+    """
+    Reads patient data from a plaintext file using the block-wise column parser.
+
+    fileName: The name of the file to read patient data from.
+    blockSize: The number of bytes to read per block.
+    Returns the same PatientRecords dictionary of patient IDs to lists of visits as
+    readPatientsFromFile, and reports invalid lines with the same messages.
+    """
+    patients = {}
+    try:
+        groupVisits(iterColumnBlocks(fileName, blockSize), patients)
+    except FileNotFoundError:
+        print(f"The file '{fileName}' could not be found.")
+    return PatientRecords(patients)
+
+
+def groupVisits(blocks, patients):
+    """
+    Adds the visits of VisitColumns blocks to a dictionary of patient IDs to lists of
+    visits, in block order.
+
+    blocks: An iterable of VisitColumns.
+    patients: The dictionary to add the visits to.
+    """
+    # Creating millions of visits triggers repeated garbage collection passes
+    # over objects that can never be garbage, so collection is paused while loading
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for block in blocks:
+            for patient_id, visit in block.visits():
+                visits = patients.get(patient_id)
+                if visits is None:
+                    patients[patient_id] = [visit]
+                else:
+                    visits.append(visit)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
@@ -0,0 +1,236 @@
+"""
+Command line interface to the Health Information System, for scripts and automation.
+
+Every option of the interactive menu is a subcommand, as are trends over years and months:
+
+    python cli.py stats [PATIENT_ID] [--format text|json]
+    python cli.py show [PATIENT_ID] [--format text|csv|jsonl] [--offset N] [--limit N]
+    python cli.py add PATIENT_ID DATE TEMP HR RR SBP DBP SPO2
+    python cli.py find-visits [--year YYYY] [--month MM] [--format text|csv|jsonl] [--offset N] [--limit N]
+    python cli.py followup [--rules FILE] [--min-severity low|medium|high]
+    python cli.py trends [--from YEAR] [--to YEAR] [--monthly] [--format text|json]
+    python cli.py delete PATIENT_ID
+
+--batch FILE ('-' for standard input) instead reads one subcommand per line and answers
+all of them against a single load of the patients file, so that many queries pay for
+one process start and one parse. Blank lines and lines starting with '#' are skipped,
+and a line that fails is reported without stopping the batch.
+
+--file selects the patients file (patients.txt by default), or a SQLite database if its
+name ends in .db, .sqlite or .sqlite3 (see storage). Running main_22BECD87.py with
+arguments is the same as running this module.
+
+A single command about one patient (stats or show with a PATIENT_ID, add, delete) on a
+text file reads only that patient's lines, through the patient index kept next to the
+file (see patient_index), instead of loading the whole file.
+"""
+import argparse
+import json
+import shlex
+import sys
+
+from main_22BECD87 import (addPatientData, deleteAllVisitsOfPatient, displayPatientData, displayStats,
+                           displayTrends, findPatientsWhoNeedFollowUp, findVisitsByDate)
+from followup_rules import DEFAULT_RULES, SEVERITIES, loadRules
+from instrumentation import entryPoint
+from monthly_rollups import vitalTrends
+from patient_index import IndexedPatients
+from storage import SQLITE_SUFFIXES, openPatients, storageFor
+from visit_render import FORMATS, FORMAT_TEXT, renderPatients, renderVisitList
+from vital_stats import computeStats
+
+
+class _CommandParser(argparse.ArgumentParser):
+    """
+    An ArgumentParser that raises instead of exiting, so one bad line of a batch does
+    not end it.
+    """
+
+    def error(self, message):
+        raise ValueError(f"{self.prog}: {message}")
+
+
+def buildParser():
+    """
+    Returns the parser of the subcommands, shared by the command line and batch lines.
+    """
+    parser = _CommandParser(prog='cli.py', description="Query and update the patients file.")
+    commands = parser.add_subparsers(dest='command', required=True, parser_class=_CommandParser)
+
+    stats = commands.add_parser('stats', help="average vital signs of all patients or one patient")
+    stats.add_argument('patientId', nargs='?', type=int, default=0)
+    stats.add_argument('--format', choices=(FORMAT_TEXT, 'json'), default=FORMAT_TEXT,
+                       help="json adds minimum, maximum, standard deviation and percentiles")
+
+    show = commands.add_parser('show', help="visits of all patients or one patient")
+    show.add_argument('patientId', nargs='?', type=int, default=0)
+    show.add_argument('--format', choices=FORMATS, default=FORMAT_TEXT)
+    show.add_argument('--offset', type=int, default=0, help="number of visits to skip")
+    show.add_argument('--limit', type=int, default=None, help="largest number of visits to show")
+
+    add = commands.add_parser('add', help="add a visit")
+    add.add_argument('patientId', type=int)
+    add.add_argument('date')
+    add.add_argument('temp', type=float)
+    for name in ('hr', 'rr', 'sbp', 'dbp', 'spo2'):
+        add.add_argument(name, type=int)
+
+    find = commands.add_parser('find-visits', help="visits in a year, a month, or both")
+    find.add_argument('--year', type=int, default=None)
+    find.add_argument('--month', type=int, default=None)
+    find.add_argument('--format', choices=FORMATS, default=FORMAT_TEXT)
+    find.add_argument('--offset', type=int, default=0, help="number of visits to skip")
+    find.add_argument('--limit', type=int, default=None, help="largest number of visits to show")
+
+    followup = commands.add_parser('followup', help="patients whose last visit needs a follow-up")
+    followup.add_argument('--rules', help="JSON file of follow-up rules (see followup_rules); "
+                                          "the severity of each patient is then shown")
+    followup.add_argument('--min-severity', choices=SEVERITIES, default=None,
+                          help="only patients matching rules of this severity or higher")
+
+    trends = commands.add_parser('trends', help="average vital signs and follow-ups per year or month")
+    trends.add_argument('--from', dest='startYear', type=int, default=None, metavar='YEAR')
+    trends.add_argument('--to', dest='endYear', type=int, default=None, metavar='YEAR')
+    trends.add_argument('--monthly', action='store_true', help="one line per month rather than per year")
+    trends.add_argument('--format', choices=(FORMAT_TEXT, 'json'), default=FORMAT_TEXT,
+                        help="json adds minimum, maximum and standard deviation")
+
+    delete = commands.add_parser('delete', help="delete all visits of a patient")
+    delete.add_argument('patientId', type=int)
+    return parser
+
+
+def concernsOnePatient(args):
+    """
+    Returns True if a parsed subcommand reads or changes the visits of one patient only.
+    """
+    return args.command in ('add', 'delete') or args.command in ('stats', 'show') and args.patientId != 0
+
+
+def runCommand(patients, args, fileName):
+    """
+    Runs one parsed subcommand against loaded patient data, printing its result.
+
+    patients: The loaded patient data.
+    args: The parsed arguments of the subcommand.
+    fileName: The name of the patients file, for commands that change it.
+    """
+    if args.command == 'stats':
+        if args.format == 'json':
+            patientIds = None if args.patientId == 0 else [args.patientId]
+            print(json.dumps(computeStats(patients, patientIds).asDict()))
+        else:
+            displayStats(patients, args.patientId)
+    elif args.command == 'show':
+        if args.format == FORMAT_TEXT and not args.offset and args.limit is None:
+            displayPatientData(patients, args.patientId)
+        elif args.patientId and args.patientId not in patients:
+            print(f"Patient with ID {args.patientId} not found.")
+        else:
+            patientIds = [args.patientId] if args.patientId else None
+            renderPatients(patients, patientIds, args.format, sys.stdout, args.offset, args.limit)
+    elif args.command == 'add':
+        addPatientData(patients, args.patientId, args.date, args.temp, args.hr, args.rr,
+                       args.sbp, args.dbp, args.spo2, fileName)
+    elif args.command == 'find-visits':
+        visits = findVisitsByDate(patients, args.year, args.month)
+        if visits:
+            renderVisitList(visits, args.format, sys.stdout, args.offset, args.limit)
+        elif args.format == FORMAT_TEXT:
+            print("No visits found for the specified year/month.")
+    elif args.command == 'followup':
+        if args.rules or args.min_severity:
+            rules = loadRules(args.rules) if args.rules else DEFAULT_RULES
+            followup_patients = ["%s (%s)" % match for match in rules.screen(patients, args.min_severity)]
+        else:
+            followup_patients = findPatientsWhoNeedFollowUp(patients)
+        if followup_patients:
+            print("Patients who need follow-up visits:")
+            print('\n'.join(map(str, followup_patients)))
+        else:
+            print("No patients found who need follow-up visits.")
+    elif args.command == 'trends':
+        if args.format == 'json':
+            trends = vitalTrends(patients, args.startYear, args.endYear, args.monthly)
+            print(json.dumps([dict(period=period, **rollup.asDict()) for period, rollup in trends]))
+        else:
+            displayTrends(patients, args.startYear, args.endYear, args.monthly)
+    elif args.command == 'delete':
+        deleteAllVisitsOfPatient(patients, args.patientId, fileName)
+
+
+def runBatch(patients, lines, fileName, parser=None):
+    """
+    Runs one subcommand per line against loaded patient data.
+
+    patients: The loaded patient data.
+    lines: An iterable of command lines, e.g. an open file.
+    fileName: The name of the patients file, for commands that change it.
+    parser: The parser to use; built with buildParser if not given.
+    return: The number of lines that failed.
+    """
+    parser = parser or buildParser()
+    failures = 0
+    for line_num, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            runCommand(patients, parser.parse_args(shlex.split(line)), fileName)
+        except ValueError as e:
+            failures += 1
+            print(f"Error in batch line {line_num}: {e}")
+    sys.stdout.flush()
+    return failures
+
+
+@entryPoint
+def main(argv=None):
+    """
+    Runs the command line interface.
+
+    argv: The arguments, without the program name; defaults to sys.argv[1:].
+    return: The exit status: 0 on success, 1 if a batch line failed, 2 for invalid arguments.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    options = argparse.ArgumentParser(prog='cli.py', add_help=False)
+    options.add_argument('--file', default='patients.txt')
+    options.add_argument('--batch', metavar='FILE')
+    known, rest = options.parse_known_args(argv)
+
+    parser = buildParser()
+    if known.batch is None:
+        try:
+            args = parser.parse_args(rest)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            parser.print_usage(sys.stderr)
+            return 2
+    elif rest:
+        print("cli.py: --batch takes no subcommand", file=sys.stderr)
+        return 2
+
+    if known.batch is None and concernsOnePatient(args) and not known.file.endswith(SQLITE_SUFFIXES):
+        patients = IndexedPatients(known.file)
+    else:
+        patients = openPatients(known.file)
+    try:
+        if known.batch is None:
+            try:
+                runCommand(patients, args, known.file)
+            except ValueError as e:
+                print(e)
+                return 1
+            return 0
+        if known.batch == '-':
+            return 1 if runBatch(patients, sys.stdin, known.file, parser) else 0
+        with open(known.batch) as lines:
+            return 1 if runBatch(patients, lines, known.file, parser) else 0
+    finally:
+        storageFor(patients, known.file).close()
+        if isinstance(patients, IndexedPatients):
+            patients.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+Shared access to a patients collection from many threads.
+
+The patient functions of main_22BECD87 read and change a collection without any
+synchronization, so a query that iterates the collection while another thread deletes
+a patient fails with "dictionary changed size during iteration", or reads a visit list
+half way through an append. SharedPatients puts a collection behind a lock that lets
+any number of readers in at once and a writer in alone, and QueryExecutor runs the
+patient functions on a thread pool through it:
+
+    with QueryExecutor(SharedPatients(openPatients('patients.txt'), 'patients.txt')) as executor:
+        visits = executor.submit(findVisitsByDate, 2020, 6)
+        executor.submitWrite(addPatientData, 1, '2020-06-01', 37.0, 70, 16, 120, 80, 97, 'patients.txt')
+        print(len(visits.result()))
+
+Reads see the collection as it was after some write and before the next one: a read
+never overlaps a write. The indexes of a collection are built, or brought up to date,
+by the first query that needs them, which would change the collection under the other
+readers; after every write, and before the first read, the first read to arrive does
+that work alone (see prepareForReads), so that the reads themselves only look.
+
+A SqliteStore is shared differently: every reading thread has its own connection to
+the database, and every read runs in one read transaction, which sees the database as
+it was when the read began. Reads then neither wait for writes nor hold them up; only
+the writes, which go through the connection of the shared store, are serialized.
+
+Readers run in parallel only as far as the interpreter lets them: the patient functions
+hold the GIL except while they wait for I/O or for SQLite.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+
+from main_22BECD87 import findPatientsWhoNeedFollowUp
+from sqlite_store import SqliteStore
+
+# Default number of worker threads of a QueryExecutor
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+class ReadWriteLock:
+    """
+    A lock held by any number of readers at once, or by one writer.
+
+    A writer waiting for the lock keeps new readers out, so a steady stream of reads
+    cannot starve the writes. The lock is not reentrant: a thread holding it must not
+    acquire it again.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waitingWriters = 0
+
+    def acquireRead(self):
+        with self._condition:
+            while self._writing or self._waitingWriters:
+                self._condition.wait()
+            self._readers += 1
+
+    def releaseRead(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquireWrite(self):
+        with self._condition:
+            self._waitingWriters += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waitingWriters -= 1
+            self._writing = True
+
+    def releaseWrite(self):
+        with self._condition:
+            self._writing = False
+            self._condition.notify_all()
+
+    @contextmanager
+    def reading(self):
+        """
+        Returns a context manager that holds the lock as a reader.
+        """
+        self.acquireRead()
+        try:
+            yield
+        finally:
+            self.releaseRead()
+
+    @contextmanager
+    def writing(self):
+        """
+        Returns a context manager that holds the lock as the writer.
+        """
+        self.acquireWrite()
+        try:
+            yield
+        finally:
+            self.releaseWrite()
+
+
+def prepareForReads(patients):
+    """
+    Compacts a VisitStore with deleted visits or patients split over several extents,
+    then builds the indexes and cached aggregates of a patients collection, and brings
+    them up to date, the way the first queries after a change would: the date index, the
+    follow-up tracker, the aggregate of all patients and the monthly rollups. Queries
+    then read them without changing them. Collections without them are left as they are.
+
+    patients: A dictionary of patient IDs to lists of visits, or a VisitStore.
+    """
+    # Otherwise the first query reading columns or extents would compact the store,
+    # moving rows under the other readers
+    if hasattr(patients, 'isCompact') and not patients.isCompact():
+        patients.compact()
+    getattr(patients, 'dateIndex', None)  # built on first access
+    findPatientsWhoNeedFollowUp(patients)
+    if getattr(patients, 'aggregates', None) is not None:
+        patients.aggregates.merged()
+    if getattr(patients, 'rollups', None) is not None:
+        patients.rollups.months()
+
+
+class SharedPatients:
+    """
+    A patients collection shared by threads.
+
+    patients: The collection, e.g. from openPatients. Changing it in a write is fine;
+              replacing it (for example with the collection a TailFollower loaded
+              again) must also happen in a write.
+    fileName: The name of the patients file the writes save to, unless the collection
+              has its own storage (see storage).
+    version: The number of writes so far.
+    """
+
+    def __init__(self, patients, fileName=None):
+        self.patients = patients
+        self.fileName = fileName
+        self.version = 0
+        self._lock = ReadWriteLock()
+        self._prepared = False
+        self._prepareLock = threading.Lock()
+        self._readers = threading.local()
+        self._readerStores = []
+
+    @contextmanager
+    def read(self):
+        """
+        Returns a context manager giving the collection to read from. Nothing read from
+        it, such as the visits of a VisitStore, may be used after the block.
+        """
+        if isinstance(self.patients, SqliteStore):
+            store = self._readerStore()
+            store.beginRead()
+            try:
+                yield store
+            finally:
+                store.endRead()
+            return
+        # Only writes, which hold the lock alone, make the collection unprepared again
+        while True:
+            self._lock.acquireRead()
+            if self._prepared:
+                break
+            self._lock.releaseRead()
+            self._prepare()
+        try:
+            yield self.patients
+        finally:
+            self._lock.releaseRead()
+
+    @contextmanager
+    def write(self):
+        """
+        Returns a context manager giving the collection to change, with no read or other
+        write in progress.
+        """
+        with self._lock.writing():
+            try:
+                yield self.patients
+            finally:
+                self.version += 1
+                self._prepared = False
+
+    def _prepare(self):
+        """
+        Runs prepareForReads once after a write, with no read in progress.
+        """
+        with self._prepareLock:
+            if self._prepared:
+                return
+            with self._lock.writing():
+                prepareForReads(self.patients)
+                self._prepared = True
+
+    def _readerStore(self):
+        """
+        Returns the connection of the current thread to the shared SQLite database,
+        opening it on first use.
+        """
+        store = getattr(self._readers, 'store', None)
+        if store is None or store.fileName != self.patients.fileName:
+            store = self._readers.store = SqliteStore(self.patients.fileName)
+            with self._prepareLock:
+                self._readerStores.append(store)
+        return store
+
+    def close(self):
+        """
+        Closes the connections the reading threads opened to a SQLite database.
+        """
+        with self._prepareLock:
+            stores, self._readerStores = self._readerStores, []
+        for store in stores:
+            store.close()
+
+
+class QueryExecutor:
+    """
+    Runs the patient functions on a pool of threads against a SharedPatients.
+
+    Functions are called with the collection as their first argument, followed by the
+    arguments given to submit or submitWrite, e.g. submit(findVisitsByDate, 2020).
+    A read function must return its result rather than a view into the collection.
+    """
+
+    def __init__(self, shared, workers=DEFAULT_WORKERS):
+        """
+        shared: The SharedPatients to run the functions against.
+        workers: The number of threads.
+        """
+        if workers < 1:
+            raise ValueError("The number of workers must be positive.")
+        self.shared = shared
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='query')
+
+    def _read(self, function, args):
+        with self.shared.read() as patients:
+            return function(patients, *args)
+
+    def _write(self, function, args):
+        with self.shared.write() as patients:
+            return function(patients, *args)
+
+    def submit(self, function, *args):
+        """
+        Runs a function that reads the collection on the pool.
+
+        return: A Future of the result of the function.
+        """
+        return self._pool.submit(self._read, function, args)
+
+    def submitWrite(self, function, *args):
+        """
+        Runs a function that changes the collection on the pool, alone.
+
+        return: A Future of the result of the function.
+        """
+        return self._pool.submit(self._write, function, args)
+
+    def map(self, function, argumentLists):
+        """
+        Runs a function that reads the collection once per list of arguments.
+
+        return: An iterator of the results, in the order of the argument lists.
+        """
+        return self._pool.map(self._read, repeat(function), argumentLists)
+
+    def close(self):
+        """
+        Waits for the submitted functions and stops the threads, then closes the
+        connections the reading threads opened.
+        """
+        self._pool.shutdown(wait=True)
+        self.shared.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,273 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import chain, repeat
+from operator import attrgetter, itemgetter
+
+from instrumentation import metrics
+from visit_record import Visit, VisitDate
+
+
+def _packDay(date):
+    """
+    Packs a 'yyyy-mm-dd' date into a yyyymmdd integer, or returns None if it is not in that format.
+    """
+    if type(date) is VisitDate:
+        return date.packed
+    if len(date) != 10 or date[4] != '-' or date[7] != '-':
+        return None
+    digits = date[:4] + date[5:7] + date[8:]
+    return int(digits) if digits.isdigit() else None
+
+
+class DateIndex:
+    """
+    A sorted index of visit dates.
+
+    Visits are kept as two parallel arrays sorted by date: the packed yyyymmdd day of
+    each visit and a sequence number identifying it. Year, year+month and date-range
+    queries are two binary searches plus the matching entries; month-only queries do
+    two binary searches per year covered by the index.
+
+    Every patient gets a rank when its first visit is added. Results are ordered by
+    (rank, sequence number), which is the patient-then-visit order a full scan of the
+    patients dictionary produces. Deleting a patient only forgets its rank; its entries
+    are skipped by queries and purged once they make up half of the index.
+
+    Entries carry a reference to the visit (the visit list for a dictionary of patients,
+    a row number for a VisitStore) that resolve turns into the visit returned by queries.
+    """
+
+    def __init__(self, resolve=None):
+        self._resolve = resolve
+        self._days = array('i')
+        self._seqs = array('q')
+        self._ranks = array('q')
+        self._refs = []
+        self._patientRank = {}
+        self._rankPatient = {}
+        self._rankCounts = {}
+        self._nextRank = 0
+        self._dead = 0
+        self._unindexed = []
+
+    def rebuild(self, patients):
+        """
+        Rebuilds the index from a dictionary of patient IDs to lists of visits.
+        """
+        refs = list(chain.from_iterable(patients.values()))
+        try:
+            dates = list(map(attrgetter('date'), refs))
+        except AttributeError:
+            dates = [visit.date if type(visit) is Visit else visit[0] for visit in refs]
+        patientIds = chain.from_iterable(map(repeat, patients.keys(), map(len, patients.values())))
+        self.loadColumns(patientIds, dates, refs)
+
+    def load(self, entries):
+        """
+        Replaces the contents of the index.
+
+        entries: An iterable of (patientId, date, ref) in patient and visit order, where date
+                 is 'yyyy-mm-dd' or a packed yyyymmdd integer.
+        """
+        entries = list(entries)
+        self.loadColumns(map(itemgetter(0), entries), list(map(itemgetter(1), entries)),
+                         list(map(itemgetter(2), entries)))
+
+    def loadColumns(self, patientIds, dates, refs):
+        """
+        Replaces the contents of the index, like load, from columns rather than one entry
+        per visit: the visits are sorted by day with one sort of their sequence numbers.
+
+        patientIds: An iterable of the patient ID of every visit.
+        dates: A list of the visit dates, as for load.
+        refs: A list of the references the visits are resolved from.
+        """
+        self.__init__(self._resolve)
+        patientRank = self._patientRank
+        ranks = array('q', [patientRank.setdefault(patientId, len(patientRank)) for patientId in patientIds])
+        self._rankPatient = {rank: patientId for patientId, rank in patientRank.items()}
+        self._rankCounts = dict(Counter(ranks))
+        self._nextRank = len(patientRank)
+        self._ranks = ranks
+        self._refs = refs
+        days = [date if type(date) is int else _packDay(date) for date in dates]
+        if None in days:
+            self._unindexed = [(seq, date) for seq, (day, date) in enumerate(zip(days, dates)) if day is None]
+            seqs = [seq for seq, day in enumerate(days) if day is not None]
+        else:
+            seqs = range(len(days))
+        # A stable sort keeps the visits of a day in sequence order
+        seqs = sorted(seqs, key=days.__getitem__)
+        self._days = array('i', map(days.__getitem__, seqs))
+        self._seqs = array('q', seqs)
+
+    def _register(self, patientId, date, ref):
+        """
+        Assigns a sequence number to a visit and returns its packed day, or None if the
+        date could not be packed and the visit went to the unindexed list.
+        """
+        rank = self._patientRank.get(patientId)
+        if rank is None:
+            rank = self._nextRank
+            self._nextRank += 1
+            self._patientRank[patientId] = rank
+            self._rankPatient[rank] = patientId
+            self._rankCounts[rank] = 0
+        self._rankCounts[rank] += 1
+        seq = len(self._refs)
+        self._refs.append(ref)
+        self._ranks.append(rank)
+        day = date if isinstance(date, int) else _packDay(date)
+        if day is None:
+            self._unindexed.append((seq, date))
+        return day
+
+    def add(self, patientId, date, ref):
+        """
+        Adds one visit to the index.
+
+        patientId: The ID of the patient.
+        date: The visit date, as 'yyyy-mm-dd' or a packed yyyymmdd integer.
+        ref: The reference the visit is resolved from.
+        """
+        day = self._register(patientId, date, ref)
+        if day is not None:
+            position = bisect_right(self._days, day)
+            self._days.insert(position, day)
+            self._seqs.insert(position, len(self._refs) - 1)
+
+    def addMany(self, entries):
+        """
+        Adds many visits to the index, merging them in with one sort rather than one
+        insertion per visit.
+
+        entries: An iterable of (patientId, date, ref), as taken by add.
+        """
+        added = []
+        for patientId, date, ref in entries:
+            day = self._register(patientId, date, ref)
+            if day is not None:
+                added.append((day, len(self._refs) - 1))
+        if len(added) < 16:
+            for day, seq in added:
+                position = bisect_right(self._days, day)
+                self._days.insert(position, day)
+                self._seqs.insert(position, seq)
+            return
+        # The existing entries form one sorted run, which the sort merges in linear time
+        merged = list(zip(self._days, self._seqs))
+        added.sort()
+        merged.extend(added)
+        merged.sort()
+        self._days = array('i', [day for day, _ in merged])
+        self._seqs = array('q', [seq for _, seq in merged])
+
+    def visitAdded(self, patientId, visit):
+        """
+        Adds a visit appended to a dictionary of patients.
+        """
+        self.add(patientId, visit[0], visit)
+
+    def visitsAdded(self, visits):
+        """
+        Adds (patientId, visit) pairs appended to a dictionary of patients.
+        """
+        self.addMany((patientId, visit[0], visit) for patientId, visit in visits)
+
+    def patientDeleted(self, patientId):
+        """
+        Removes all visits of a patient from the index.
+        """
+        rank = self._patientRank.pop(patientId, None)
+        if rank is None:
+            return
+        del self._rankPatient[rank]
+        self._dead += self._rankCounts.pop(rank)
+        if self._dead * 2 > len(self._refs):
+            self._purge()
+
+    def renumber(self, rows):
+        """
+        Replaces the row numbers the entries refer to, after the columns of a VisitStore
+        were rewritten.
+
+        rows: A sequence giving the new row number of every old one.
+        """
+        self._refs = list(map(rows.__getitem__, self._refs))
+
+    def _purge(self):
+        """
+        Drops the entries of deleted patients and renumbers the rest.
+        """
+        days = {seq: day for day, seq in zip(self._days, self._seqs)}
+        days.update(self._unindexed)
+        entries = []
+        for seq, (rank, ref) in enumerate(zip(self._ranks, self._refs)):
+            if rank in self._rankPatient:
+                entries.append((self._rankPatient[rank], days[seq], ref))
+        self.load(entries)
+
+    def _collect(self, ranges, keep=None):
+        """
+        Returns the live visits in the given (low, high) day ranges, plus unindexed visits
+        accepted by keep, in patient and visit order.
+        """
+        hits = []
+        for low, high in ranges:
+            hits.extend(self._seqs[bisect_left(self._days, low):bisect_right(self._days, high)])
+        if keep is not None:
+            hits.extend(seq for seq, date in self._unindexed if keep(date))
+        if metrics.enabled:
+            metrics.count('dateIndex.entriesScanned', len(hits) + (len(self._unindexed) if keep else 0))
+        ranks = self._ranks
+        rankPatient = self._rankPatient
+        if self._dead:
+            hits = [seq for seq in hits if ranks[seq] in rankPatient]
+        hits.sort(key=lambda seq: (ranks[seq], seq))
+        resolve = self._resolve
+        refs = self._refs
+        if resolve is None:
+            return [(rankPatient[ranks[seq]], refs[seq]) for seq in hits]
+        return [(rankPatient[ranks[seq]], resolve(refs[seq])) for seq in hits]
+
+    def find(self, year=None, month=None):
+        """
+        Finds visits by year, month, or both.
+
+        year: The year to filter by.
+        month: The month to filter by.
+        return: A list of tuples (patientId, visit), in the same order as a full scan.
+        """
+        year = int(year) if year is not None else None
+        month = int(month) if month is not None else None
+        if year is not None and month is not None:
+            ranges = [(year * 10000 + month * 100, year * 10000 + month * 100 + 99)]
+        elif year is not None:
+            ranges = [(year * 10000, year * 10000 + 9999)]
+        elif month is not None:
+            years = range(self._days[0] // 10000, self._days[-1] // 10000 + 1) if self._days else ()
+            ranges = [(y * 10000 + month * 100, y * 10000 + month * 100 + 99) for y in years]
+        else:
+            ranges = [(-2 ** 31, 2 ** 31 - 1)]
+
+        year_str = str(year) if year is not None else None
+        month_str = "%02d" % month if month is not None else None
+
+        def keep(date):
+            return (not year_str or date.startswith(year_str)) and (not month_str or date[5:7] == month_str)
+
+        return self._collect(ranges, keep)
+
+    def findRange(self, start, end):
+        """
+        Finds visits dated between start and end, both inclusive.
+
+        start: The first date, as 'yyyy-mm-dd'.
+        end: The last date, as 'yyyy-mm-dd'.
+        return: A list of tuples (patientId, visit), in the same order as a full scan.
+        """
+        return self._collect([(_packDay(start), _packDay(end))], lambda date: start <= date <= end)
+
+    def __len__(self):
+        return len(self._refs) - self._dead
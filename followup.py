@@ -0,0 +1,129 @@
+def needsFollowUp(visit):
+    """
+    Checks whether a visit has abnormal vital signs that call for a follow-up visit.
+
+    visit: A visit as [date, temperature, heart rate, respiratory rate, systolic blood pressure,
+           diastolic blood pressure, oxygen saturation].
+    return: True if the temperature, heart rate or blood pressure is out of the normal range.
+    """
+    temperature, heart_rate, respiratory_rate, systolic_bp, diastolic_bp, spo2 = visit[1:7]
+    return (temperature > 37.5 or temperature < 36.0) or (heart_rate > 100 or heart_rate < 60) or \
+           (systolic_bp > 140 or systolic_bp < 90) or (diastolic_bp > 90 or diastolic_bp < 60)
+
+
+def lastVisits(patients):
+    """
+    Yields (patientId, last visit) for every patient, in patient order.
+
+    patients: A dictionary of patient IDs to lists of visits, or a VisitStore.
+    """
+    if hasattr(patients, 'lastRow'):
+        for patientId in patients:
+            yield patientId, patients.visitAt(patients.lastRow(patientId))
+    else:
+        for patientId, visits_list in patients.items():
+            yield patientId, visits_list[-1]
+
+
+class FollowUpTracker:
+    """
+    Maintains the set of patients whose last visit needs a follow-up.
+
+    Only a patient's last visit decides its status, so appending a visit re-evaluates
+    that one visit and deleting a patient drops it: both are O(1). The list of patients
+    is kept in patient order and cached until the set changes.
+
+    Subscribers are called as callback(patientId, needsFollowUp) whenever a patient
+    enters (True) or leaves (False) the follow-up set.
+
+    The predicate decides from a patient's last visit. A RuleSet (see followup_rules)
+    without trend rules can be the predicate; it then screens all patients at once when
+    the tracker is rebuilt.
+    """
+
+    def __init__(self, predicate=needsFollowUp):
+        self._predicate = predicate
+        self._rank = {}
+        self._nextRank = 0
+        self._flagged = set()
+        self._cached = None
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """
+        Registers callback(patientId, needsFollowUp) to be called on every status change.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Removes a callback registered with subscribe.
+        """
+        self._subscribers.remove(callback)
+
+    def rebuild(self, patients):
+        """
+        Recomputes the follow-up set from the last visit of every patient.
+        """
+        self._rank = {}
+        self._nextRank = 0
+        self._flagged = set()
+        self._cached = None
+        if hasattr(self._predicate, 'screen') and not self._predicate.hasTrends:
+            self._rank = {patientId: rank for rank, patientId in enumerate(patients)}
+            self._nextRank = len(self._rank)
+            self._flagged = set(self._predicate.flagged(patients))
+            return
+        for patientId, last_visit in lastVisits(patients):
+            self._rank[patientId] = self._nextRank
+            self._nextRank += 1
+            if self._predicate(last_visit):
+                self._flagged.add(patientId)
+
+    def visitAdded(self, patientId, visit):
+        """
+        Re-evaluates a patient after a visit was appended; the new visit is now its last.
+        """
+        if patientId not in self._rank:
+            self._rank[patientId] = self._nextRank
+            self._nextRank += 1
+        self._setStatus(patientId, self._predicate(visit))
+
+    def visitsAdded(self, visits):
+        """
+        Re-evaluates patients after (patientId, visit) pairs were appended, in order.
+        """
+        for patientId, visit in visits:
+            self.visitAdded(patientId, visit)
+
+    def patientDeleted(self, patientId):
+        """
+        Drops a deleted patient from the follow-up set.
+        """
+        if self._rank.pop(patientId, None) is not None:
+            self._setStatus(patientId, False)
+
+    def _setStatus(self, patientId, flagged):
+        if flagged == (patientId in self._flagged):
+            return
+        if flagged:
+            self._flagged.add(patientId)
+        else:
+            self._flagged.discard(patientId)
+        self._cached = None
+        for callback in list(self._subscribers):
+            callback(patientId, flagged)
+
+    def patients(self):
+        """
+        Returns the list of patient IDs that need follow-up, in patient order.
+        """
+        if self._cached is None:
+            self._cached = sorted(self._flagged, key=self._rank.__getitem__)
+        return list(self._cached)
+
+    def __contains__(self, patientId):
+        return patientId in self._flagged
+
+    def __len__(self):
+        return len(self._flagged)
@@ -0,0 +1,355 @@
+"""
+Declarative follow-up rules, evaluated over whole columns of recent visits.
+
+A rule set is a list of rules, each with a name and a severity (see SEVERITIES):
+
+    range rules   flag a patient whose last visit has a vital sign below "min" or above "max"
+    trend rules   flag a patient whose vital sign changed by at least "change" (rising if
+                  positive, falling if negative) over its last "visits" visits, optionally
+                  moving the same way at every step ("monotonic")
+
+Rule sets are loaded from JSON files such as followup_rules.json:
+
+    {"rules": [
+        {"name": "fever", "vital": "temperature", "max": 37.5, "severity": "medium"},
+        {"name": "falling SpO2", "vital": "spo2", "trend": {"visits": 3, "change": -3}, "severity": "high"}
+    ]}
+
+Vital signs are named as in the JSON Lines output of visit_render (see RULE_VITALS).
+
+screen evaluates a rule set on every patient at once. The last visits (and, for trend
+rules, the visits before them) are gathered into one column per vital sign the rules
+use. Vital signs take few distinct values, so all range rules on a vital sign are
+compiled into one table of distinct value -> severity bits, applied to the column with a
+single map run by the interpreter in C; trend rules map a comparison over the columns
+the same way. Results are packed into integers with one byte per patient, so combining
+rules and severities takes a few big-integer operations instead of a loop over patients.
+
+DEFAULT_RULES are the criteria of needsFollowUp.
+"""
+import gc
+import json
+from itertools import compress
+from operator import gt, itemgetter, lt, sub
+
+from visit_record import VITAL_GETTERS
+
+# Vital signs rules can refer to, in visit order (fields 1 to 6 of a visit)
+RULE_VITALS = ('temperature', 'heartRate', 'respiratoryRate', 'systolicBP', 'diastolicBP', 'spo2')
+
+# Severity levels, from lowest to highest
+SEVERITIES = ('low', 'medium', 'high')
+DEFAULT_SEVERITY = 'medium'
+
+# Byte translation of severity bits to 1 + the level of the highest bit set, and back to a name
+_HIGHEST_LEVEL = bytes(bits.bit_length() if bits < 1 << len(SEVERITIES) else 0 for bits in range(256))
+_SEVERITY_OF_CODE = (None,) + SEVERITIES
+
+# Tolerance of trend comparisons, so that e.g. 37.3 - 36.3 counts as a change of 1.0
+_TOLERANCE = 1e-9
+
+
+def _mask(flags):
+    """
+    Packs an iterable of booleans, one per patient, into an integer bit mask.
+    """
+    return int.from_bytes(bytes(flags), 'little')
+
+
+def _vitalIndex(name):
+    if name not in RULE_VITALS:
+        raise ValueError(f"Unknown vital sign '{name}'; expected one of {', '.join(RULE_VITALS)}")
+    return RULE_VITALS.index(name)
+
+
+def _checkSeverity(severity):
+    if severity not in SEVERITIES:
+        raise ValueError(f"Unknown severity '{severity}'; expected one of {', '.join(SEVERITIES)}")
+    return severity
+
+
+class RangeRule:
+    """
+    Flags a patient whose last visit has a vital sign outside [minimum, maximum].
+    Either bound may be None.
+    """
+
+    depth = 1
+
+    def __init__(self, name, vital, minimum=None, maximum=None, severity=DEFAULT_SEVERITY):
+        if minimum is None and maximum is None:
+            raise ValueError(f"Rule '{name}' needs a minimum or a maximum")
+        self.name = name
+        self.vital = vital
+        self.severity = _checkSeverity(severity)
+        self.minimum = None if minimum is None else float(minimum)
+        self.maximum = None if maximum is None else float(maximum)
+        self._field = _vitalIndex(vital)
+
+    def outside(self, value):
+        """
+        Checks whether a value of the vital sign is out of the rule's range.
+        """
+        return (self.minimum is not None and value < self.minimum) or \
+               (self.maximum is not None and value > self.maximum)
+
+    def matches(self, visits):
+        """
+        Checks the rule against a patient's visits, oldest first.
+        """
+        return self.outside(visits[-1][self._field + 1])
+
+
+class TrendRule:
+    """
+    Flags a patient whose vital sign changed by at least change over its last visits
+    visits: rising if change is positive, falling if it is negative. With monotonic, the
+    value must also move that way between every two consecutive visits of the window.
+    Patients with fewer visits are not flagged.
+    """
+
+    def __init__(self, name, vital, visits, change, monotonic=False, severity=DEFAULT_SEVERITY):
+        if int(visits) < 2:
+            raise ValueError(f"Rule '{name}' needs a window of at least 2 visits")
+        if not change:
+            raise ValueError(f"Rule '{name}' needs a non-zero change")
+        self.name = name
+        self.vital = vital
+        self.severity = _checkSeverity(severity)
+        self.depth = int(visits)
+        self.change = float(change)
+        self.monotonic = bool(monotonic)
+        self._field = _vitalIndex(vital)
+
+    def _changed(self, difference):
+        if self.change > 0:
+            return difference >= self.change - _TOLERANCE
+        return difference <= self.change + _TOLERANCE
+
+    def matches(self, visits):
+        """
+        Checks the rule against a patient's visits, oldest first.
+        """
+        if len(visits) < self.depth:
+            return False
+        values = [visit[self._field + 1] for visit in visits[-self.depth:]]
+        if not self._changed(values[-1] - values[0]):
+            return False
+        step = lt if self.change > 0 else gt
+        return not self.monotonic or all(map(step, values, values[1:]))
+
+    def mask(self, recent, counts):
+        """
+        Evaluates the rule on every patient, given their visit counts and the columns of
+        their recent visits (see recentColumns). Returns a mask with one byte per patient,
+        1 if the patient matches.
+        """
+        field = self._field
+        differences = map(sub, recent[0][field], recent[self.depth - 1][field])
+        if self.change > 0:
+            result = _mask(map((self.change - _TOLERANCE).__le__, differences))
+        else:
+            result = _mask(map((self.change + _TOLERANCE).__ge__, differences))
+        result &= _mask(map(self.depth.__le__, counts))
+        if self.monotonic:
+            step = gt if self.change > 0 else lt
+            for k in range(self.depth - 1):
+                if not result:
+                    break
+                result &= _mask(map(step, recent[k][field], recent[k + 1][field]))
+        return result
+
+
+class _SeverityTable(dict):
+    """
+    A dictionary of vital sign value to the severity bits of the range rules the value
+    falls outside of, filled in as values are first looked up. Lookups of values seen
+    before stay in C.
+    """
+
+    def __init__(self, rules):
+        super().__init__()
+        self._rules = rules
+
+    def __missing__(self, value):
+        bits = 0
+        for rule in self._rules:
+            if rule.outside(value):
+                bits |= 1 << SEVERITIES.index(rule.severity)
+        self[value] = bits
+        return bits
+
+
+def recentColumns(patients, depth, fields=range(6)):
+    """
+    Gathers vital signs of the last depth visits of every patient into columns.
+
+    patients: A dictionary of patient IDs to lists of visits, or a VisitStore.
+    depth: The number of most recent visits to gather.
+    fields: The indexes (in RULE_VITALS) of the vital signs to gather.
+    Returns a tuple (patient IDs, visit counts, recent), where recent[k][field] is the
+    column of a vital sign at the (k + 1)-th last visit of every patient, or None if
+    that vital sign was not requested. A patient with fewer visits repeats its first visit.
+    """
+    fields = sorted(set(fields))
+    recent = []
+    if hasattr(patients, 'patientExtents'):
+        extents = list(patients.patientExtents())
+        patientIds = [patientId for patientId, _, _ in extents]
+        counts = [length for _, _, length in extents]
+        columns = patients.columns()
+        for k in range(1, depth + 1):
+            rows = [offset + length - k if length >= k else offset for _, offset, length in extents]
+            gathered = [None] * 6
+            for field in fields:
+                gathered[field] = itemgetter(*rows)(columns[field]) if len(rows) > 1 else \
+                    [columns[field][row] for row in rows]
+            recent.append(gathered)
+        return patientIds, counts, recent
+
+    patientIds = list(patients)
+    histories = list(patients.values())
+    counts = list(map(len, histories))
+    # The gathered lists are tracked by the garbage collector, which would otherwise
+    # make repeated passes over them while they are built
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for k in range(1, depth + 1):
+            if k == 1:
+                visits = list(map(itemgetter(-1), histories))
+            else:
+                visits = [history[-k] if len(history) >= k else history[0] for history in histories]
+            gathered = [None] * 6
+            for field in fields:
+                try:
+                    gathered[field] = list(map(VITAL_GETTERS[field], visits))
+                except AttributeError:
+                    gathered[field] = list(map(itemgetter(field + 1), visits))
+            recent.append(gathered)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return patientIds, counts, recent
+
+
+class RuleSet:
+    """
+    A compiled set of follow-up rules.
+
+    Called with a single visit, a rule set evaluates its range rules on it, so that it
+    can serve as the predicate of a FollowUpTracker when it has no trend rules.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        names = [rule.name for rule in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Rule names must be unique")
+        self.depth = max((rule.depth for rule in self.rules), default=1)
+        self.hasTrends = self.depth > 1
+
+    @classmethod
+    def fromConfig(cls, config):
+        """
+        Builds a rule set from a decoded configuration, {"rules": [...]} as described above.
+        """
+        rules = []
+        for number, entry in enumerate(config.get('rules', ()), start=1):
+            if not isinstance(entry, dict) or 'vital' not in entry:
+                raise ValueError(f"Rule {number} needs a vital sign")
+            name = entry.get('name', f"rule {number}")
+            severity = entry.get('severity', DEFAULT_SEVERITY)
+            trend = entry.get('trend')
+            if trend is not None:
+                rules.append(TrendRule(name, entry['vital'], trend.get('visits', 0), trend.get('change', 0),
+                                       trend.get('monotonic', False), severity))
+            else:
+                rules.append(RangeRule(name, entry['vital'], entry.get('min'), entry.get('max'), severity))
+        return cls(rules)
+
+    def __call__(self, visit):
+        return any(rule.matches([visit]) for rule in self.rules if rule.depth == 1)
+
+    def matchedRules(self, visits):
+        """
+        Returns the names of the rules a patient's visits (oldest first) match.
+        """
+        return [rule.name for rule in self.rules if visits and rule.matches(visits)]
+
+    def severityOf(self, visits):
+        """
+        Returns the highest severity among the rules a patient's visits match, or None.
+        """
+        levels = [SEVERITIES.index(rule.severity) for rule in self.rules if visits and rule.matches(visits)]
+        return SEVERITIES[max(levels)] if levels else None
+
+    def _rangeTable(self, field, lowest):
+        """
+        Returns a table mapping every value of a vital sign to the severity bits
+        (1 << level) of the range rules on it that the value falls outside of.
+        """
+        rules = [rule for rule in self.rules if rule.depth == 1 and rule._field == field
+                 and SEVERITIES.index(rule.severity) >= lowest]
+        return _SeverityTable(rules)
+
+    def screen(self, patients, minSeverity=None):
+        """
+        Evaluates the rules on every patient at once.
+
+        patients: A dictionary of patient IDs to lists of visits, or a VisitStore.
+        minSeverity: The lowest severity to report, or None for all.
+        Returns a list of (patientId, severity) for the patients that match at least one
+        rule, in patient order, with the highest severity among the rules they match.
+        """
+        lowest = SEVERITIES.index(_checkSeverity(minSeverity)) if minSeverity is not None else 0
+        rules = [rule for rule in self.rules if SEVERITIES.index(rule.severity) >= lowest]
+        if not patients or not rules:
+            return []
+        depth = max(rule.depth for rule in rules)
+        patientIds, counts, recent = recentColumns(patients, depth, {rule._field for rule in rules})
+
+        # One byte per patient holding the severity bits of every rule it matches
+        bits = 0
+        for field in sorted({rule._field for rule in rules if rule.depth == 1}):
+            column = recent[0][field]
+            bits |= _mask(map(self._rangeTable(field, lowest).__getitem__, column))
+        for rule in rules:
+            if rule.depth > 1:
+                bits |= rule.mask(recent, counts) << SEVERITIES.index(rule.severity)
+
+        # Turn the bits into 1 + the level of the highest severity, or 0
+        codes = bits.to_bytes(len(patientIds), 'little').translate(_HIGHEST_LEVEL)
+        return list(zip(compress(patientIds, codes), map(_SEVERITY_OF_CODE.__getitem__, filter(None, codes))))
+
+    def flagged(self, patients, minSeverity=None):
+        """
+        Returns the IDs of the patients that match at least one rule, in patient order.
+        """
+        return [patientId for patientId, _ in self.screen(patients, minSeverity)]
+
+
+def loadRules(fileName):
+    """
+    Loads a rule set from a JSON file.
+
+    Raises ValueError if the file cannot be read or does not describe valid rules.
+    """
+    try:
+        with open(fileName) as file:
+            config = json.load(file)
+    except OSError:
+        raise ValueError(f"The rules file '{fileName}' could not be found.")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"The rules file '{fileName}' is not valid JSON: {e}")
+    if not isinstance(config, dict):
+        raise ValueError(f"The rules file '{fileName}' should hold an object with a list of rules")
+    return RuleSet.fromConfig(config)
+
+
+DEFAULT_RULES = RuleSet([
+    RangeRule('temperature', 'temperature', 36.0, 37.5),
+    RangeRule('heart rate', 'heartRate', 60, 100),
+    RangeRule('systolic blood pressure', 'systolicBP', 90, 140),
+    RangeRule('diastolic blood pressure', 'diastolicBP', 60, 90),
+])
@@ -0,0 +1,243 @@
+"""
+Opt-in timers, counters and profiling of the patient functions.
+
+The module-level metrics object collects:
+
+    timers      calls, total and longest seconds of the functions decorated with timed
+    counters    lines parsed, lines rejected by reason, bytes read, visits loaded,
+                date index entries and visits scanned by queries, cache hits and misses,
+                snapshot use, ...
+
+It is disabled unless the HIS_METRICS environment variable is set, or until
+metrics.enable() is called. Disabled, a timed function costs one attribute check per
+call, and the loaders count per block of lines rather than per line, so instrumented
+code runs at the same speed. Work done in the worker processes of parallel_ingest is
+not counted.
+
+Three environment variables act around every entry point decorated with entryPoint
+(the interactive menu, the command line interface and the query server):
+
+    HIS_METRICS=1 | FILE        collect metrics; print them to stderr at exit, or write them to FILE as JSON
+    HIS_PROFILE=FILE            run under cProfile and write the stats to FILE (for pstats or snakeviz)
+    HIS_TRACEMALLOC=1 | FILE    trace allocations; print the top allocation sites to stderr, or to FILE
+
+For example:
+
+    HIS_PROFILE=load.prof python cli.py stats
+    python -c "import pstats; pstats.Stats('load.prof').sort_stats('cumtime').print_stats(20)"
+"""
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from visit_validation import REJECTION_REASONS
+
+METRICS_ENV = 'HIS_METRICS'
+PROFILE_ENV = 'HIS_PROFILE'
+TRACEMALLOC_ENV = 'HIS_TRACEMALLOC'
+
+# Number of allocation sites listed by the tracemalloc capture
+TRACEMALLOC_TOP = 25
+
+def _envSet(name):
+    """
+    Returns the value of an environment variable, or None if it is unset, empty or '0'.
+    """
+    value = os.environ.get(name)
+    return value if value and value != '0' else None
+
+
+class Metrics:
+    """
+    Named counters and timers, collected only while enabled. Threads may record them
+    concurrently.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = Counter()
+        self.timers = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """
+        Forgets all counts and timings.
+        """
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def count(self, name, amount=1):
+        """
+        Adds to a counter. Callers in hot paths check enabled first.
+        """
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += amount
+
+    def addTime(self, name, seconds):
+        """
+        Records one timed call.
+        """
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def timer(self, name):
+        """
+        Returns a context manager that records the time spent in its block.
+        """
+        return _Timer(self, name)
+
+    def countRejections(self, codes, prefix='load'):
+        """
+        Counts rejected lines under '<prefix>.rejected.<reason>', given their rejection
+        codes (see visit_validation); the reason is the one REJECTION_REASONS names,
+        such as 'number of fields', 'date' or 'temperature'. Callers check enabled first.
+        """
+        with self._lock:
+            for code in codes:
+                self.counters[f"{prefix}.rejected.{REJECTION_REASONS[code]}"] += 1
+
+    def snapshot(self):
+        """
+        Returns the counters and timers as a dictionary, e.g. for JSON output.
+        """
+        return {
+            'counters': dict(sorted(self.counters.items())),
+            'timers': {name: {'calls': calls, 'seconds': total, 'maxSeconds': longest}
+                       for name, (calls, total, longest) in sorted(self.timers.items())},
+        }
+
+    def report(self, out=None):
+        """
+        Prints the counters and timers in a readable table.
+        """
+        out = out or sys.stderr
+        if self.timers:
+            print(f"{'timer':44} {'calls':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}", file=out)
+            for name, (calls, total, longest) in sorted(self.timers.items()):
+                print(f"{name:44} {calls:8} {total:10.4f} {total / calls * 1000:10.3f} {longest * 1000:10.3f}",
+                      file=out)
+        if self.counters:
+            print(f"{'counter':44} {'value':>12}", file=out)
+            for name, value in sorted(self.counters.items()):
+                print(f"{name:44} {value:12,}", file=out)
+
+
+class _Timer:
+    __slots__ = ('_metrics', '_name', '_start')
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter() if self._metrics.enabled else None
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is not None:
+            self._metrics.addTime(self._name, time.perf_counter() - self._start)
+        return False
+
+
+metrics = Metrics(enabled=_envSet(METRICS_ENV) is not None)
+
+
+def timed(name=None):
+    """
+    Decorates a function so that its calls are timed while metrics are enabled.
+
+    name: The name of the timer; defaults to the name of the function.
+    """
+    def decorate(function):
+        timer_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.addTime(timer_name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def _writeOutput(destination, write):
+    """
+    Calls write(file) with stderr if destination is '1', otherwise with the file it names.
+    """
+    if destination in ('1', '-'):
+        write(sys.stderr)
+    else:
+        with open(destination, 'w') as file:
+            write(file)
+
+
+def entryPoint(function):
+    """
+    Decorates the function a program starts from, so that the HIS_METRICS, HIS_PROFILE
+    and HIS_TRACEMALLOC environment variables take effect around it. Without them, the
+    function is called as is.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        metrics_to = _envSet(METRICS_ENV)
+        profile_to = _envSet(PROFILE_ENV)
+        trace_to = _envSet(TRACEMALLOC_ENV)
+        if not (metrics_to or profile_to or trace_to):
+            return function(*args, **kwargs)
+
+        if metrics_to:
+            metrics.enable()
+        profiler = None
+        if profile_to:
+            import cProfile
+            profiler = cProfile.Profile()
+        if trace_to:
+            import tracemalloc
+            tracemalloc.start()
+        try:
+            if profiler is not None:
+                return profiler.runcall(function, *args, **kwargs)
+            return function(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.dump_stats(profile_to)
+            if trace_to:
+                top = tracemalloc.take_snapshot().statistics('lineno')[:TRACEMALLOC_TOP]
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                def writeTrace(out):
+                    print(f"tracemalloc: {current / 2 ** 20:.1f} MiB allocated at exit, "
+                          f"peak {peak / 2 ** 20:.1f} MiB; top allocation sites:", file=out)
+                    for statistic in top:
+                        print(f"  {statistic}", file=out)
+                _writeOutput(trace_to, writeTrace)
+            if metrics_to:
+                if metrics_to in ('1', '-'):
+                    metrics.report()
+                else:
+                    _writeOutput(metrics_to, lambda out: json.dump(metrics.snapshot(), out, indent=2))
+    return wrapper
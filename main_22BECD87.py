@@ -1,12 +1,31 @@
+import sys
 from typing import List, Dict, Optional
 
+from bulk_ingest import groupVisits, iterColumnBlocks
+from followup import lastVisits, needsFollowUp
+from instrumentation import entryPoint, metrics, timed
+from monthly_rollups import vitalTrends
+from patient_records import PatientRecords, notifyPatientDeleted
+from storage import storageFor
+from tail_follow import TailFollower
+from visit_log import compactPatientsFile
+from visit_record import Visit, visitDate
+from visit_render import renderPatients, renderVisitList
+from visit_writer import BATCH_SIZE, DURABILITY_NONE, VisitWriter, recordVisit, validateVisit
+from vital_stats import vitalMeans
 
+# Column headings of the vital sign averages printed by displayTrends, in visit order
+TREND_HEADINGS = ('Temp C', 'HR bpm', 'RR bpm', 'SBP mmHg', 'DBP mmHg', 'SpO2 %')
+
+
+@timed()
 def readPatientsFromFile(fileName):
     """
     Reads patient data from a plaintext file.
 
     fileName: The name of the file to read patient data from.
     Returns a dictionary of patient IDs, where each patient has a list of visits.
+    The dictionary is a PatientRecords, which also carries a date index over the visits.
     The dictionary has the following structure:
     {
         patientId (int): [
@@ -22,61 +41,21 @@ def readPatientsFromFile(fileName):
     }
     """
     patients = {}
+
+    # Group the validated visits of each block straight into the dictionary; invalid
+    # lines are reported as their block is read. iter_visits is for streaming: going
+    # through it one visit at a time only slows a full load down
+
     try:
-        # Open the file and iterate through each line
-
-        with open(fileName, 'r') as file:
-            for line_num, line in enumerate(file, start=1):
-                try:
-                    # Split the line into patient data fields
-
-                    patient_data = line.strip().split(',')
-                    if len(patient_data) != 8:
-                        raise ValueError(f"Invalid number of fields ({len(patient_data)}) in line: {line_num}")
-                    
-                    # Convert patient data to appropriate data types
-                    
-                    patient_id = int(patient_data[0])
-                    date = patient_data[1]
-                    temp = float(patient_data[2])
-                    hr = int(patient_data[3])
-                    rr = int(patient_data[4])
-                    sbp = int(patient_data[5])
-                    dbp = int(patient_data[6])
-                    spo2 = int(patient_data[7])
-                    
-                    # Validate data values
-                    
-                    if not (35 <= temp <= 42):
-                        raise ValueError(f"Invalid temperature value ({temp}) in line: {line_num}")
-                    if not (30 <= hr <= 180):
-                        raise ValueError(f"Invalid heart rate value ({hr}) in line: {line_num}")
-                    if not (5 <= rr <= 40):
-                        raise ValueError(f"Invalid respiratory rate value ({rr}) in line: {line_num}")
-                    if not (70 <= sbp <= 200):
-                        raise ValueError(f"Invalid systolic blood pressure value ({sbp}) in line: {line_num}")
-                    if not (40 <= dbp <= 120):
-                        raise ValueError(f"Invalid diastolic blood pressure value ({dbp}) in line: {line_num}")
-                    if not (70 <= spo2 <= 100):
-                        raise ValueError(f"Invalid oxygen saturation value ({spo2}) in line: {line_num}")
-                    
-                    # Append patient data to dictionary
-                    
-                    if patient_id not in patients:
-                        patients[patient_id] = []
-                    patients[patient_id].append([date, temp, hr, rr, sbp, dbp, spo2])
-                
-                except ValueError as ve:
-                    print(ve)
-                except Exception as e:
-                    print(f"An unexpected error occurred while reading line {line_num}: {e}")
-    
+        groupVisits(iterColumnBlocks(fileName), patients)
     except FileNotFoundError:
         print(f"The file '{fileName}' could not be found.")
-        
-    return patients
+
+    # Wrap the dictionary so that the visit indexes are built from it when first queried
+    return PatientRecords(patients)
 
 
+@timed()
 def displayPatientData(patients, patientId=0):
     """
     Displays patient data for a given patient ID.
@@ -88,31 +67,12 @@ def displayPatientData(patients, patientId=0):
         # Display data for all patients or a specific patient
 
         if patientId == 0:
-            for patient_id, visits in patients.items():
-                print(f"Patient ID: {patient_id}")
-                for visit in visits:
-                    print(" Visit Date:", visit[0])
-                    print(" " * 2, "Temperature:", "%.2f" % visit[1], "C")
-                    print(" " * 2, "Heart Rate:", visit[2], "bpm")
-                    print(" " * 2, "Respiratory Rate:", visit[3], "bpm")
-                    print(" " * 2, "Systolic Blood Pressure:", visit[4], "mmHg")
-                    print(" " * 2, "Diastolic Blood Pressure:", visit[5], "mmHg")
-                    print(" " * 2, "Oxygen Saturation:", visit[6], "%")
-                    print()
+            renderPatients(patients, out=sys.stdout)
         else:
             # Display data for a specific patient
 
             if patientId in patients:
-                print(f"Patient ID: {patientId}")
-                for visit in patients[patientId]:
-                    print(" Visit Date:", visit[0])
-                    print(" " * 2, "Temperature:", "%.2f" % visit[1], "C")
-                    print(" " * 2, "Heart Rate:", visit[2], "bpm")
-                    print(" " * 2, "Respiratory Rate:", visit[3], "bpm")
-                    print(" " * 2, "Systolic Blood Pressure:", visit[4], "mmHg")
-                    print(" " * 2, "Diastolic Blood Pressure:", visit[5], "mmHg")
-                    print(" " * 2, "Oxygen Saturation:", visit[6], "%")
-                    print()
+                renderPatients(patients, [patientId], out=sys.stdout)
             else:
                 print(f"Patient with ID {patientId} not found.")
     except Exception as e:
@@ -120,6 +80,7 @@ def displayPatientData(patients, patientId=0):
 
 
 
+@timed()
 def displayStats(patients, patientId=0):
     """
     Prints the average of each vital sign for all patients or for the specified patient.
@@ -131,55 +92,35 @@ def displayStats(patients, patientId=0):
         patientId = int(patientId)  # Convert patientId to an integer
         # Display statistics for all patients or a specific patient
         
+        aggregates = getattr(patients, 'aggregates', None)
         if patientId == 0:
             print("Vital Signs for All Patients:")
-            # Calculate and display average values
-            num_patients = len(patients)
-            temp_sum = hr_sum = rr_sum = sbp_sum = dbp_sum = spo2_sum = 0
-            num_visits = 0
-            for visits in patients.values():
-                for visit in visits:
-                    num_visits += 1
-                    temp_sum += visit[1]
-                    hr_sum += visit[2]
-                    rr_sum += visit[3]
-                    sbp_sum += visit[4]
-                    dbp_sum += visit[5]
-                    spo2_sum += visit[6]
-            if num_visits == 0:
-                print("No data found")
-                return
-            print(" Average temperature:", "%.2f" % (temp_sum / num_visits), "C")
-            print(" Average heart rate:", "%.2f" % (hr_sum / num_visits), "bpm")
-            print(" Average respiratory rate:", "%.2f" % (rr_sum / num_visits), "bpm")
-            print(" Average systolic blood pressure:", "%.2f" % (sbp_sum / num_visits), "mmHg")
-            print(" Average diastolic blood pressure:", "%.2f" % (dbp_sum / num_visits), "mmHg")
-            print(" Average oxygen saturation:", "%.2f" % (spo2_sum / num_visits), "%")
-        else:
-            # Display statistics for a specific patient
-            if patientId in patients:
-                print(f"Vital Signs for Patient {patientId}:")
-                visits = patients[patientId]
-                num_visits = len(visits)
-                if num_visits == 0:
-                    print("No data found")
-                    return
-                temp_sum = hr_sum = rr_sum = sbp_sum = dbp_sum = spo2_sum = 0
-                for visit in visits:
-                    temp_sum += visit[1]
-                    hr_sum += visit[2]
-                    rr_sum += visit[3]
-                    sbp_sum += visit[4]
-                    dbp_sum += visit[5]
-                    spo2_sum += visit[6]
-                print(" Average temperature:", "%.2f" % (temp_sum / num_visits), "C")
-                print(" Average heart rate:", "%.2f" % (hr_sum / num_visits), "bpm")
-                print(" Average respiratory rate:", "%.2f" % (rr_sum / num_visits), "bpm")
-                print(" Average systolic blood pressure:", "%.2f" % (sbp_sum / num_visits), "mmHg")
-                print(" Average diastolic blood pressure:", "%.2f" % (dbp_sum / num_visits), "mmHg")
-                print(" Average oxygen saturation:", "%.2f" % (spo2_sum / num_visits), "%")
+            if aggregates is not None:
+                # The population sums are cached and kept up to date by add and delete
+                total = aggregates.merged()
+                num_visits, averages = total.count, total.means()
             else:
-                print(f"Patient with ID {patientId} not found.")
+                num_visits, averages = vitalMeans(patients)
+        elif patientId in patients:
+            print(f"Vital Signs for Patient {patientId}:")
+            if aggregates is not None:
+                total = aggregates.get(patientId)
+                num_visits, averages = total.count, total.means()
+            else:
+                num_visits, averages = vitalMeans(patients, [patientId])
+        else:
+            print(f"Patient with ID {patientId} not found.")
+            return
+        if num_visits == 0:
+            print("No data found")
+            return
+        temp_avg, hr_avg, rr_avg, sbp_avg, dbp_avg, spo2_avg = averages
+        print(" Average temperature:", "%.2f" % temp_avg, "C")
+        print(" Average heart rate:", "%.2f" % hr_avg, "bpm")
+        print(" Average respiratory rate:", "%.2f" % rr_avg, "bpm")
+        print(" Average systolic blood pressure:", "%.2f" % sbp_avg, "mmHg")
+        print(" Average diastolic blood pressure:", "%.2f" % dbp_avg, "mmHg")
+        print(" Average oxygen saturation:", "%.2f" % spo2_avg, "%")
     except ValueError:
         raise ValueError("Error: 'patientId' should be an integer.")
     except Exception as e:
@@ -187,6 +128,31 @@ def displayStats(patients, patientId=0):
 
 
 
+@timed()
+def displayTrends(patients, startYear=None, endYear=None, monthly=False):
+    """
+    Prints the average of each vital sign and the number of visits that need a follow-up,
+    per year or per month, from the monthly rollups of the visits (see monthly_rollups).
+
+    patients: A dictionary of patient IDs, where each patient has a list of visits.
+    startYear: The first year to display, or None to start with the first visit.
+    endYear: The last year to display, or None to end with the last visit.
+    monthly: Whether to display one line per month rather than one per year.
+    """
+    trends = vitalTrends(patients, startYear, endYear, monthly)
+    if not trends:
+        print("No visits found for the specified years.")
+        return
+    print(f"Vital Sign Trends by {'Month' if monthly else 'Year'}:")
+    print(f" {'Period':8} {'Visits':>7} {'Follow-up':>10}"
+          + ''.join(f"{heading:>10}" for heading in TREND_HEADINGS))
+    for period, rollup in trends:
+        print(f" {period:8} {rollup.count:7} {rollup.followUps:10}"
+              + ''.join("%10.2f" % mean for mean in rollup.means()))
+
+
+
+@timed()
 def addPatientData(patients, patientId, date, temp, hr, rr, sbp, dbp, spo2, fileName):
     """
     Adds new patient data to the patient list.
@@ -200,56 +166,16 @@ def addPatientData(patients, patientId, date, temp, hr, rr, sbp, dbp, spo2, file
     sbp: The patient's systolic blood pressure.
     dbp: The patient's diastolic blood pressure.
     spo2: The patient's oxygen saturation level.
-    fileName: The name of the file to append new data to.
+    fileName: The name of the file to append new data to, unless patients has its own storage.
     """
     try:
-        # Validate patient ID
-        if not str(patientId).isdigit() or int(patientId) <= 0:
-            raise ValueError("Invalid patient ID. Please enter a positive integer.")
-        
-        # Validate date format using regular expression
-        if not re.match(r'^\d{4}-\d{2}-\d{2}$', date):
-            raise ValueError("Invalid date format. Please enter date in the format 'yyyy-mm-dd'.")
-        
-        # Validate date values
-        year, month, day = map(int, date.split('-'))
-        if not (1900 <= year <= 9999 and 1 <= month <= 12 and 1 <= day <= 31):
-            raise ValueError("Invalid date. Please enter a valid date.")
-        
-        # Validate temperature
-        if not (35.0 <= float(temp) <= 42.0):
-            raise ValueError("Invalid temperature. Please enter a temperature between 35.0 and 42.0 Celsius.")
-        
-        # Validate heart rate
-        if not (30 <= int(hr) <= 180):
-            raise ValueError("Invalid heart rate. Please enter a heart rate between 30 and 180 bpm.")
-        
-        # Validate respiratory rate
-        if not (5 <= int(rr) <= 40):
-            raise ValueError("Invalid respiratory rate. Please enter a respiratory rate between 5 and 40 bpm.")
-        
-        # Validate systolic blood pressure
-        if not (70 <= int(sbp) <= 200):
-            raise ValueError("Invalid systolic blood pressure. Please enter a systolic blood pressure between 70 and 200 mmHg.")
-        
-        # Validate diastolic blood pressure
-        if not (40 <= int(dbp) <= 120):
-            raise ValueError("Invalid diastolic blood pressure. Please enter a diastolic blood pressure between 40 and 120 mmHg.")
-        
-        # Validate oxygen saturation
-        if not (70 <= int(spo2) <= 100):
-            raise ValueError("Invalid oxygen saturation. Please enter an oxygen saturation between 70 and 100%.")
-        
+        patientId, new_visit = validateVisit(patientId, date, temp, hr, rr, sbp, dbp, spo2)
+
         # Append new data to patients dictionary
-        new_visit = [date, temp, hr, rr, sbp, dbp, spo2]
-        if int(patientId) in patients:
-            patients[int(patientId)].append(new_visit)
-        else:
-            patients[int(patientId)] = [new_visit]
-        
+        recordVisit(patients, patientId, new_visit)
+
         # Append new data to file
-        with open(fileName, 'a') as file:
-            file.write(f"\n{patientId},{','.join(map(str, new_visit))}")
+        storageFor(patients, fileName).saveVisits([(patientId, new_visit)])
         
         # Display success message
         print(f"Visit is saved successfully for Patient #{patientId}")
@@ -261,6 +187,35 @@ def addPatientData(patients, patientId, date, temp, hr, rr, sbp, dbp, spo2, file
 
 
 
+@timed()
+def addPatientVisits(patients, visits, fileName, durability=DURABILITY_NONE, batchSize=BATCH_SIZE):
+    """
+    Adds many new visits to the patient list and the patients file at once.
+
+    patients: The dictionary of patient IDs, where each patient has a list of visits, to add data to.
+    visits: An iterable of (patientId, date, temp, hr, rr, sbp, dbp, spo2) tuples, with values
+            as accepted by addPatientData.
+    fileName: The name of the file to append new data to.
+    durability: When to fsync the file, one of the DURABILITY_* policies in visit_writer.
+    batchSize: The number of visits written per writelines.
+    return: The number of visits saved. Invalid visits are reported and skipped.
+    """
+    try:
+        writer = VisitWriter(patients, fileName, durability, batchSize)
+    except OSError as e:
+        print("An unexpected error occurred while adding new data:", e)
+        return 0
+    try:
+        with writer:
+            writer.addMany(visits)
+    except OSError as e:
+        print("An unexpected error occurred while adding new data:", e)
+    print(f"{writer.written} visits are saved successfully, {writer.rejected} rejected")
+    return writer.written
+
+
+
+@timed()
 def findVisitsByDate(patients, year=None, month=None):
     """
     Find visits by year, month, or both.
@@ -273,72 +228,86 @@ def findVisitsByDate(patients, year=None, month=None):
     visits = []
     
     try:
-        # Convert year and month to strings if they are not None
-        year_str = str(year) if year is not None else None
-        if month is not None:
-            month_str = str(int(month))  # Convert to int and back to remove leading zero
-            if len(month_str) == 1:
-                month_str = '0' + month_str
-        else:
-            month_str = None
+        year = int(year) if year is not None else None
+        month = int(month) if month is not None else None
+
+        # Collections with a date index answer with binary searches instead of a scan
+        date_index = getattr(patients, 'dateIndex', None)
+        if date_index is not None and (year is not None or month is not None):
+            return date_index.find(year, month)
+
+        if metrics.enabled:
+            metrics.count('query.findVisitsByDate.visitsScanned', sum(map(len, patients.values())))
+
         # Iterate through patients and their visits
         for patientId, visits_list in patients.items():
             for visit in visits_list:
-                # Parse visit date
-                visit_date = visit[0]
+                # Visits carry their date parsed; other visits look theirs up once per distinct date
+                visit_date = visit.date if type(visit) is Visit else visitDate(visit[0])
 
                 # Check if year and month filters match
-                if (not year_str or visit_date.startswith(year_str)) and (not month_str or visit_date[5:7] == month_str):
+                if (year is None or visit_date.year == year) and (month is None or visit_date.month == month):
                     visits.append((patientId, visit))
 
         
+        metrics.count('query.findVisitsByDate.visitsFound', len(visits))
         return visits
 
     except Exception as e:
         raise e
 
 
-def findPatientsWhoNeedFollowUp(patients):
+@timed()
+def findPatientsWhoNeedFollowUp(patients, rules=None):
     """
     Find patients who need follow-up visits based on abnormal vital signs.
 
     patients: A dictionary of patient IDs, where each patient has a list of visits.
+    rules: A RuleSet of follow-up criteria (see followup_rules), or None for the criteria
+           of needsFollowUp.
     return: A list of patient IDs that need follow-up visits to to abnormal health stats.
     """
     followup_patients = []
-    for patientId, visits_list in patients.items():
-        last_visit = visits_list[-1]  # Get the last visit for each patient
 
-        temperature, heart_rate, respiratory_rate, systolic_bp, diastolic_bp, spo2 = last_visit[1:7]
+    # Configured rule sets screen the recent visits of all patients at once
+    if rules is not None:
+        return rules.flagged(patients)
+
+    # Collections that track follow-up status incrementally already have the answer
+    tracker = getattr(patients, 'followUp', None)
+    if tracker is not None:
+        return tracker.patients()
 
+    for patientId, last_visit in lastVisits(patients):  # Get the last visit for each patient
         # Check if any vital signs are abnormal
-        if (temperature > 37.5 or temperature < 36.0) or (heart_rate > 100 or heart_rate < 60) or \
-           (systolic_bp > 140 or systolic_bp < 90) or (diastolic_bp > 90 or diastolic_bp < 60):
+        if needsFollowUp(last_visit):
             followup_patients.append(patientId)
             
     return followup_patients
 
 
+@timed()
 def deleteAllVisitsOfPatient(patients, patientId, filename):
     """
     Delete all visits of a particular patient.
 
     patients: The dictionary of patient IDs, where each patient has a list of visits, to delete data from.
     patientId: The ID of the patient to delete data for.
-    filename: The name of the file to save the updated patient data.
+    filename: The name of the file to save the updated patient data, unless patients has its own storage.
     return: None
+
+    The deletion is recorded as a tombstone in the file's deletion log rather than by
+    rewriting the file; the file is compacted once the log holds COMPACTION_THRESHOLD
+    tombstones (see visit_log), or on demand with compactPatientsFile.
     """
     if patientId in patients:
         # Remove all visits of the patient from the dictionary
         del patients[patientId]
+        notifyPatientDeleted(patients, patientId)
+
+        # Record the deletion in the log instead of rewriting the whole file
+        storageFor(patients, filename).deletePatient(patientId)
 
-        # Open the file in write mode to update patient data
-        with open(filename, 'w') as file:
-            for patient_id, visits_list in patients.items():
-                for visit in visits_list:
-                    visit_line = ','.join(map(str, [patient_id] + visit)) + '\n'
-                    file.write(visit_line)
-        
         print(f"Data for patient {patientId} has been deleted.")
     else:
         raise ValueError(f"No data found for patient with ID {patientId}")
@@ -348,8 +317,11 @@ def deleteAllVisitsOfPatient(patients, patientId, filename):
 
 
 
+@entryPoint
 def main():
-    patients = readPatientsFromFile('patients.txt')
+    # Other programs may append to the file while the menu runs; their visits are
+    # read before every choice
+    follower = TailFollower('patients.txt')
     while True:
         print("\n\nWelcome to the Health Information System\n\n")
         print("1. Display all patient data")
@@ -362,6 +334,8 @@ def main():
         print("8. Quit\n")
 
         choice = input("Enter your choice (1-8): ")
+        follower.refresh()
+        patients = follower.patients
         if choice == '1':
             displayPatientData(patients)
         elif choice == '2':
@@ -389,15 +363,7 @@ def main():
             visits = findVisitsByDate(patients, int(year) if year != '0' else None,
                                       int(month) if month != '0' else None)
             if visits:
-                for visit in visits:
-                    print("Patient ID:", visit[0])
-                    print(" Visit Date:", visit[1][0])
-                    print("  Temperature:", "%.2f" % visit[1][1], "C")
-                    print("  Heart Rate:", visit[1][2], "bpm")
-                    print("  Respiratory Rate:", visit[1][3], "bpm")
-                    print("  Systolic Blood Pressure:", visit[1][4], "mmHg")
-                    print("  Diastolic Blood Pressure:", visit[1][5], "mmHg")
-                    print("  Oxygen Saturation:", visit[1][6], "%")
+                renderVisitList(visits, out=sys.stdout)
             else:
                 print("No visits found for the specified year/month.")
         elif choice == '6':
@@ -412,6 +378,7 @@ def main():
             patientID = input("Enter patient ID: ")
             deleteAllVisitsOfPatient(patients, int(patientID), "patients.txt")
         elif choice == '8':
+            compactPatientsFile('patients.txt')
             print("Goodbye!")
             break
         else:
@@ -419,4 +386,8 @@ def main():
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        # Subcommands and --batch are handled by the command line interface
+        from cli import main as runCommandLine
+        sys.exit(runCommandLine(sys.argv[1:]))
     main()
@@ -0,0 +1,278 @@
+"""
+Monthly rollups of vital signs, for population trends over months and years.
+
+A rollup holds, for one calendar month, the aggregate of the visits in that month (count,
+sum, sum of squares, minimum and maximum of each vital sign, as in a PatientAggregate of
+aggregate_cache) and the number of those visits with abnormal vital signs (see
+needsFollowUp). Rollups merge by adding up these partials, so a trend over many years is
+answered from a few hundred months instead of a findVisitsByDate scan per month.
+
+MonthlyRollups is one of the indexes of a patients collection (see patient_records): it
+is built in one pass over the visits when it is first read, appending a visit then adds
+it to its month, and deleting a patient marks the months it had visits in as stale. Minimums and maximums
+cannot be taken back, so a stale month is aggregated again, from the date index of the
+collection, the next time it is read.
+"""
+from bisect import bisect_right
+from itertools import accumulate, chain, repeat
+from operator import attrgetter
+
+from aggregate_cache import PatientAggregate
+from followup import needsFollowUp
+from instrumentation import metrics
+from visit_record import VITAL_NAMES, Visit, VisitDate, visitDate, vitalColumns
+
+
+def _monthOf(date):
+    """
+    Returns the yyyymm month of a visit date, or None if it does not start with a year
+    and a month. Like findVisitsByDate, only those are read from a date string.
+
+    date: A date string, or a packed yyyymmdd integer.
+    """
+    if isinstance(date, int):
+        return date // 100
+    date = date if type(date) is VisitDate else visitDate(date)
+    if date.year is None or date.month is None:
+        return None
+    return date.year * 100 + date.month
+
+
+def _visitMonth(visit):
+    """
+    Returns the yyyymm month of a visit, or None if its date has no year and month.
+    """
+    return _monthOf(visit.date if type(visit) is Visit else visit[0])
+
+
+class MonthRollup(PatientAggregate):
+    """
+    The aggregate of the visits of one month, or of several months merged, and the
+    number of them that need a follow-up (followUps).
+    """
+
+    __slots__ = ('followUps',)
+
+    def __init__(self):
+        super().__init__()
+        self.followUps = 0
+
+    def add(self, visit):
+        """
+        Adds one visit.
+        """
+        super().add(visit)
+        self.lastVisit = None
+        self.followUps += needsFollowUp(visit)
+
+    def merge(self, other):
+        """
+        Adds the visits rolled up by another MonthRollup to this one.
+        """
+        super().merge(other)
+        self.followUps += other.followUps
+
+    def asDict(self):
+        """
+        Returns the rollup as nested dictionaries, e.g. for JSON output.
+        """
+        vitals = zip(VITAL_NAMES, self.means(), self.minimums, self.maximums, self.stdevs())
+        return {'visitCount': self.count, 'followUpCount': self.followUps,
+                'vitals': {name: {'mean': mean, 'minimum': minimum, 'maximum': maximum, 'stdev': stdev}
+                           for name, mean, minimum, maximum, stdev in vitals}}
+
+
+def _visitsByMonth(patients):
+    """
+    Collects the patient ID, yyyymm month and vital signs of every visit of a patients
+    collection with a month, as columns sorted by month.
+
+    Returns a tuple (IDs, months, list of six vital sign columns).
+    """
+    # The row numbers of the visits in a VisitStore, or the visits themselves
+    if hasattr(patients, 'patientRows'):
+        visits = []
+        ids = []
+        for patientId in patients:
+            count = len(visits)
+            visits.extend(patients.patientRows(patientId))
+            ids.extend(repeat(patientId, len(visits) - count))
+        dates = list(map(patients.dates.__getitem__, visits))
+    else:
+        visits = list(chain.from_iterable(patients.values()))
+        ids = list(chain.from_iterable(repeat(patientId, len(patientVisits))
+                                       for patientId, patientVisits in patients.items()))
+        try:
+            dates = list(map(attrgetter('date'), visits))
+        except AttributeError:
+            dates = [visit[0] for visit in visits]
+
+    # Visits share few distinct dates, so each is looked at once
+    months = {date: _monthOf(date) for date in set(dates)}
+    months = list(map(months.__getitem__, dates))
+    order = range(len(months))
+    if None in months:
+        order = [row for row, month in zip(order, months) if month is not None]
+    order = sorted(order, key=months.__getitem__)
+    ids = list(map(ids.__getitem__, order))
+    months = list(map(months.__getitem__, order))
+    visits = list(map(visits.__getitem__, order))
+    if hasattr(patients, 'patientRows'):
+        return ids, months, [list(map(column.__getitem__, visits)) for column in patients.columns()]
+    return ids, months, vitalColumns(visits)
+
+
+class MonthlyRollups:
+    """
+    The MonthRollups of every month with visits in a patients collection.
+    """
+
+    def __init__(self, patients=None):
+        """
+        patients: The dictionary of patient IDs to lists of visits, or VisitStore, to roll
+                  up; if None, the rollups are empty until rebuild is called.
+        """
+        self._patients = None
+        self._cells = {}
+        self._members = {}
+        self._stale = set()
+        self._built = False
+        if patients is not None:
+            self.rebuild(patients)
+
+    def rebuild(self, patients):
+        """
+        Forgets every rollup; the visits of the patients collection are rolled up again
+        when the rollups are next read.
+        """
+        self._patients = patients
+        self._cells = {}
+        self._members = {}
+        self._stale = set()
+        self._built = False
+
+    def _build(self):
+        """
+        Rolls up all visits of the patients collection, in one pass over them sorted by month.
+        """
+        ids, months, columns = _visitsByMonth(self._patients)
+        # Running count of the visits that need a follow-up, so a month's is a difference
+        followUps = list(accumulate(map(needsFollowUp, zip(repeat(None), *columns)), initial=0))
+        start = 0
+        for month in dict.fromkeys(months):
+            end = bisect_right(months, month, start)
+            cell = MonthRollup.fromColumns([column[start:end] for column in columns])
+            cell.followUps = followUps[end] - followUps[start]
+            self._cells[month] = cell
+            self._members[month] = set(ids[start:end])
+            start = end
+        self._built = True
+        metrics.count('rollups.builds')
+
+    def visitAdded(self, patientId, visit):
+        """
+        Adds a visit appended to the patients collection to its month.
+        """
+        month = _visitMonth(visit) if self._built else None
+        if month is None:
+            return
+        members = self._members.get(month)
+        if members is None:
+            members = self._members[month] = set()
+            self._cells[month] = MonthRollup()
+        members.add(patientId)
+        # A stale month is aggregated again from the collection, which has the visit
+        if month not in self._stale:
+            self._cells[month].add(visit)
+
+    def visitsAdded(self, visits):
+        """
+        Adds (patientId, visit) pairs appended to the patients collection to their months.
+        """
+        for patientId, visit in visits:
+            self.visitAdded(patientId, visit)
+
+    def patientDeleted(self, patientId):
+        """
+        Marks the months a deleted patient had visits in as stale.
+        """
+        for month, members in self._members.items():
+            if patientId in members:
+                members.discard(patientId)
+                self._stale.add(month)
+
+    def _refresh(self, low, high):
+        """
+        Rolls up the visits if that was not done yet, or aggregates the visits of the
+        stale months between two yyyymm months again.
+        """
+        if not self._built:
+            self._build()
+        stale = [month for month in self._stale if low <= month <= high]
+        if not stale:
+            return
+        patients = self._patients
+        dateIndex = getattr(patients, 'dateIndex', None)
+        for month in stale:
+            year, number = divmod(month, 100)
+            if dateIndex is not None:
+                found = dateIndex.find(year, number)
+            else:
+                found = [(patientId, visit) for patientId, visits in patients.items()
+                         for visit in visits if _visitMonth(visit) == month]
+            if not found:
+                del self._cells[month], self._members[month]
+                continue
+            visits = [visit for _, visit in found]
+            cell = MonthRollup.fromColumns(vitalColumns(visits))
+            cell.followUps = sum(map(needsFollowUp, visits))
+            self._cells[month] = cell
+            self._members[month] = {patientId for patientId, _ in found}
+        metrics.count('rollups.monthsRefreshed', len(stale))
+        self._stale.difference_update(stale)
+
+    def months(self, startYear=None, endYear=None):
+        """
+        Returns the rollups of the months with visits, in date order.
+
+        startYear: The first year to include, or None to start with the first visit.
+        endYear: The last year to include, or None to end with the last visit.
+        return: A list of ((year, month), MonthRollup). The rollups must not be modified
+                by the caller.
+        """
+        low = startYear * 100 if startYear is not None else -1
+        high = endYear * 100 + 99 if endYear is not None else float('inf')
+        self._refresh(low, high)
+        return [(divmod(month, 100), self._cells[month]) for month in sorted(self._cells) if low <= month <= high]
+
+    def __len__(self):
+        return len(self._cells)
+
+
+def vitalTrends(patients, startYear=None, endYear=None, monthly=False):
+    """
+    Rolls up the vital signs of all patients per year or per month.
+
+    patients: A patients collection. Collections with rollups (see patient_records) answer
+              from them; others are rolled up here, in one pass.
+    startYear: The first year to include, or None to start with the first visit.
+    endYear: The last year to include, or None to end with the last visit.
+    monthly: Whether to roll up per month rather than per year.
+    return: A list of (period, MonthRollup) in date order, where the period is 'yyyy' or
+            'yyyy-mm'. The rollups must not be modified by the caller.
+    """
+    if startYear is not None and endYear is not None and startYear > endYear:
+        raise ValueError("The start year must not be after the end year.")
+    rollups = getattr(patients, 'rollups', None)
+    if rollups is None:
+        rollups = MonthlyRollups(patients)
+    months = rollups.months(startYear, endYear)
+    if monthly:
+        return [("%04d-%02d" % month, cell) for month, cell in months]
+    years = {}
+    for (year, _), cell in months:
+        total = years.get(year)
+        if total is None:
+            total = years[year] = MonthRollup()
+        total.merge(cell)
+    return [("%04d" % year, total) for year, total in years.items()]
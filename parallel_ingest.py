@@ -0,0 +1,152 @@
+"""
+Multi-process loading of large or sharded patients files.
+
+Each file is cut into chunks at line boundaries, and the chunks are parsed by the
+block-wise parser of bulk_ingest in a pool of worker processes. A first round of jobs
+counts the lines of every chunk, so that each chunk knows the number of its first line
+and reports errors with the line numbers of the whole file. The parsed columns come back
+in chunk order and are joined, so visits keep their file order within every patient.
+
+Several files (for example one per clinic) are loaded as if they were concatenated in
+the order given. Line numbers then count from 1 in every file, and error messages are
+prefixed with the name of the file they refer to.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from bulk_ingest import VisitColumns, groupVisits, readColumns
+from patient_records import PatientRecords
+from visit_store import VisitStore
+
+# Files smaller than this many bytes per worker are parsed in fewer chunks
+MIN_CHUNK_SIZE = 1 << 20
+
+
+def splitFile(fileName, parts):
+    """
+    Cuts a file into byte ranges that start and end at line boundaries.
+
+    fileName: The name of the file to split.
+    parts: The number of ranges to aim for; fewer are returned for small files.
+    Returns a list of (start, end) byte offsets covering the whole file.
+    """
+    size = os.path.getsize(fileName)
+    parts = max(1, min(parts, size // MIN_CHUNK_SIZE))
+    bounds = [0]
+    with open(fileName, 'rb') as file:
+        for i in range(1, parts):
+            file.seek(max(size * i // parts - 1, bounds[-1]))
+            file.readline()  # move past the line the guess landed in
+            position = file.tell()
+            if position >= size:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _countLines(fileName, start, end):
+    """
+    Returns the number of line breaks between two byte offsets of a file.
+    """
+    count = 0
+    with open(fileName, 'rb') as file:
+        file.seek(start)
+        remaining = end - start
+        while remaining:
+            block = file.read(min(remaining, 1 << 24))
+            if not block:
+                break
+            count += block.count(b'\n')
+            remaining -= len(block)
+    return count
+
+
+def _parseChunk(fileName, start, end, firstLine):
+    """
+    Parses one chunk of a file in a worker process.
+
+    Returns a tuple (VisitColumns, list of error messages).
+    """
+    messages = []
+    columns = readColumns(fileName, report=messages.append, start=start, firstLine=firstLine, end=end)
+    return columns, messages
+
+
+def readColumnsParallel(fileNames, workers=None, report=print):
+    """
+    Reads and validates one or more patients files into a single VisitColumns, parsing
+    chunks of them in parallel.
+
+    fileNames: The name of a patients file, or a list of names of shard files.
+    workers: The number of worker processes; defaults to the number of CPUs.
+    report: A function called with each error message, in file and line order.
+    Returns a VisitColumns with the visits of all files in order.
+    """
+    if isinstance(fileNames, str):
+        fileNames = [fileNames]
+        prefix = False
+    else:
+        prefix = len(fileNames) > 1
+    workers = workers or os.cpu_count() or 1
+
+    chunks = []
+    for fileName in fileNames:
+        try:
+            ranges = splitFile(fileName, workers)
+        except OSError:
+            report(f"The file '{fileName}' could not be found.")
+            continue
+        chunks.extend((fileName, start, end) for start, end in ranges)
+
+    columns = VisitColumns()
+    if not chunks:
+        return columns
+    if len(chunks) == 1:
+        # Not worth starting worker processes for
+        fileName, start, end = chunks[0]
+        results = [_parseChunk(fileName, start, end, 1)]
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(chunks)))
+        counts = list(pool.map(_countLines, *zip(*chunks)))
+        first_lines = []
+        for i, (fileName, start, _) in enumerate(chunks):
+            first_lines.append(1 if start == 0 else first_lines[-1] + counts[i - 1])
+        results = pool.map(_parseChunk, *zip(*chunks), first_lines)
+    try:
+        for (fileName, _, _), (chunk_columns, messages) in zip(chunks, results):
+            for message in messages:
+                report(f"{fileName}: {message}" if prefix else message)
+            columns.extend(chunk_columns)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return columns
+
+
+def readPatientsParallel(fileNames, workers=None):
+    """
+    Reads one or more patients files into a dictionary of patient IDs to lists of
+    visits, parsing chunks of them in parallel.
+
+    fileNames: The name of a patients file, or a list of names of shard files.
+    workers: The number of worker processes; defaults to the number of CPUs.
+    Returns the same PatientRecords dictionary as readPatientsFromFile, and reports
+    invalid lines with the same messages.
+    """
+    patients = {}
+    groupVisits([readColumnsParallel(fileNames, workers)], patients)
+    return PatientRecords(patients)
+
+
+def loadVisitStoreParallel(fileNames, workers=None):
+    """
+    Loads one or more patients files into a VisitStore, parsing chunks of them in parallel.
+
+    fileNames: The name of a patients file, or a list of names of shard files.
+    workers: The number of worker processes; defaults to the number of CPUs.
+    Returns a VisitStore.
+    """
+    return VisitStore.fromColumns(readColumnsParallel(fileNames, workers))
@@ -0,0 +1,387 @@
+"""
+A persisted index of where the lines of each patient are in a patients file.
+
+The index is written next to the text file (patients.txt -> patients.txt.idx) and maps
+every patient ID to the byte ranges of its lines, so the visits of one patient are read
+by seeking to those ranges instead of parsing the whole file:
+
+    header
+    sorted entries      (patient ID, offset, length, line number), int64 each, ordered
+                        by patient ID, then offset
+    appended entries    the same, in file order, for lines indexed since the entries
+                        were last sorted
+
+An entry covers a run of consecutive lines of one patient: offset is where its first
+line starts, length runs to the end of its last line (without the newline), and line
+number is the number of its first line. A lookup bisects the sorted entries in a memory
+map of the index and scans the appended ones, of which there are at most MERGE_THRESHOLD:
+beyond that they are merged into the sorted ones. Its cost thus depends on the patient,
+not on the size of the file.
+
+Like a snapshot (see snapshot), the header records how many bytes of the text file the
+index covers and the last bytes of that region. If the file has only grown, the new
+lines are indexed and their entries appended; TextStorage does this right after saving
+visits (see storage). If the file shrank or was rewritten, for example by a compaction,
+the index is built again. Deleted patients stay in the index: a lookup applies the
+deletion log (see visit_log) to the lines it reads.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import MutableMapping
+from itertools import chain
+
+from bulk_ingest import iterLineBlocks, parseLines
+from snapshot import sourceState, tailStart
+from visit_log import readTombstones
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; updates are then not locked against each other
+    fcntl = None
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'PATIDX\x00\x01'
+
+# magic, byte order, source size, source mtime, source lines, source ends with newline,
+# length of the signature, signature (last bytes of the source), sorted entries, entries
+HEADER = struct.Struct('=8scQdQ?B64sQQ5x')
+
+# Number of int64 fields of an entry
+ENTRY_FIELDS = 4
+ENTRY_SIZE = 8 * ENTRY_FIELDS
+
+# Number of appended entries above which they are merged into the sorted ones; it bounds
+# the entries every lookup scans
+MERGE_THRESHOLD = 1024
+
+
+def indexPath(fileName):
+    """
+    Returns the name of the patient index of a patients file.
+    """
+    return fileName + INDEX_SUFFIX
+
+
+def _indexLines(fileName, start, firstLine, end):
+    """
+    Indexes the lines of a patients file between two byte offsets.
+
+    fileName: The name of the patients file.
+    start: The byte offset of the first line.
+    firstLine: The line number of the first line.
+    end: The byte offset to stop at.
+    return: A tuple (entries, lines): an array('q') of entries in file order, and the
+            number of lines read. Lines that do not start with a patient ID are skipped.
+    """
+    entries = array('q')
+    line_num = firstLine
+    run_id = run_offset = run_end = None
+    for lines, offsets in iterLineBlocks(fileName, start=start, withOffsets=True, end=end):
+        for line, offset in zip(lines, offsets):
+            try:
+                patientId = int(line.partition(',')[0])
+            except ValueError:
+                patientId = None
+            line_end = offset + (len(line) if line.isascii() else len(line.encode()))
+            if patientId is not None and patientId == run_id and offset == run_end + 1:
+                run_end = line_end
+            else:
+                if run_id is not None:
+                    entries.extend((run_id, run_offset, run_end - run_offset, run_line))
+                run_id = patientId
+                run_offset, run_end, run_line = offset, line_end, line_num
+            line_num += 1
+    if run_id is not None:
+        entries.extend((run_id, run_offset, run_end - run_offset, run_line))
+    return entries, line_num - firstLine
+
+
+def _sortEntries(entries):
+    """
+    Returns an array('q') of entries ordered by patient ID, then offset.
+    """
+    rows = sorted(zip(*(entries[field::ENTRY_FIELDS] for field in range(ENTRY_FIELDS))))
+    return array('q', chain.from_iterable(rows))
+
+
+def _packHeader(size, mtime, lines, endsWithNewline, signature, sortedCount, count):
+    return HEADER.pack(INDEX_MAGIC, sys.byteorder[0].encode(), size, mtime, lines, endsWithNewline,
+                       len(signature), signature, sortedCount, count)
+
+
+def writeIndex(fileName, entries, size, mtime):
+    """
+    Writes the index of a patients file with all its entries sorted.
+
+    fileName: The name of the patients file.
+    entries: An array('q') of the entries, in any order.
+    size: The number of bytes of the patients file the entries cover.
+    mtime: The modification time of the patients file.
+    """
+    lines, ends_with_newline, signature = sourceState(fileName, size)
+    entries = _sortEntries(entries)
+    count = len(entries) // ENTRY_FIELDS
+    header = _packHeader(size, mtime, lines, ends_with_newline, signature, count, count)
+
+    # Write to a temporary file and rename it, so a crash never leaves a partial index
+    path = indexPath(fileName)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(header)
+        file.write(entries)
+    os.replace(temp_path, path)
+
+
+def buildIndex(fileName):
+    """
+    Indexes a whole patients file and writes its index.
+
+    fileName: The name of the patients file.
+    """
+    size = os.path.getsize(fileName)
+    mtime = os.path.getmtime(fileName)
+    entries, _ = _indexLines(fileName, 0, 1, size)
+    writeIndex(fileName, entries, size, mtime)
+
+
+def _readHeader(file):
+    """
+    Returns the header fields of an open index file, or None if it is not a usable index.
+    """
+    data = file.read(HEADER.size)
+    if len(data) < HEADER.size:
+        return None
+    header = HEADER.unpack(data)
+    if header[0] != INDEX_MAGIC or header[1] != sys.byteorder[0].encode():
+        return None
+    return header
+
+
+def updateIndex(fileName):
+    """
+    Brings the index of a patients file up to date, if the file has one: indexes the
+    lines appended since it was written, or builds it again if the file was rewritten.
+
+    fileName: The name of the patients file.
+    return: True if the file has an index.
+    """
+    try:
+        file = open(indexPath(fileName), 'r+b')
+    except FileNotFoundError:
+        return False
+    with file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        header = _readHeader(file)
+        size = os.path.getsize(fileName)
+        mtime = os.path.getmtime(fileName)
+        start = None
+        if header is not None:
+            _, _, source_size, source_mtime, lines, ends_with_newline, signature_length, signature, \
+                sorted_count, count = header
+            if os.fstat(file.fileno()).st_size >= HEADER.size + ENTRY_SIZE * count:
+                start = tailStart(fileName, source_size, source_mtime, ends_with_newline,
+                                  signature[:signature_length], size, mtime)
+        if start is None:
+            buildIndex(fileName)
+            return True
+        if start == size and size == source_size:
+            return True
+
+        entries, new_lines = _indexLines(fileName, start, lines + 1, size)
+        count += len(entries) // ENTRY_FIELDS
+        if count - sorted_count > MERGE_THRESHOLD:
+            file.seek(HEADER.size)
+            all_entries = array('q')
+            all_entries.frombytes(file.read(ENTRY_SIZE * (count - len(entries) // ENTRY_FIELDS)))
+            all_entries.extend(entries)
+            writeIndex(fileName, all_entries, size, mtime)
+            return True
+
+        # Entries past the count in the header are left over from an interrupted update
+        file.seek(HEADER.size + ENTRY_SIZE * (count - len(entries) // ENTRY_FIELDS))
+        file.write(entries)
+        file.truncate()
+        with open(fileName, 'rb') as source:
+            source.seek(max(0, size - len(signature)))  # the 64 bytes sourceState keeps
+            signature = source.read(size - source.tell())
+        ends_with_newline = signature.endswith(b'\n') or size == 0
+        file.seek(0)
+        file.write(_packHeader(size, mtime, lines + new_lines, ends_with_newline, signature, sorted_count, count))
+    return True
+
+
+class PatientIndex:
+    """
+    The memory-mapped index of a patients file. Use PatientIndex.open to create one.
+    """
+
+    def __init__(self, fileName, entries, sortedCount, mapping=None):
+        """
+        fileName: The name of the patients file.
+        entries: A memoryview of the entries as int64, the sorted ones first.
+        sortedCount: The number of sorted entries.
+        mapping: The memory map backing entries, closed by close.
+        """
+        self.fileName = fileName
+        self._mapping = mapping
+        self._sorted = entries[:ENTRY_FIELDS * sortedCount]
+        self._sortedIds = self._sorted[0::ENTRY_FIELDS]
+        self._appended = entries[ENTRY_FIELDS * sortedCount:]
+        self._appendedIds = self._appended[0::ENTRY_FIELDS]
+
+    @classmethod
+    def open(cls, fileName):
+        """
+        Opens the index of a patients file, building or updating it first as needed.
+        If the index cannot be written, the file is indexed in memory instead.
+
+        fileName: The name of the patients file.
+        Returns a PatientIndex. If the file does not exist, the index is empty.
+        """
+        if not os.path.exists(fileName):
+            print(f"The file '{fileName}' could not be found.")
+            return cls(fileName, memoryview(array('q')), 0)
+        try:
+            if not updateIndex(fileName):
+                buildIndex(fileName)
+            with open(indexPath(fileName), 'rb') as file:
+                header = _readHeader(file)
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError as e:
+            print(f"Could not write patient index for '{fileName}': {e}")
+            entries, _ = _indexLines(fileName, 0, 1, os.path.getsize(fileName))
+            entries = _sortEntries(entries)
+            return cls(fileName, memoryview(entries), len(entries) // ENTRY_FIELDS)
+        count = header[9]
+        entries = memoryview(mapping)[HEADER.size:HEADER.size + ENTRY_SIZE * count].cast('q')
+        return cls(fileName, entries, header[8], mapping)
+
+    def ranges(self, patientId):
+        """
+        Returns the (offset, length, line number) of every run of lines of a patient,
+        in file order.
+        """
+        entries = self._sorted
+        first = bisect_left(self._sortedIds, patientId)
+        last = bisect_right(self._sortedIds, patientId, first)
+        ranges = [tuple(entries[row * ENTRY_FIELDS + 1:(row + 1) * ENTRY_FIELDS]) for row in range(first, last)]
+        appended = self._appended
+        for row, appendedId in enumerate(self._appendedIds):
+            if appendedId == patientId:
+                ranges.append(tuple(appended[row * ENTRY_FIELDS + 1:(row + 1) * ENTRY_FIELDS]))
+        return ranges
+
+    def patientIds(self):
+        """
+        Returns the IDs of all patients with lines in the file, deleted or not, in
+        ascending order.
+        """
+        return sorted(set(self._sortedIds).union(self._appendedIds))
+
+    def readVisits(self, patientId, report=print):
+        """
+        Reads the visits of one patient from the patients file, like the loaders do:
+        lines removed by the deletion log are skipped and invalid lines are reported.
+
+        patientId: The ID of the patient.
+        report: A function called with each error message.
+        Returns a list of Visits, empty if the patient has no valid visits.
+        """
+        ranges = self.ranges(patientId)
+        if not ranges:
+            return []
+        cutoff = readTombstones(self.fileName)[0].get(patientId, 0)
+        visits = []
+        with open(self.fileName, 'rb') as file:
+            for offset, length, line_num in ranges:
+                if offset + length <= cutoff:
+                    continue
+                file.seek(offset)
+                lines = file.read(length).decode().split('\n')
+                if offset < cutoff:
+                    # Only the lines starting at or past the cutoff were added after the deletion
+                    position = offset
+                    skipped = 0
+                    while position < cutoff:
+                        position += len(lines[skipped].encode()) + 1
+                        skipped += 1
+                    lines = lines[skipped:]
+                    line_num += skipped
+                visits.extend(visit for _, visit in parseLines(lines, line_num, report).visits())
+        return visits
+
+    def close(self):
+        """
+        Releases the memory-mapped index file.
+        """
+        self._sorted = self._sortedIds = self._appended = self._appendedIds = None
+        if self._mapping is not None:
+            self._mapping.close()
+
+
+class IndexedPatients(MutableMapping):
+    """
+    The patients of a text file, read one patient at a time through its PatientIndex
+    instead of loaded all at once.
+
+    Looking up a patient reads only that patient's lines, and the visits read or added
+    are kept, so the functions of main_22BECD87 can be given an IndexedPatients for
+    queries and changes that concern one patient. Iterating lists the patients with
+    lines in the file, including ones all of whose lines are invalid or deleted.
+    """
+
+    def __init__(self, fileName, report=print):
+        """
+        fileName: The name of the patients file.
+        report: A function called with the error message of each invalid line read.
+        """
+        self.fileName = fileName
+        self.index = PatientIndex.open(fileName)
+        self.report = report
+        self._visits = {}
+        self._deleted = set()
+
+    def __getitem__(self, patientId):
+        visits = self._visits.get(patientId)
+        if visits is None:
+            if patientId in self._deleted:
+                raise KeyError(patientId)
+            visits = self.index.readVisits(patientId, self.report)
+            if not visits:
+                raise KeyError(patientId)
+            self._visits[patientId] = visits
+        return visits
+
+    def __setitem__(self, patientId, visits):
+        self._visits[patientId] = visits
+        self._deleted.discard(patientId)
+
+    def __delitem__(self, patientId):
+        self[patientId]
+        del self._visits[patientId]
+        self._deleted.add(patientId)
+
+    def __contains__(self, patientId):
+        try:
+            self[patientId]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        patientIds = set(self.index.patientIds()).union(self._visits).difference(self._deleted)
+        return iter(sorted(patientIds))
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def close(self):
+        """
+        Releases the patient index of the file.
+        """
+        self.index.close()
@@ -0,0 +1,18 @@
+from visit_validation import VALID, parseFields, rejectionMessage
+
+
+def parsePatientLine(line, line_num):
+    """
+    Parses and validates a single line of the patients file.
+
+    line: The raw line read from the file.
+    line_num: The line number, used in error messages.
+    Returns a tuple (patientId, date, temperature, heart rate, respiratory rate,
+    systolic blood pressure, diastolic blood pressure, oxygen saturation).
+    Raises ValueError with a message naming the line if the line is invalid; the
+    loaders call parseFields, which returns a rejection code instead.
+    """
+    code, detail = parseFields(line.strip().split(','))
+    if code != VALID:
+        raise ValueError(rejectionMessage(code, detail, line_num))
+    return detail
@@ -0,0 +1,245 @@
+from aggregate_cache import AggregateCache
+from date_index import DateIndex
+from followup import FollowUpTracker
+from monthly_rollups import MonthlyRollups
+
+
+class VisitList(list):
+    """
+    The list of visits of one patient in a PatientRecords. Visits appended to it are
+    counted until the indexes are told about them (see notifyVisitAdded); any other
+    change to it makes the indexes stale. Either way, the indexes are rebuilt before
+    they are next read.
+    """
+
+    __slots__ = ('_records',)
+
+    def __init__(self, visits=(), records=None):
+        super().__init__(visits)
+        self._records = records
+
+    def append(self, visit):
+        super().append(visit)
+        if self._records is not None:
+            self._records._unindexed += 1
+
+    def extend(self, visits):
+        count = len(self)
+        super().extend(visits)
+        if self._records is not None:
+            self._records._unindexed += len(self) - count
+
+    def __iadd__(self, visits):
+        self.extend(visits)
+        return self
+
+    def _changed(self):
+        if self._records is not None:
+            self._records._stale = True
+
+
+def _staleAfter(name):
+    """
+    Returns a list method that makes the indexes of the PatientRecords stale.
+    """
+    method = getattr(list, name)
+
+    def change(self, *args):
+        result = method(self, *args)
+        self._changed()
+        return result
+
+    change.__name__ = name
+    return change
+
+
+for _name in ('insert', 'pop', 'remove', 'clear', 'sort', 'reverse', '__setitem__', '__delitem__', '__imul__'):
+    setattr(VisitList, _name, _staleAfter(_name))
+
+
+class Acknowledgement:
+    """
+    An index of a PatientRecords or VisitStore that takes off the counts of changes the
+    indexes were told about, so that only the changes they missed are left.
+    """
+
+    def __init__(self, records):
+        self._records = records
+
+    def rebuild(self, patients):
+        self._records._unindexed = 0
+        self._records._stale = False
+
+    def visitAdded(self, patientId, visit):
+        self._records._unindexed -= 1
+
+    def visitsAdded(self, visits):
+        self._records._unindexed -= len(visits)
+
+    def patientDeleted(self, patientId):
+        self._records._unindexed -= 1
+
+
+class PatientRecords(dict):
+    """
+    The dictionary of patient IDs to lists of visits returned by readPatientsFromFile,
+    carrying secondary indexes over those visits: a DateIndex (dateIndex), a
+    FollowUpTracker (followUp), an AggregateCache of per-patient vital sign
+    aggregates (aggregates) and MonthlyRollups of the visits of each month (rollups).
+
+    Like those of a VisitStore, each index is built on first use and registered in
+    indexes, so loading pays nothing for indexes no query reads. addPatientData and
+    deleteAllVisitsOfPatient keep the indexes up to date. Other changes to the dictionary
+    or its visit lists (held as VisitList) are noticed, and the indexes are rebuilt when
+    they are next read. Changing a visit itself is not: code that does should call
+    rebuildIndexes afterwards.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        for patientId, visits in dict(*args, **kwargs).items():
+            # Lists a loader made for this dictionary are taken over rather than copied
+            if type(visits) is not VisitList or visits._records is not None:
+                visits = VisitList(visits)
+            visits._records = self
+            dict.__setitem__(self, patientId, visits)
+        # Number of visits appended and patients deleted the indexes were not told about
+        self._unindexed = 0
+        # Whether the dictionary changed in a way the indexes cannot be told about
+        self._stale = False
+        self._dateIndex = None
+        self._followUp = None
+        self._aggregates = None
+        self._rollups = None
+        self.indexes = [Acknowledgement(self)]
+
+    def rebuildIndexes(self):
+        """
+        Rebuilds every index from the current contents of the dictionary.
+        """
+        for index in self.indexes:
+            index.rebuild(self)
+
+    def _currentIndexes(self):
+        """
+        Rebuilds the indexes if the dictionary changed without them being told.
+        """
+        if self._unindexed or self._stale:
+            self.rebuildIndexes()
+
+    def _register(self, index):
+        """
+        Builds a new index from the dictionary and registers it in indexes.
+        """
+        index.rebuild(self)
+        self.indexes.append(index)
+        return index
+
+    @property
+    def dateIndex(self):
+        self._currentIndexes()
+        if self._dateIndex is None:
+            self._dateIndex = self._register(DateIndex())
+        return self._dateIndex
+
+    @property
+    def followUp(self):
+        self._currentIndexes()
+        if self._followUp is None:
+            self._followUp = self._register(FollowUpTracker())
+        return self._followUp
+
+    @property
+    def aggregates(self):
+        self._currentIndexes()
+        if self._aggregates is None:
+            self._aggregates = self._register(AggregateCache(self))
+        return self._aggregates
+
+    @property
+    def rollups(self):
+        self._currentIndexes()
+        if self._rollups is None:
+            self._rollups = self._register(MonthlyRollups())
+        return self._rollups
+
+    def __setitem__(self, patientId, visits):
+        old = self.get(patientId)
+        if old is None:
+            self._unindexed += len(visits)
+        else:
+            old._records = None
+            self._stale = True
+        super().__setitem__(patientId, VisitList(visits, self))
+
+    def __delitem__(self, patientId):
+        visits = self[patientId]
+        super().__delitem__(patientId)
+        visits._records = None
+        self._unindexed += 1
+
+    def pop(self, patientId, *default):
+        if patientId not in self:
+            return super().pop(patientId, *default)
+        visits = self[patientId]
+        del self[patientId]
+        return visits
+
+    def popitem(self):
+        patientId, visits = super().popitem()
+        visits._records = None
+        self._unindexed += 1
+        return patientId, visits
+
+    def setdefault(self, patientId, visits=None):
+        if patientId not in self:
+            self[patientId] = visits
+        return self[patientId]
+
+    def update(self, *args, **kwargs):
+        for patientId, visits in dict(*args, **kwargs).items():
+            self[patientId] = visits
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        for visits in self.values():
+            visits._records = None
+        super().clear()
+        self._stale = True
+
+
+def notifyVisitAdded(patients, patientId, visit):
+    """
+    Tells the indexes of a patients collection that a visit was appended.
+
+    patients: The patients collection. Collections without indexes are ignored.
+    patientId: The ID of the patient the visit was added for.
+    visit: The visit that was appended.
+    """
+    for index in getattr(patients, 'indexes', ()):
+        index.visitAdded(patientId, visit)
+
+
+def notifyVisitsAdded(patients, visits):
+    """
+    Tells the indexes of a patients collection that a batch of visits was appended.
+
+    patients: The patients collection. Collections without indexes are ignored.
+    visits: A list of (patientId, visit) pairs, in the order they were appended.
+    """
+    for index in getattr(patients, 'indexes', ()):
+        index.visitsAdded(visits)
+
+
+def notifyPatientDeleted(patients, patientId):
+    """
+    Tells the indexes of a patients collection that all visits of a patient were removed.
+
+    patients: The patients collection. Collections without indexes are ignored.
+    patientId: The ID of the patient that was deleted.
+    """
+    for index in getattr(patients, 'indexes', ()):
+        index.patientDeleted(patientId)
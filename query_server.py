@@ -0,0 +1,415 @@
+"""
+A local query server that keeps a patients file loaded between requests.
+
+Every program that used to run main() paid for reading the whole patients file. The
+server loads it once and answers requests over a localhost TCP port or a Unix socket.
+The protocol is JSON Lines: every request is one JSON object on a line, and every
+response is one line holding {"ok": true, "result": ...} or {"ok": false, "error": ...}.
+A request may carry an "id", which is copied into its response. Requests on one
+connection may be pipelined; they are answered in order.
+
+Requests, by their "op":
+
+    ping
+    stats        [patientId] [detail]    averages (or, with detail, all of computeStats)
+    patient      patientId [offset] [limit]
+    findVisits   [year] [month] [offset] [limit]
+    followUp     [minSeverity]           with severities if the server was given rules
+    trends       [startYear] [endYear] [monthly]  vital signs and follow-ups per year or month
+    add          patientId date temp hr rr sbp dbp spo2
+    delete       patientId
+
+Reads run on the event loop, so any number of connections are served interleaved and
+see a consistent dataset: the indexes and the aggregate cache are not thread-safe, and
+the GIL would leave nothing to gain from reading in threads anyway. Writes are
+serialized by a lock held until their line or tombstone is in the file (or, for a SQLite
+database, until they are committed), so the file records them in the order they were
+applied; the I/O itself runs in a worker thread, and reads are answered meanwhile.
+
+With --follow SECONDS, the server also picks up the visits and deletions other programs
+write to the patients text file, checking for them every SECONDS (see tail_follow).
+The data then changes between requests, so the checks and the writes, which read what
+other programs appended before them, run on the event loop like the reads.
+
+Usage: python query_server.py [--file patients.txt] [--host 127.0.0.1] [--port 8765] [--socket PATH]
+                              [--rules FILE] [--follow SECONDS]
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from main_22BECD87 import findPatientsWhoNeedFollowUp, findVisitsByDate
+from followup_rules import loadRules
+from instrumentation import entryPoint
+from monthly_rollups import vitalTrends
+from patient_records import notifyPatientDeleted
+from storage import SQLITE_SUFFIXES, openPatients, storageFor
+from tail_follow import TailFollower
+from visit_store import VITAL_NAMES
+from visit_writer import recordVisit, recordVisits, validateVisit
+from vital_stats import computeStats, vitalMeans
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Longest request line accepted, in bytes
+MAX_REQUEST_SIZE = 1 << 20
+
+READ_OPS = ('ping', 'stats', 'patient', 'findVisits', 'followUp', 'trends')
+WRITE_OPS = ('add', 'delete')
+
+# Fields of an add request, in the order validateVisit takes them
+ADD_FIELDS = ('patientId', 'date', 'temp', 'hr', 'rr', 'sbp', 'dbp', 'spo2')
+
+
+def _page(items, offset, limit):
+    """
+    Returns a slice of a sequence for paging, checking offset and limit.
+    """
+    offset = int(offset or 0)
+    if offset < 0 or limit is not None and int(limit) < 0:
+        raise ValueError("offset and limit must not be negative")
+    return items[offset:] if limit is None else items[offset:offset + int(limit)]
+
+
+class QueryServer:
+    """
+    Answers requests against one loaded patients collection.
+
+    patients: The loaded patients collection, e.g. from openPatients.
+    fileName: The name of the patients file that add and delete write to, unless
+              patients has its own storage (see storage).
+    rules: A RuleSet (see followup_rules) for followUp requests, or None for the default criteria.
+    follower: The TailFollower that loaded patients, to keep them in step with the file
+              with follow, or None.
+    """
+
+    def __init__(self, patients, fileName, rules=None, follower=None):
+        self.patients = patients
+        self.fileName = fileName
+        self.storage = storageFor(patients, fileName)
+        self.rules = rules
+        self.follower = follower
+        self.requests = 0
+        self._writeLock = asyncio.Lock()
+        self._server = None
+
+    def warm(self):
+        """
+        Builds the indexes the requests use, so that the first requests after start-up
+        do not pay for them.
+        """
+        patients = self.patients
+        getattr(patients, 'dateIndex', None)  # built on first access
+        findPatientsWhoNeedFollowUp(patients)
+        if getattr(patients, 'aggregates', None) is not None:
+            patients.aggregates.merged()
+        if getattr(patients, 'rollups', None) is not None:
+            patients.rollups.months()
+
+    def _patientId(self, request, required=True):
+        patientId = request.get('patientId', 0 if not required else None)
+        if patientId is None:
+            raise ValueError("patientId is required")
+        try:
+            return int(patientId)
+        except (TypeError, ValueError):
+            raise ValueError("Error: 'patientId' should be an integer.")
+
+    def _stats(self, request):
+        patients = self.patients
+        patientId = self._patientId(request, required=False)
+        if patientId and patientId not in patients:
+            raise ValueError(f"Patient with ID {patientId} not found.")
+        if request.get('detail'):
+            return computeStats(patients, [patientId] if patientId else None).asDict()
+        aggregates = getattr(patients, 'aggregates', None)
+        if aggregates is not None:
+            total = aggregates.merged() if not patientId else aggregates.get(patientId)
+            count, means = total.count, total.means()
+        else:
+            count, means = vitalMeans(patients, [patientId] if patientId else None)
+        return {'visitCount': count, 'means': dict(zip(VITAL_NAMES, means))}
+
+    def _patient(self, request):
+        patientId = self._patientId(request)
+        if patientId not in self.patients:
+            raise ValueError(f"Patient with ID {patientId} not found.")
+        visits = _page(self.patients[patientId], request.get('offset'), request.get('limit'))
+        return {'patientId': patientId, 'visits': [list(visit) for visit in visits]}
+
+    def _findVisits(self, request):
+        visits = findVisitsByDate(self.patients, request.get('year'), request.get('month'))
+        visits = _page(visits, request.get('offset'), request.get('limit'))
+        return [[patientId, list(visit)] for patientId, visit in visits]
+
+    def _trends(self, request):
+        years = [request.get(name) for name in ('startYear', 'endYear')]
+        try:
+            years = [int(year) if year is not None else None for year in years]
+        except (TypeError, ValueError):
+            raise ValueError("Error: 'startYear' and 'endYear' should be integers.")
+        trends = vitalTrends(self.patients, *years, monthly=bool(request.get('monthly')))
+        return [dict(period=period, **rollup.asDict()) for period, rollup in trends]
+
+    def read(self, request):
+        """
+        Answers a read request.
+        """
+        op = request['op']
+        if op == 'ping':
+            return 'pong'
+        if op == 'stats':
+            return self._stats(request)
+        if op == 'patient':
+            return self._patient(request)
+        if op == 'findVisits':
+            return self._findVisits(request)
+        if op == 'trends':
+            return self._trends(request)
+        if self.rules is not None:
+            return self.rules.screen(self.patients, request.get('minSeverity'))
+        return findPatientsWhoNeedFollowUp(self.patients)
+
+    async def _save(self, method, *args):
+        """
+        Calls a method of the storage in a worker thread, or on the event loop when
+        following the file, as the follower changes the loaded data before it writes.
+        """
+        if self.follower is not None:
+            return method(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+    async def follow(self, interval):
+        """
+        Adds the visits and deletions other programs wrote to the file every interval
+        seconds, until cancelled.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            async with self._writeLock:
+                if self.follower.refresh() and self.follower.patients is not self.patients:
+                    # The file was rewritten and loaded again
+                    self.patients = self.follower.patients
+                    self.warm()
+
+    async def write(self, request):
+        """
+        Applies an add or delete request to the loaded data, then saves it to storage.
+        If the save fails, the change is taken back out of the loaded data, which then
+        keeps no visit or deletion the storage does not hold.
+        """
+        async with self._writeLock:
+            patients = self.patients
+            if request['op'] == 'add':
+                missing = [name for name in ADD_FIELDS if request.get(name) is None]
+                if missing:
+                    raise ValueError(f"Missing fields: {', '.join(missing)}")
+                patientId, visit = validateVisit(*(request[name] for name in ADD_FIELDS))
+                recordVisit(patients, patientId, visit)
+                try:
+                    await self._save(self.storage.saveVisits, [(patientId, visit)])
+                except Exception:
+                    visits = list(patients[patientId])[:-1]
+                    if visits:
+                        patients[patientId] = visits
+                    else:
+                        del patients[patientId]
+                        notifyPatientDeleted(patients, patientId)
+                    raise
+                return {'patientId': patientId}
+
+            patientId = self._patientId(request)
+            if patientId not in patients:
+                raise ValueError(f"No data found for patient with ID {patientId}")
+            visits = list(patients[patientId])
+            del patients[patientId]
+            notifyPatientDeleted(patients, patientId)
+            try:
+                await self._save(self.storage.deletePatient, patientId)
+            except Exception:
+                recordVisits(patients, [(patientId, visit) for visit in visits])
+                raise
+            return {'patientId': patientId}
+
+    async def handle(self, request):
+        """
+        Answers one decoded request and returns the response object.
+        """
+        self.requests += 1
+        response = {'id': request['id']} if isinstance(request, dict) and 'id' in request else {}
+        try:
+            if not isinstance(request, dict) or request.get('op') not in READ_OPS + WRITE_OPS:
+                raise ValueError(f"Unknown request: {request!r}")
+            if request['op'] in WRITE_OPS:
+                result = await self.write(request)
+            else:
+                result = self.read(request)
+            response.update(ok=True, result=result)
+        except (ValueError, TypeError) as e:
+            response.update(ok=False, error=str(e))
+        except Exception as e:
+            response.update(ok=False, error=f"An unexpected error occurred: {e}")
+        return response
+
+    async def _serveConnection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    writer.write(b'{"ok": false, "error": "Request too long"}\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    response = {'ok': False, 'error': f"Invalid JSON: {e}"}
+                else:
+                    response = await self.handle(request)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socketPath=None):
+        """
+        Starts listening on a Unix socket if socketPath is given, otherwise on host:port.
+        Returns the asyncio server.
+        """
+        if socketPath:
+            self._server = await asyncio.start_unix_server(self._serveConnection, socketPath,
+                                                           limit=MAX_REQUEST_SIZE)
+        else:
+            self._server = await asyncio.start_server(self._serveConnection, host, port,
+                                                      limit=MAX_REQUEST_SIZE)
+        return self._server
+
+    def addresses(self):
+        """
+        Returns the addresses the server listens on, e.g. to learn the port chosen for port 0.
+        """
+        return [sock.getsockname() for sock in self._server.sockets] if self._server else []
+
+    async def serveForever(self):
+        """
+        Serves connections until cancelled, then stops listening.
+        """
+        async with self._server:
+            await self._server.serve_forever()
+
+
+class QueryClient:
+    """
+    An asyncio client for the query server, sending requests over one connection.
+    Use QueryClient.connect to create one.
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def connect(cls, host=DEFAULT_HOST, port=DEFAULT_PORT, socketPath=None):
+        """
+        Connects to a server on a Unix socket if socketPath is given, otherwise on host:port.
+        """
+        if socketPath:
+            reader, writer = await asyncio.open_unix_connection(socketPath, limit=MAX_REQUEST_SIZE)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=MAX_REQUEST_SIZE)
+        return cls(reader, writer)
+
+    def send(self, op, **params):
+        """
+        Sends a request without waiting for its response; responses arrive in order.
+        """
+        params['op'] = op
+        self._writer.write(json.dumps(params).encode() + b'\n')
+
+    async def receive(self):
+        """
+        Returns the next response object. Raises ConnectionError if the server closed the connection.
+        """
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the query server")
+        return json.loads(line)
+
+    async def request(self, op, **params):
+        """
+        Sends a request and returns its result.
+
+        Raises ValueError with the server's message if the request failed.
+        """
+        self.send(op, **params)
+        await self._writer.drain()
+        response = await self.receive()
+        if not response.get('ok'):
+            raise ValueError(response.get('error'))
+        return response.get('result')
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+async def serve(fileName, host=DEFAULT_HOST, port=DEFAULT_PORT, socketPath=None, rules=None, follow=None):
+    """
+    Loads a patients file and serves queries on it until cancelled.
+
+    follow: If given, the number of seconds between checks for what other programs
+            wrote to the patients text file.
+    """
+    if follow:
+        follower = TailFollower(fileName)
+        server = QueryServer(follower.patients, fileName, rules, follower)
+    else:
+        server = QueryServer(openPatients(fileName), fileName, rules)
+    server.warm()
+    await server.start(host, port, socketPath)
+    for address in server.addresses():
+        print("Serving", fileName, "on", address if isinstance(address, str) else "%s:%s" % address[:2])
+    sys.stdout.flush()
+    following = asyncio.create_task(server.follow(follow)) if follow else None
+    try:
+        await server.serveForever()
+    finally:
+        if following is not None:
+            following.cancel()
+        server.storage.close()
+
+
+@entryPoint
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve queries on a patients file kept in memory.")
+    parser.add_argument('--file', default='patients.txt', help="patients text file or SQLite database (.db)")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="0 picks a free port")
+    parser.add_argument('--socket', help="listen on this Unix socket instead of TCP")
+    parser.add_argument('--rules', help="JSON file of follow-up rules (see followup_rules)")
+    parser.add_argument('--follow', type=float, metavar='SECONDS',
+                        help="check every SECONDS for visits other programs append to the text file")
+    args = parser.parse_args(argv)
+    if args.follow is not None and (args.follow <= 0 or args.file.endswith(SQLITE_SUFFIXES)):
+        parser.error("--follow takes a positive number of seconds and a patients text file")
+    rules = None
+    if args.rules:
+        try:
+            rules = loadRules(args.rules)
+        except ValueError as e:
+            parser.error(str(e))
+    try:
+        asyncio.run(serve(args.file, args.host, args.port, args.socket, rules, args.follow))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""
+Binary snapshots of a patients file.
+
+A snapshot is written next to the text file (patients.txt -> patients.txt.snap) and
+holds a VisitStore in its native column layout:
+
+    header
+    patient IDs, offsets, lengths     (int64 each, one entry per patient)
+    temperature column                (float64)
+    date column                       (int32, packed yyyymmdd)
+    heart rate, respiratory rate, systolic, diastolic, oxygen saturation (int16 each)
+
+Sections are ordered by item size so every column stays aligned. Opening a snapshot
+memory-maps it and wraps the sections in memoryviews, so there is nothing to parse.
+
+The header records how many bytes and lines of the text file the snapshot covers, plus
+the last bytes of that region. If the text file has only grown since, just the new tail
+is parsed; if it was rewritten or shrank, the snapshot is rebuilt from scratch.
+The header also records how much of the deletion log (see visit_log) the snapshot
+already reflects, so tombstones written since are applied on top of it.
+Snapshots use the native byte order and are meant as a local cache, not for exchange.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from bulk_ingest import readColumns
+from instrumentation import metrics, timed
+from visit_log import readTombstones
+from visit_store import COLUMN_TYPECODES, VisitStore, packDates
+
+SNAPSHOT_SUFFIX = '.snap'
+SNAPSHOT_MAGIC = b'PATSNAP\x02'
+
+# magic, byte order, source size, source mtime, source lines, source ends with newline,
+# length of the signature, signature (last bytes of the source), visits, patients,
+# size of the deletion log already applied
+HEADER = struct.Struct('=8scQdQ?B64sQQQ5x')
+
+# Column sections after the patient index, in file order
+_SECTIONS = ('temps', 'dates', 'heartRates', 'respRates', 'systolic', 'diastolic', 'spo2')
+
+
+def snapshotPath(fileName):
+    """
+    Returns the name of the snapshot file for a patients file.
+    """
+    return fileName + SNAPSHOT_SUFFIX
+
+
+def sourceState(fileName, size):
+    """
+    Returns (line count, ends with newline, signature) for the first size bytes of a file.
+    """
+    lines = 0
+    last = b''
+    with open(fileName, 'rb') as file:
+        remaining = size
+        while remaining:
+            chunk = file.read(min(remaining, 1 << 24))
+            if not chunk:
+                break
+            lines += chunk.count(b'\n')
+            last = (last + chunk)[-64:]
+            remaining -= len(chunk)
+    ends_with_newline = last.endswith(b'\n') or size == 0
+    if not ends_with_newline:
+        lines += 1
+    return lines, ends_with_newline, last
+
+
+def writeSnapshot(store, fileName, sourceSize=None, logSize=0):
+    """
+    Writes a snapshot of a VisitStore next to the patients file it was loaded from.
+
+    store: The VisitStore to write. It is compacted first if needed.
+    fileName: The name of the patients file the store reflects.
+    sourceSize: The number of bytes of the patients file the store covers.
+                Defaults to the current size of the file.
+    logSize: The number of bytes of the deletion log the store reflects.
+    """
+    if sourceSize is None:
+        sourceSize = os.path.getsize(fileName)
+    lines, ends_with_newline, signature = sourceState(fileName, sourceSize)
+
+    extents = list(store.patientExtents())
+    ids = array('q', (patientId for patientId, _, _ in extents))
+    offsets = array('q', (offset for _, offset, _ in extents))
+    lengths = array('q', (length for _, _, length in extents))
+
+    header = HEADER.pack(SNAPSHOT_MAGIC, sys.byteorder[0].encode(), sourceSize,
+                         os.path.getmtime(fileName), lines, ends_with_newline, len(signature),
+                         signature, len(store.dates), len(ids), logSize)
+
+    # Write to a temporary file and rename it, so a crash never leaves a partial snapshot
+    path = snapshotPath(fileName)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(header)
+        for section in (ids, offsets, lengths):
+            file.write(section)
+        for name in _SECTIONS:
+            file.write(getattr(store, name))
+    os.replace(temp_path, path)
+
+
+def openSnapshot(fileName):
+    """
+    Memory-maps the snapshot of a patients file.
+
+    fileName: The name of the patients file.
+    return: A tuple (VisitStore, header fields as a tuple), or None if there is no
+            usable snapshot.
+    """
+    try:
+        with open(snapshotPath(fileName), 'rb') as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    if len(mapping) < HEADER.size:
+        return None
+    header = HEADER.unpack_from(mapping)
+    magic, byteorder, _, _, _, _, _, _, visits, patients, _ = header
+    expected = HEADER.size + 24 * patients + 8 * visits + 4 * visits + 2 * 5 * visits
+    if magic != SNAPSHOT_MAGIC or byteorder != sys.byteorder[0].encode() or len(mapping) != expected:
+        return None
+
+    view = memoryview(mapping)
+    position = HEADER.size
+    index = []
+    for _ in range(3):
+        index.append(view[position:position + 8 * patients].cast('q'))
+        position += 8 * patients
+    columns = {}
+    for name in _SECTIONS:
+        typecode = COLUMN_TYPECODES[name]
+        size = array(typecode).itemsize * visits
+        columns[name] = view[position:position + size].cast(typecode)
+        position += size
+
+    store = VisitStore.fromBuffers(columns, zip(*index), mapping)
+    return store, header
+
+
+def tailStart(fileName, sourceSize, sourceMtime, endsWithNewline, signature, size, mtime):
+    """
+    Works out where the lines appended to a file since it was sourceSize bytes long begin.
+
+    sourceSize, sourceMtime: The size and modification time the file had then.
+    endsWithNewline, signature: Whether those bytes ended with a newline, and their last
+                                bytes, as returned by sourceState.
+    size, mtime: The current size and modification time of the file.
+    return: The byte offset of the first new line (size if nothing was appended), or None
+            if the file was changed in a way that requires a full reload.
+    """
+    if size < sourceSize:
+        return None
+    if size == sourceSize:
+        return size if mtime == sourceMtime else None
+
+    with open(fileName, 'rb') as file:
+        file.seek(sourceSize - len(signature))
+        if file.read(len(signature)) != signature:
+            return None
+        following = file.read(2)
+
+    # A last line without a newline can only be followed by one; anything else
+    # means that line itself was extended
+    if endsWithNewline:
+        return sourceSize
+    if following.startswith(b'\r\n'):
+        return sourceSize + 2
+    if following.startswith(b'\n'):
+        return sourceSize + 1
+    return None
+
+
+@timed()
+def loadPatients(fileName):
+    """
+    Loads a patients file into a VisitStore, using and maintaining its snapshot.
+
+    An up-to-date snapshot is memory-mapped and used as is. If the text file has grown
+    since the snapshot was written, only the appended lines are parsed, and patients
+    deleted since are removed. In any other case the text file is loaded in full.
+    The snapshot is rewritten whenever it was missing or out of date.
+
+    fileName: The name of the file to read patient data from.
+    Returns a VisitStore.
+    """
+    return loadPatientsTracked(fileName)[0]
+
+
+def loadPatientsTracked(fileName):
+    """
+    Loads a patients file like loadPatients, and tells how much of it was loaded.
+
+    Only the bytes the file had when loading started are read, so lines appended
+    meanwhile are left for a later load (see tail_follow).
+
+    fileName: The name of the file to read patient data from.
+    return: A tuple (VisitStore, file size, log size): the number of bytes of the file
+            and of its deletion log the store reflects.
+    """
+    try:
+        size = os.path.getsize(fileName)
+        mtime = os.path.getmtime(fileName)
+    except OSError:
+        print(f"The file '{fileName}' could not be found.")
+        return VisitStore(), 0, 0
+
+    snapshot = openSnapshot(fileName)
+    if snapshot is not None:
+        store, header = snapshot
+        _, _, source_size, source_mtime, lines, ends_with_newline, signature_length, signature, _, _, \
+            applied_log_size = header
+        tail_start = tailStart(fileName, source_size, source_mtime, ends_with_newline,
+                               signature[:signature_length], size, mtime)
+        new_cutoffs, log_size = readTombstones(fileName, applied_log_size)
+
+        # Tombstones written since the snapshot delete whole patients from it; they
+        # can only point past its end, as the text file is never rewritten in between
+        if (tail_start is not None and log_size >= applied_log_size
+                and all(cutoff >= source_size for cutoff in new_cutoffs.values())):
+            if tail_start == size and not new_cutoffs:
+                metrics.count('snapshot.reused')
+                return store, size, log_size
+            metrics.count('snapshot.updated')
+            for patientId in new_cutoffs:
+                if patientId in store:
+                    del store[patientId]
+            tail = readColumns(fileName, start=tail_start, firstLine=lines + 1, end=size)
+            for patientId, day, *vitals in zip(tail.ids, packDates(tail.dates), *tail.vitals()):
+                store.append(patientId, day, *vitals)
+            _saveSnapshot(store, fileName, size, log_size)
+            return store, size, log_size
+
+    metrics.count('snapshot.rebuilt')
+    _, log_size = readTombstones(fileName)
+    store = VisitStore.fromColumns(readColumns(fileName, end=size))
+    _saveSnapshot(store, fileName, size, log_size)
+    return store, size, log_size
+
+
+def _saveSnapshot(store, fileName, size, logSize):
+    """
+    Writes a snapshot, reporting rather than raising if it cannot be written.
+    """
+    try:
+        writeSnapshot(store, fileName, size, logSize)
+    except OSError as e:
+        print(f"Could not write snapshot for '{fileName}': {e}")
@@ -0,0 +1,537 @@
+"""
+SQLite storage for patient visits, as an alternative to the patients text file.
+
+A SqliteStore is a patients collection whose visits stay in a SQLite database rather
+than in memory, so datasets larger than memory can be queried. It is a mutable mapping
+of patient ID -> list-like visits, like a VisitStore, and the patient functions use the
+database for the work they would otherwise do in memory:
+
+    findVisitsByDate              dateIndex.find, an indexed range query on the date
+    displayStats                  aggregates, count, sums, minimums and maximums in SQL
+    findPatientsWhoNeedFollowUp   followUp, needsFollowUp on the last visit of each patient
+    computeStats                  liveColumns and patientColumns, read in blocks
+    vitalTrends                   rollups, one query grouping the visits by month
+    deleteAllVisitsOfPatient      an indexed DELETE instead of a rewrite of the file
+
+The schema keeps patients in the order their first visit was added, and visits in the
+order they were added, which is the order of the lines of a text file:
+
+    patients (seq INTEGER PRIMARY KEY, patient_id INTEGER UNIQUE)
+    visits (id INTEGER PRIMARY KEY, patient_id, date, temperature, heart_rate,
+            respiratory_rate, systolic_bp, diastolic_bp, spo2)
+    indexes on visits (patient_id, date) and visits (date)
+
+The database runs in WAL mode, so readers are not blocked while changes are written.
+Changes happen in a transaction that is committed by the store's storage methods
+(saveVisits and deletePatient, see storage) or by commit, and when the store is closed.
+
+importTextFile loads a patients text file with executemany, block by block:
+
+    python sqlite_store.py patients.txt patients.db
+"""
+import argparse
+import sqlite3
+from array import array
+from collections.abc import MutableMapping, Sequence
+from itertools import starmap
+
+from aggregate_cache import PatientAggregate
+from bulk_ingest import BLOCK_SIZE, iterColumnBlocks
+from followup import needsFollowUp
+from monthly_rollups import MonthRollup
+from visit_record import Visit
+from visit_store import COLUMN_TYPECODES, VITAL_NAMES, packDate
+
+# Columns of the visits table holding the fields of a visit, in visit order
+VISIT_FIELDS = ('date', 'temperature', 'heart_rate', 'respiratory_rate', 'systolic_bp', 'diastolic_bp', 'spo2')
+
+# Number of rows fetched at a time when reading whole columns
+FETCH_SIZE = 65536
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    seq INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    temperature REAL NOT NULL,
+    heart_rate INTEGER NOT NULL,
+    respiratory_rate INTEGER NOT NULL,
+    systolic_bp INTEGER NOT NULL,
+    diastolic_bp INTEGER NOT NULL,
+    spo2 INTEGER NOT NULL
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS visits_patient_date ON visits (patient_id, date);
+CREATE INDEX IF NOT EXISTS visits_date ON visits (date);
+"""
+
+_VISIT = ', '.join(VISIT_FIELDS)
+_VITALS = ', '.join(VISIT_FIELDS[1:])
+_INSERT_PATIENT = "INSERT OR IGNORE INTO patients (patient_id) VALUES (?)"
+_INSERT_VISIT = f"INSERT INTO visits (patient_id, {_VISIT}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+_AGGREGATES = "count(*), {}, {}, {}, {}".format(
+    ', '.join(f"total({name})" for name in VISIT_FIELDS[1:]),
+    ', '.join(f"total({name} * {name})" for name in VISIT_FIELDS[1:]),
+    ', '.join(f"min({name})" for name in VISIT_FIELDS[1:]),
+    ', '.join(f"max({name})" for name in VISIT_FIELDS[1:]))
+_AGGREGATE = f"SELECT {_AGGREGATES} FROM visits"
+_MONTHLY = (f"SELECT substr(date, 1, 7) AS month, {_AGGREGATES}, total(needs_follow_up({_VITALS})) "
+            f"FROM visits {{}} GROUP BY month ORDER BY month")
+
+
+def _needsFollowUp(*vitals):
+    """
+    needsFollowUp of the six vital signs of a visit, as the SQL function needs_follow_up.
+    """
+    return needsFollowUp((None,) + vitals)
+
+
+class SqlitePatientVisits(Sequence):
+    """
+    A list-like view of the visits of one patient inside a SqliteStore, returning
+    each visit as a Visit.
+    """
+
+    __slots__ = ('_store', '_patientId')
+
+    def __init__(self, store, patientId):
+        self._store = store
+        self._patientId = patientId
+
+    def __len__(self):
+        return self._store._db.execute("SELECT count(*) FROM visits WHERE patient_id = ?",
+                                       (self._patientId,)).fetchone()[0]
+
+    def __getitem__(self, index):
+        if index == -1:
+            visit = self._store.lastVisit(self._patientId)
+            if visit is None:
+                raise IndexError(index)
+            return visit
+        visits = list(self)
+        return visits[index]
+
+    def __iter__(self):
+        rows = self._store._db.execute(f"SELECT {_VISIT} FROM visits WHERE patient_id = ? ORDER BY id",
+                                       (self._patientId,))
+        return starmap(Visit, rows)
+
+    def append(self, visit):
+        self._store.append(self._patientId, *visit)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class _DateQueries:
+    """
+    Answers the queries of a DateIndex with SQL, for findVisitsByDate.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def _select(self, conditions, params):
+        query = (f"SELECT v.patient_id, {', '.join('v.' + name for name in VISIT_FIELDS)} "
+                 f"FROM visits v JOIN patients p ON p.patient_id = v.patient_id "
+                 f"WHERE {' AND '.join(conditions) or '1'} ORDER BY p.seq, v.id")
+        return [(row[0], Visit(*row[1:])) for row in self._store._db.execute(query, params)]
+
+    def find(self, year=None, month=None):
+        """
+        Finds visits by year, month, or both.
+
+        year: The year to filter by.
+        month: The month to filter by.
+        return: A list of tuples (patientId, visit), in patient and visit order.
+        """
+        conditions = []
+        params = []
+        if year is not None:
+            # A range of whole years is answered from the index on the date; '.' is the
+            # character after '-', so the range ends after the last date of the year
+            # even for year 9999
+            conditions.append("v.date >= ? AND v.date < ?")
+            params.extend(["%04d-" % int(year), "%04d." % int(year)])
+        if month is not None:
+            conditions.append("substr(v.date, 6, 2) = ?")
+            params.append("%02d" % int(month))
+        return self._select(conditions, params)
+
+    def findRange(self, start, end):
+        """
+        Finds visits dated between start and end, both inclusive.
+
+        start: The first date, as 'yyyy-mm-dd'.
+        end: The last date, as 'yyyy-mm-dd'.
+        return: A list of tuples (patientId, visit), in patient and visit order.
+        """
+        return self._select(["v.date BETWEEN ? AND ?"], [start, end])
+
+    def __len__(self):
+        return self._store.visitCount()
+
+
+def _fromRow(aggregate, row):
+    """
+    Fills a PatientAggregate from the columns of _AGGREGATES in a row, and returns it.
+    """
+    aggregate.count = row[0]
+    if aggregate.count:
+        aggregate.sums = list(row[1:7])
+        aggregate.squares = list(row[7:13])
+        aggregate.minimums = list(row[13:19])
+        aggregate.maximums = list(row[19:25])
+    return aggregate
+
+
+class _Aggregates:
+    """
+    Computes the PatientAggregates of an AggregateCache with SQL, for displayStats.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def _aggregate(self, where='', params=()):
+        return _fromRow(PatientAggregate(), self._store._db.execute(f"{_AGGREGATE} {where}", params).fetchone())
+
+    def get(self, patientId):
+        """
+        Returns the aggregate of a patient's visits.
+
+        Raises KeyError if the patient is not in the store.
+        """
+        if patientId not in self._store:
+            raise KeyError(patientId)
+        aggregate = self._aggregate("WHERE patient_id = ?", (patientId,))
+        aggregate.lastVisit = self._store.lastVisit(patientId)
+        return aggregate
+
+    def merged(self, patientIds=None):
+        """
+        Merges the aggregates of some patients, or of all patients if patientIds is None.
+        IDs that are not in the store are ignored.
+
+        The aggregate of all patients is kept until the store changes. It must not be
+        modified by the caller.
+
+        Returns a PatientAggregate, whose lastVisit is None.
+        """
+        store = self._store
+        if patientIds is None:
+            store._checkDataVersion()
+            if store._population is None:
+                store._population = self._aggregate()
+            return store._population
+        total = PatientAggregate()
+        for patientId in dict.fromkeys(patientIds):
+            total.merge(self._aggregate("WHERE patient_id = ?", (patientId,)))
+        return total
+
+
+class _FollowUp:
+    """
+    Answers the queries of a FollowUpTracker from the last visit of every patient, for
+    findPatientsWhoNeedFollowUp.
+    """
+
+    def __init__(self, store, predicate=needsFollowUp):
+        self._store = store
+        self._predicate = predicate
+
+    def patients(self):
+        """
+        Returns the list of patient IDs that need follow-up, in patient order.
+        """
+        rows = self._store._db.execute(
+            f"SELECT p.patient_id, {', '.join('v.' + name for name in VISIT_FIELDS)} FROM patients p "
+            f"JOIN visits v ON v.id = (SELECT max(id) FROM visits WHERE patient_id = p.patient_id) "
+            f"ORDER BY p.seq")
+        predicate = self._predicate
+        return [row[0] for row in rows if predicate(row[1:])]
+
+    def __contains__(self, patientId):
+        visit = self._store.lastVisit(patientId)
+        return visit is not None and self._predicate(visit)
+
+
+class _Rollups:
+    """
+    Answers the queries of MonthlyRollups (see monthly_rollups) with one grouped query,
+    for vitalTrends.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def months(self, startYear=None, endYear=None):
+        """
+        Returns the rollups of the months with visits, in date order.
+
+        startYear: The first year to include, or None to start with the first visit.
+        endYear: The last year to include, or None to end with the last visit.
+        return: A list of ((year, month), MonthRollup).
+        """
+        conditions = []
+        params = []
+        if startYear is not None:
+            conditions.append("date >= ?")
+            params.append("%04d" % int(startYear))
+        if endYear is not None:
+            conditions.append("date < ?")
+            params.append("%04d" % (int(endYear) + 1))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        months = []
+        for row in self._store._db.execute(_MONTHLY.format(where), params):
+            rollup = _fromRow(MonthRollup(), row[1:])
+            rollup.followUps = int(row[-1])
+            months.append(((int(row[0][:4]), int(row[0][5:7])), rollup))
+        return months
+
+
+class SqliteStore(MutableMapping):
+    """
+    Patient visits kept in a SQLite database.
+
+    The store is a mutable mapping of patient ID -> list-like visits, so it can be
+    passed anywhere the dictionary returned by readPatientsFromFile is expected, and is
+    its own storage (see storage): the patient functions save their changes by
+    committing them to the database.
+    """
+
+    def __init__(self, fileName):
+        """
+        fileName: The name of the database file, created if it does not exist.
+        """
+        self.fileName = fileName
+        # Changes may be saved from a worker thread, as the query server does
+        self._db = sqlite3.connect(fileName, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(SCHEMA + INDEXES)
+        self._db.create_function('needs_follow_up', 6, _needsFollowUp, deterministic=True)
+        self._population = None
+        self._dataVersion = self._readDataVersion()
+        self.indexes = []
+        self.dateIndex = _DateQueries(self)
+        self.aggregates = _Aggregates(self)
+        self.followUp = _FollowUp(self)
+        self.rollups = _Rollups(self)
+
+    @property
+    def storage(self):
+        return self
+
+    def append(self, patientId, date, temp, hr, rr, sbp, dbp, spo2):
+        """
+        Appends a visit for a patient.
+
+        patientId: The ID of the patient.
+        date: The date of the visit, as 'yyyy-mm-dd'.
+        temp, hr, rr, sbp, dbp, spo2: The vital signs of the visit.
+        Raises ValueError if the date is not in the format 'yyyy-mm-dd'.
+        """
+        packDate(date)
+        self._db.execute(_INSERT_PATIENT, (patientId,))
+        self._db.execute(_INSERT_VISIT, (patientId, date, float(temp), int(hr), int(rr), int(sbp), int(dbp), int(spo2)))
+        self._population = None
+
+    def appendMany(self, visits):
+        """
+        Appends (patientId, visit) pairs with one executemany.
+        """
+        visits = list(visits)
+        for _, visit in visits:
+            packDate(visit[0])
+        self._db.executemany(_INSERT_PATIENT, ((patientId,) for patientId in dict.fromkeys(
+            patientId for patientId, _ in visits)))
+        self._db.executemany(_INSERT_VISIT, ((patientId, *visit) for patientId, visit in visits))
+        self._population = None
+
+    def importTextFile(self, fileName, blockSize=BLOCK_SIZE, report=print):
+        """
+        Adds the visits of a patients text file to the store, one block of lines at a
+        time with executemany, and commits them.
+
+        fileName: The name of the text file to import.
+        blockSize: The number of bytes to read per block.
+        report: A function called with each error message, as for loadPatients.
+        Returns the number of visits imported.
+        """
+        db = self._db
+        empty = not len(self)
+        if empty:
+            # Building the indexes once at the end is faster than updating them per row
+            db.execute("DROP INDEX IF EXISTS visits_patient_date")
+            db.execute("DROP INDEX IF EXISTS visits_date")
+        imported = 0
+        try:
+            for columns in iterColumnBlocks(fileName, blockSize, report):
+                db.executemany(_INSERT_PATIENT, ((patientId,) for patientId in dict.fromkeys(columns.ids)))
+                db.executemany(_INSERT_VISIT, zip(columns.ids, columns.dates, *columns.vitals()))
+                imported += len(columns)
+        except FileNotFoundError:
+            report(f"The file '{fileName}' could not be found.")
+        finally:
+            self._population = None
+            db.commit()
+            if empty:
+                db.executescript(INDEXES)
+        return imported
+
+    def lastVisit(self, patientId):
+        """
+        Returns the most recent visit of a patient, or None if it has no visits.
+        """
+        row = self._db.execute(f"SELECT {_VISIT} FROM visits WHERE patient_id = ? ORDER BY id DESC LIMIT 1",
+                               (patientId,)).fetchone()
+        return Visit(*row) if row is not None else None
+
+    def visitCount(self):
+        """
+        Returns the number of visits in the store.
+        """
+        return self._db.execute("SELECT count(*) FROM visits").fetchone()[0]
+
+    def _readColumns(self, columns, where='', params=()):
+        cursor = self._db.execute(f"SELECT {_VITALS} FROM visits {where}", params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+
+    def liveColumns(self):
+        """
+        Reads the vital sign columns of all visits into arrays, in the order of
+        VisitStore.columns.
+        """
+        columns = [array(COLUMN_TYPECODES[name]) for name in VITAL_NAMES]
+        self._readColumns(columns)
+        return columns
+
+    def patientColumns(self, patientIds):
+        """
+        Reads the vital sign columns of some patients' visits into arrays, in the order
+        of VisitStore.columns. Unknown patient IDs are skipped.
+        """
+        columns = [array(COLUMN_TYPECODES[name]) for name in VITAL_NAMES]
+        for patientId in patientIds:
+            self._readColumns(columns, "WHERE patient_id = ?", (patientId,))
+        return columns
+
+    def _readDataVersion(self):
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _checkDataVersion(self):
+        """
+        Forgets the aggregate of all patients if another connection changed the database
+        since it was computed.
+        """
+        version = self._readDataVersion()
+        if version != self._dataVersion:
+            self._dataVersion = version
+            self._population = None
+
+    def beginRead(self):
+        """
+        Starts a read transaction: until endRead, queries see the database as it is now,
+        whatever other connections commit meanwhile. The store must not be changed
+        during the transaction.
+        """
+        self._db.execute("BEGIN")
+        # The first read of the transaction fixes what it sees
+        self._db.execute("SELECT 1 FROM patients LIMIT 1").fetchone()
+        self._checkDataVersion()
+
+    def endRead(self):
+        """
+        Ends a read transaction started by beginRead.
+        """
+        self._db.rollback()
+
+    def commit(self):
+        """
+        Commits the changes made since the last commit.
+        """
+        self._db.commit()
+
+    def saveVisits(self, visits):
+        """
+        Commits visits appended to the store.
+        """
+        self._db.commit()
+
+    def deletePatient(self, patientId):
+        """
+        Commits the deletion of a patient.
+        """
+        self._db.commit()
+
+    def close(self):
+        """
+        Commits any changes and closes the database.
+        """
+        self._db.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getitem__(self, patientId):
+        if patientId not in self:
+            raise KeyError(patientId)
+        return SqlitePatientVisits(self, patientId)
+
+    def __setitem__(self, patientId, visits):
+        visits = list(visits)
+        if patientId in self:
+            del self[patientId]
+        self.appendMany([(patientId, list(visit)) for visit in visits])
+
+    def __delitem__(self, patientId):
+        if patientId not in self:
+            raise KeyError(patientId)
+        self._db.execute("DELETE FROM visits WHERE patient_id = ?", (patientId,))
+        self._db.execute("DELETE FROM patients WHERE patient_id = ?", (patientId,))
+        self._population = None
+
+    def __contains__(self, patientId):
+        return self._db.execute("SELECT 1 FROM patients WHERE patient_id = ?", (patientId,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter([row[0] for row in self._db.execute("SELECT patient_id FROM patients ORDER BY seq")])
+
+    def __len__(self):
+        return self._db.execute("SELECT count(*) FROM patients").fetchone()[0]
+
+    def __repr__(self):
+        return f"SqliteStore({self.fileName!r}, {len(self)} patients, {self.visitCount()} visits)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a patients text file into a SQLite database.")
+    parser.add_argument('textFile')
+    parser.add_argument('database')
+    args = parser.parse_args()
+    with SqliteStore(args.database) as store:
+        imported = store.importTextFile(args.textFile)
+        print(f"Imported {imported:,} visits into {args.database} ({len(store):,} patients)")
+
+
+if __name__ == '__main__':
+    main()
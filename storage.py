@@ -0,0 +1,78 @@
+"""
+Storage backends under the patient functions.
+
+The functions of main_22BECD87 change a patients collection in memory, then ask the
+storage of that collection to make the change durable:
+
+    saveVisits(visits)          after (patientId, visit) pairs were appended
+    deletePatient(patientId)    after all visits of a patient were removed
+    close()                     when the program is done with the collection
+
+TextStorage, the default, appends lines to the patients text file and tombstones to
+its deletion log (see visit_log). A collection that carries its own storage in a
+storage attribute, such as a SqliteStore, is saved there instead, and the file name
+the functions are given is not used.
+
+openPatients opens a patients file with the backend its name calls for: a SQLite
+database for names ending in one of SQLITE_SUFFIXES, the text format otherwise.
+"""
+from patient_index import updateIndex
+from snapshot import loadPatients
+from sqlite_store import SqliteStore
+from visit_log import COMPACTION_THRESHOLD, appendTombstone, compactPatientsFile
+from visit_writer import formatVisitLine
+
+# File name endings that openPatients opens as SQLite databases
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+
+class TextStorage:
+    """
+    Saves the changes of a patients collection to a patients text file.
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+    def saveVisits(self, visits):
+        """
+        Appends the lines of (patientId, visit) pairs to the file, as addPatientData does,
+        and indexes them if the file has a patient index (see patient_index).
+        """
+        with open(self.fileName, 'a') as file:
+            file.writelines(formatVisitLine(patientId, visit) for patientId, visit in visits)
+        updateIndex(self.fileName)
+
+    def deletePatient(self, patientId):
+        """
+        Records the deletion of a patient in the deletion log, compacting the file once
+        the log holds COMPACTION_THRESHOLD tombstones.
+        """
+        if appendTombstone(self.fileName, patientId) >= COMPACTION_THRESHOLD:
+            compactPatientsFile(self.fileName)
+
+    def close(self):
+        """
+        Nothing to do: the file is opened for every change.
+        """
+
+
+def storageFor(patients, fileName):
+    """
+    Returns the storage that saves the changes of a patients collection: its own, or
+    a TextStorage of fileName.
+    """
+    storage = getattr(patients, 'storage', None)
+    return storage if storage is not None else TextStorage(fileName)
+
+
+def openPatients(fileName):
+    """
+    Opens a patients file with the backend its name calls for.
+
+    fileName: A patients text file, or a SQLite database if it ends in one of SQLITE_SUFFIXES.
+    Returns a VisitStore loaded with loadPatients, or a SqliteStore.
+    """
+    if fileName.endswith(SQLITE_SUFFIXES):
+        return SqliteStore(fileName)
+    return loadPatients(fileName)
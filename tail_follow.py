@@ -0,0 +1,284 @@
+"""
+Incremental reload of a patients file that other programs append to.
+
+A TailFollower keeps a patients collection, loaded with loadPatients (see snapshot), in
+step with its text file while the program runs. It remembers how many bytes of the file
+and of its deletion log (see visit_log) the collection reflects, and refresh parses only
+the lines appended since and removes the patients deleted since.
+
+Lines are read to the end of the file, like the loaders do: addPatientData starts every
+line with a newline rather than ending it with one, so the last line of the file has
+none. refresh loads the whole file again only when the file changed in a way appending
+cannot explain: it was replaced (compacted, or rewritten by another program), it shrank,
+the bytes before the remembered offset changed (including a last line that was read
+while another program was still writing it), its deletion log was reset, or a tombstone
+removes visits that were already read after the deletion was made.
+
+The follower is also the storage (see storage) of its collection, so the visits and
+deletions of this program go through it: it catches up with the file first, then
+writes them and moves its offset past them, and never reads them back.
+
+refresh runs on demand, for example before every menu choice of main(), or on a poll
+interval, as the query server does with --follow SECONDS.
+"""
+import os
+
+from bulk_ingest import BLOCK_SIZE, readColumns
+from instrumentation import metrics
+from patient_index import updateIndex
+from patient_records import notifyPatientDeleted
+from snapshot import loadPatientsTracked, sourceState
+from storage import TextStorage
+from visit_log import COMPACTION_THRESHOLD, appendTombstone, compactPatientsFile, readTombstones
+from visit_writer import formatVisitLine, recordVisits
+
+# Number of bytes at the end of the part of the file already read that refresh checks
+# are unchanged, as in the header of a snapshot
+SIGNATURE_SIZE = 64
+
+
+def _fileIdentity(fileName):
+    """
+    Returns (device, inode) of a file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(fileName)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def _countLines(data, endsWithNewline):
+    """
+    Returns the number of lines appending data adds to a file, given whether the file
+    ended with a newline: a last line without one counts, and is completed by a newline
+    at the start of data.
+    """
+    if not data:
+        return 0
+    return data.count(b'\n') + (not data.endswith(b'\n')) - (not endsWithNewline)
+
+
+def _scanLines(file, start, size, endsWithNewline):
+    """
+    Counts the lines between start and size of a file, like _countLines.
+
+    endsWithNewline: Whether the bytes before start end with a newline.
+    return: A tuple (lines, ends with newline).
+    """
+    file.seek(start)
+    lines = 0
+    remaining = size - start
+    while remaining > 0:
+        chunk = file.read(min(remaining, BLOCK_SIZE))
+        if not chunk:
+            break
+        lines += _countLines(chunk, endsWithNewline)
+        endsWithNewline = chunk.endswith(b'\n')
+        remaining -= len(chunk)
+    return lines, endsWithNewline
+
+
+def _signature(file, end):
+    """
+    Returns the last SIGNATURE_SIZE bytes of a file before offset end.
+    """
+    start = max(0, end - SIGNATURE_SIZE)
+    file.seek(start)
+    return file.read(end - start)
+
+
+class TailFollower(TextStorage):
+    """
+    Keeps a patients collection in step with a patients text file that other programs
+    append to, and saves the changes of this program to that file.
+
+    patients: The collection, a VisitStore. It is replaced by a new one when refresh
+              has to load the whole file again, so read it from here after refresh.
+    offset: The number of bytes of the file the collection reflects.
+    lines: The number of lines before offset, for the line numbers of error messages.
+    logSize: The number of bytes of the deletion log the collection reflects.
+    reloads: The number of times refresh loaded the whole file again.
+    """
+
+    def __init__(self, fileName, report=print):
+        """
+        Loads a patients file.
+
+        fileName: The name of the patients file.
+        report: A function called with the error message of each invalid new line.
+        """
+        super().__init__(fileName)
+        self.report = report
+        self.reloads = 0
+        self._load()
+
+    def _load(self):
+        """
+        Loads the whole file into a new collection.
+        """
+        identity = _fileIdentity(self.fileName)
+        self.patients, size, self.logSize = loadPatientsTracked(self.fileName)
+        self.patients.storage = self
+        self._stale = False
+        self._rebase(identity, size)
+
+    def _rebase(self, identity, size):
+        """
+        Records that the collection reflects the first size bytes of the file.
+        """
+        self._identity = identity
+        self.offset = size
+        if identity is None:
+            self.lines, self._endsWithNewline, self._signature = 0, True, b''
+        else:
+            self.lines, self._endsWithNewline, signature = sourceState(self.fileName, size)
+            self._signature = signature[-SIGNATURE_SIZE:]
+
+    def refresh(self):
+        """
+        Brings the collection up to date with the file: adds the visits appended since
+        the last refresh and removes the patients deleted since, or loads the whole file
+        again if it changed in any other way.
+
+        return: True if the collection changed.
+        """
+        changes = None if self._stale else self._catchUp()
+        if changes is None:
+            self.reloads += 1
+            metrics.count('follow.reloads')
+            self._load()
+            return True
+        return changes > 0
+
+    def _tailStart(self, file, size):
+        """
+        Checks that the part of the file already read is unchanged.
+
+        return: The offset of the first new line, or None if the file was rewritten.
+        """
+        signature = self._signature
+        file.seek(self.offset - len(signature))
+        if file.read(len(signature)) != signature:
+            return None
+        if self._endsWithNewline or size == self.offset:
+            return self.offset
+
+        # A last line without a newline can only be followed by one; anything else
+        # means that line itself was extended
+        following = file.read(2)
+        if following.startswith(b'\r\n'):
+            return self.offset + 2
+        if following.startswith(b'\n'):
+            return self.offset + 1
+        return None
+
+    def _catchUp(self, protect=()):
+        """
+        Applies the tombstones and lines added to the deletion log and the file since
+        the last call.
+
+        protect: IDs of patients whose new visits are in the collection but not yet in
+                 the file; new lines or a deletion of one of them would land out of
+                 order in the collection, and call for a full reload instead.
+        return: The number of visits added plus patients removed, or None if the file
+                must be loaded in full.
+        """
+        identity = _fileIdentity(self.fileName)
+        if identity != self._identity:
+            return None
+        if identity is None:
+            return 0
+        size = os.path.getsize(self.fileName)
+        if size < self.offset:
+            return None
+        with open(self.fileName, 'rb') as file:
+            start = self._tailStart(file, size)
+            if start is None:
+                return None
+            lines, ends_with_newline = _scanLines(file, start, size, start > self.offset or self._endsWithNewline)
+            signature = _signature(file, size)
+
+        # Tombstones are read after the size, so they point at or past the lines read
+        # so far unless they delete visits this collection has already read
+        cutoffs, log_size = readTombstones(self.fileName, self.logSize)
+        if log_size < self.logSize:
+            return None
+        if any(cutoff < self.offset or patientId in protect for patientId, cutoff in cutoffs.items()):
+            return None
+        visits = []
+        if size > start:
+            tail = readColumns(self.fileName, start=start, firstLine=self.lines + 1, end=size,
+                               report=self.report)
+            if protect and not protect.isdisjoint(tail.ids):
+                return None
+            visits = list(tail.visits())
+
+        patients = self.patients
+        changes = 0
+        for patientId in cutoffs:
+            if patientId in patients:
+                del patients[patientId]
+                notifyPatientDeleted(patients, patientId)
+                changes += 1
+        if changes:
+            metrics.count('follow.patientsDeleted', changes)
+
+        if visits:
+            recordVisits(patients, visits)
+            changes += len(visits)
+            metrics.count('follow.visitsAdded', len(visits))
+        self.lines += lines
+        self.offset = size
+        self._endsWithNewline = ends_with_newline
+        self._signature = signature
+        self.logSize = log_size
+        return changes
+
+    def saveVisits(self, visits):
+        """
+        Appends the lines of (patientId, visit) pairs to the file, after reading the
+        lines other programs appended before them, and indexes them if the file has a
+        patient index (see patient_index).
+        """
+        visits = list(visits)
+        if not self._stale and self._catchUp({patientId for patientId, _ in visits}) is None:
+            self._stale = True
+        data = ''.join(formatVisitLine(patientId, visit) for patientId, visit in visits).encode()
+        with open(self.fileName, 'ab') as file:
+            file.write(data)
+            file.flush()
+            end = file.tell()
+        updateIndex(self.fileName)
+        if self._identity is None and end == len(data):
+            self._identity = _fileIdentity(self.fileName)
+
+        # Another program appended between the catch-up and the write: the lines in
+        # between are unread, so the next refresh loads the whole file
+        if self._stale or end - len(data) != self.offset:
+            self._stale = True
+            return
+        self.offset = end
+        self.lines += _countLines(data, self._endsWithNewline)
+        self._endsWithNewline = data.endswith(b'\n')
+        self._signature = (self._signature + data)[-SIGNATURE_SIZE:]
+
+    def deletePatient(self, patientId):
+        """
+        Records the deletion of a patient in the deletion log, compacting the file once
+        the log holds COMPACTION_THRESHOLD tombstones.
+        """
+        if not self._stale and self._catchUp() is None:
+            self._stale = True
+        tombstones = appendTombstone(self.fileName, patientId)
+        if not self._stale and self._catchUp() is None:
+            self._stale = True
+        if tombstones >= COMPACTION_THRESHOLD:
+            caught_up = not self._stale and os.path.getsize(self.fileName) == self.offset
+            compactPatientsFile(self.fileName)
+            if caught_up:
+                # The compacted file holds exactly the visits of the collection
+                self.logSize = 0
+                self._rebase(_fileIdentity(self.fileName), os.path.getsize(self.fileName))
+            else:
+                self._stale = True
@@ -0,0 +1,65 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Lines every loader must reject, with the message they report for them (for line 1)
+INVALID_LINES = (
+    ("1,2022-01-05,37.0,70,16,120,80", "Invalid number of fields (7) in line: 1"),
+    ("1,2022-01-05,37.0,70,16,120,80,97,1", "Invalid number of fields (9) in line: 1"),
+    ("x,2022-01-05,37.0,70,16,120,80,97", "invalid literal for int() with base 10: 'x'"),
+    ("1,2022-01-05,37.0,seventy,16,120,80,97", "invalid literal for int() with base 10: 'seventy'"),
+    ("1,2022-02-30,37.0,70,16,120,80,97", "Invalid date value (2022-02-30) in line: 1"),
+    ("1,2022/01/05,37.0,70,16,120,80,97", "Invalid date value (2022/01/05) in line: 1"),
+    ("1,2022-01-05,45.0,70,16,120,80,97", "Invalid temperature value (45.0) in line: 1"),
+    ("1,2022-01-05,37.0,70,16,120,80,101", "Invalid oxygen saturation value (101) in line: 1"),
+)
+
+
+def visitLine(rng, patientId):
+    """
+    Returns a valid line of a patients file for a patient, with random values.
+    """
+    return "%d,%04d-%02d-%02d,%.1f,%d,%d,%d,%d,%d" % (
+        patientId, rng.randint(2018, 2024), rng.randint(1, 12), rng.randint(1, 28),
+        rng.uniform(35.5, 39.5), rng.randint(50, 120), rng.randint(10, 25),
+        rng.randint(90, 160), rng.randint(55, 100), rng.randint(88, 100))
+
+
+def writeLines(fileName, lines):
+    with open(fileName, 'w') as file:
+        file.write('\n'.join(lines))
+
+
+def asLists(patients):
+    """
+    Returns the visits of a patients collection as a dictionary of lists, for comparing.
+    """
+    return {patientId: list(patients[patientId]) for patientId in patients}
+
+
+def load(loader, fileName, capsys):
+    """
+    Returns (visits as lists, printed lines) of a loader.
+    """
+    capsys.readouterr()
+    patients = asLists(loader(fileName))
+    return patients, capsys.readouterr().out.splitlines()
+
+
+@pytest.fixture
+def patientsFile(tmp_path):
+    """
+    A patients file of 2,000 visits of 200 patients, interleaved, with every kind of
+    invalid line spread over it.
+    """
+    rng = random.Random(1)
+    lines = [visitLine(rng, rng.randint(1, 200)) for _ in range(2000)]
+    for position, (line, _) in zip(range(7, 2000, 250), INVALID_LINES):
+        lines.insert(position, line)
+    fileName = str(tmp_path / 'patients.txt')
+    writeLines(fileName, lines)
+    return fileName
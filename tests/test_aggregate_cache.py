@@ -0,0 +1,41 @@
+from aggregate_cache import AGGREGATE_SIZE, AggregateCache
+from main_22BECD87 import displayStats, readPatientsFromFile
+from visit_store import loadVisitStore
+
+
+def statsOutput(patients, patientIds, capsys):
+    capsys.readouterr()
+    for patientId in patientIds:
+        displayStats(patients, patientId)
+    return capsys.readouterr().out
+
+
+def testStoreChangesReachCachedAggregates(patientsFile, capsys):
+    store = loadVisitStore(patientsFile)
+    patientId, deleted, replaced = list(store)[:3]
+    shown = [0, patientId, replaced]
+    statsOutput(store, shown, capsys)
+
+    # Changes through the mapping API tell no index about themselves
+    for _ in range(4):
+        store[patientId].append(['2024-02-29', 40.5, 70, 16, 120, 80, 97])
+    del store[deleted]
+    store[replaced] = [['2023-05-01', 37.0, 70, 16, 120, 80, 97]]
+
+    plain = {patientId: list(visits) for patientId, visits in store.items()}
+    assert statsOutput(store, shown, capsys) == statsOutput(plain, shown, capsys)
+
+
+def testLeastRecentlyUsedAggregatesAreEvicted(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    first, second, third, fourth = list(patients)[:4]
+    cache = AggregateCache(patients, memoryBudget=3 * AGGREGATE_SIZE)
+    for patientId in (first, second, third, first, fourth):
+        assert cache.get(patientId).count == len(patients[patientId])
+
+    assert (cache.hits, cache.misses) == (1, 4)
+    assert second not in cache
+    assert [patientId in cache for patientId in (first, third, fourth)] == [True] * 3
+
+    cache.setMemoryBudget(AGGREGATE_SIZE)
+    assert len(cache) == 1 and fourth in cache
@@ -0,0 +1,37 @@
+from functools import partial
+
+from bulk_ingest import parseLines, readColumns, readPatientsBulk
+from conftest import INVALID_LINES, load, writeLines
+from main_22BECD87 import readPatientsFromFile
+from visit_store import loadVisitStore
+
+
+def testBulkLoaderAgreesWithDictLoader(patientsFile, capsys):
+    expected, messages = load(readPatientsFromFile, patientsFile, capsys)
+    for blockSize in (100, 4096, 1 << 18):
+        assert load(partial(readPatientsBulk, blockSize=blockSize), patientsFile, capsys) == (expected, messages)
+
+
+def testMessagesAreInLineOrder(tmp_path, capsys):
+    fileName = str(tmp_path / 'patients.txt')
+    writeLines(fileName, [line for line, _ in reversed(INVALID_LINES)])
+    expected = [message.replace('line: 1', f'line: {number}')
+                for number, (_, message) in enumerate(reversed(INVALID_LINES), start=1)]
+    for loader in (readPatientsFromFile, readPatientsBulk, loadVisitStore):
+        assert load(loader, fileName, capsys)[1] == expected
+
+
+def testValuesTooLargeForColumnsAreParsedLineByLine(capsys):
+    lines = ["1,2022-01-05,37.0,70,16,120,80,97", "2,2022-01-05,37.0,99999,16,120,80,97",
+             "3,2022-01-05,37.0,70,16,120,80,97"]
+    columns = parseLines(lines, 1)
+    assert list(columns.ids) == [1, 3]
+    assert list(columns.lineNumbers) == [1, 3]
+    assert capsys.readouterr().out.splitlines() == ["Invalid heart rate value (99999) in line: 2"]
+
+
+def testMissingFileIsReported(tmp_path, capsys):
+    fileName = str(tmp_path / 'missing.txt')
+    assert len(readColumns(fileName)) == 0
+    assert readPatientsBulk(fileName) == {}
+    assert capsys.readouterr().out.splitlines() == [f"The file '{fileName}' could not be found."] * 2
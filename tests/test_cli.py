@@ -0,0 +1,80 @@
+import json
+import random
+
+import pytest
+
+import cli
+from conftest import visitLine, writeLines
+from main_22BECD87 import displayStats, findPatientsWhoNeedFollowUp, readPatientsFromFile
+
+
+@pytest.fixture
+def patientsFile(tmp_path):
+    """
+    A patients file without invalid lines, so that loading it prints nothing.
+    """
+    rng = random.Random(5)
+    fileName = str(tmp_path / 'patients.txt')
+    writeLines(fileName, [visitLine(rng, rng.randint(1, 50)) for _ in range(500)])
+    return fileName
+
+
+def run(capsys, *argv):
+    capsys.readouterr()
+    status = cli.main(list(argv))
+    captured = capsys.readouterr()
+    return status, captured.out, captured.err
+
+
+def testCommandsMatchMenuFunctions(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    capsys.readouterr()
+    displayStats(patients, 3)
+    expected = capsys.readouterr().out
+    assert run(capsys, '--file', patientsFile, 'stats', '3') == (0, expected, '')
+
+    status, out, _ = run(capsys, '--file', patientsFile, 'stats', '--format', 'json')
+    assert status == 0 and json.loads(out)['visitCount'] == sum(map(len, patients.values()))
+
+    status, out, _ = run(capsys, '--file', patientsFile, 'followup')
+    assert status == 0 and out.splitlines()[1:] == list(map(str, findPatientsWhoNeedFollowUp(patients)))
+
+    status, out, _ = run(capsys, '--file', patientsFile, 'show', '7', '--format', 'csv', '--limit', '2')
+    assert status == 0 and len(out.splitlines()) == 3
+
+
+def testChangesReachTheFile(patientsFile, capsys):
+    assert run(capsys, '--file', patientsFile, 'add', '500', '2024-02-29', '37.0', '70', '16', '120', '80',
+               '97')[0] == 0
+    assert run(capsys, '--file', patientsFile, 'delete', '3')[0] == 0
+    patients = readPatientsFromFile(patientsFile)
+    assert 3 not in patients and patients[500] == [['2024-02-29', 37.0, 70, 16, 120, 80, 97]]
+
+    _, out, _ = run(capsys, '--file', patientsFile, 'add', '500', '2024-02-30', '37.0', '70', '16', '120', '80',
+                    '97')
+    # addPatientData reports a rejected visit itself, as in the menu
+    assert out == "Invalid date. Please enter a valid date.\n"
+    assert readPatientsFromFile(patientsFile)[500] == patients[500]
+    status, _, err = run(capsys, '--file', patientsFile, 'stats', 'three')
+    assert status == 2 and 'usage: cli.py' in err
+
+
+def testBatchAnswersEveryLine(patientsFile, tmp_path, capsys):
+    batch = tmp_path / 'commands.txt'
+    batch.write_text("# a comment\n"
+                     "\n"
+                     "add 500 2024-02-29 37.0 70 16 120 80 97\n"
+                     "frobnicate\n"
+                     "find-visits --year 2024 --month 2 --format csv\n"
+                     "show 500\n")
+    status, out, _ = run(capsys, '--file', patientsFile, '--batch', str(batch))
+    assert status == 1
+    lines = out.splitlines()
+    assert lines[0] == "Visit is saved successfully for Patient #500"
+    assert lines[1].startswith("Error in batch line 4: cli.py: argument command: invalid choice: 'frobnicate'")
+    assert "500,2024-02-29,37.0,70,16,120,80,97" in lines
+    assert lines[-9:-7] == ["Patient ID: 500", " Visit Date: 2024-02-29"]
+
+    batch.write_text("stats 500\n")
+    assert run(capsys, '--file', patientsFile, '--batch', str(batch))[0] == 0
+    assert run(capsys, '--file', patientsFile, '--batch', str(batch), 'stats')[0] == 2
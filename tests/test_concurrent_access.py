@@ -0,0 +1,58 @@
+from concurrent_access import QueryExecutor, SharedPatients, prepareForReads
+from main_22BECD87 import addPatientData, deleteAllVisitsOfPatient, findPatientsWhoNeedFollowUp, findVisitsByDate
+from monthly_rollups import vitalTrends
+from snapshot import loadPatients
+
+
+def visitsOfYear(patients, year):
+    return findVisitsByDate(patients, year)
+
+
+def statsOf(patients, patientId):
+    aggregate = patients.aggregates.get(patientId)
+    return aggregate.count, [round(mean, 6) for mean in aggregate.means()]
+
+
+def trends(patients):
+    return [(period, rollup.count) for period, rollup in vitalTrends(patients, 2018, 2024)]
+
+
+def reads(patientIds):
+    reads = [(findPatientsWhoNeedFollowUp, ()), (trends, ())]
+    reads += [(visitsOfYear, (year,)) for year in range(2018, 2025)]
+    reads += [(statsOf, (patientId,)) for patientId in patientIds[:40]]
+    return reads
+
+
+def testPrepareForReadsCompactsStore(patientsFile, capsys):
+    patients = loadPatients(patientsFile)
+    prepareForReads(patients)
+    for patientId in list(patients)[:6]:
+        deleteAllVisitsOfPatient(patients, patientId, patientsFile)
+        prepareForReads(patients)
+        assert patients.isCompact()
+    addPatientData(patients, list(patients)[1], '2024-02-29', 37.0, 70, 16, 120, 80, 97, patientsFile)
+    assert not patients.isCompact()
+    prepareForReads(patients)
+    assert patients.isCompact()
+
+
+def testConcurrentReadsMatchSerialReads(patientsFile, capsys):
+    patients = loadPatients(patientsFile)
+    patientIds = list(patients)
+    shared = SharedPatients(patients, patientsFile)
+    with QueryExecutor(shared, workers=8) as executor:
+        for step in range(5):
+            mix = reads(patientIds[5:])
+            results = [[executor.submit(function, *args) for function, args in mix] for _ in range(4)]
+            executor.submitWrite(deleteAllVisitsOfPatient, patientIds[step], patientsFile).result()
+            executor.submitWrite(addPatientData, patientIds[-1], '2024-02-29', 37.0, 70, 16, 120, 80, 97,
+                                 patientsFile).result()
+            # Reads submitted before a write may run before or after it; reads submitted
+            # after it see it, all the same, like a serial run on a fresh load
+            expected = [function(loadPatients(patientsFile), *args) for function, args in mix]
+            after = [executor.submit(function, *args) for function, args in mix]
+            assert [future.result() for future in after] == expected
+            for futures in results:
+                for future in futures:
+                    future.result()
@@ -0,0 +1,46 @@
+import pytest
+
+from main_22BECD87 import addPatientData, deleteAllVisitsOfPatient, findPatientsWhoNeedFollowUp, readPatientsFromFile
+from visit_store import loadVisitStore
+
+NORMAL = ['2024-02-29', 37.0, 70, 16, 120, 80, 97]
+FEBRILE = ['2024-03-01', 38.5, 70, 16, 120, 80, 97]
+
+
+@pytest.mark.parametrize('loader', [readPatientsFromFile, loadVisitStore])
+def testMappingChangesReachTracker(loader, patientsFile, capsys):
+    patients = loader(patientsFile)
+    flagged = findPatientsWhoNeedFollowUp(patients)
+    deleted = flagged[0]
+    healthy = next(patientId for patientId in patients if patientId not in flagged)
+
+    del patients[deleted]
+    patients[healthy].append(FEBRILE)
+    patients[flagged[1]].append(NORMAL)
+
+    expected = findPatientsWhoNeedFollowUp({patientId: list(visits) for patientId, visits in patients.items()})
+    assert deleted not in expected and healthy in expected and flagged[1] not in expected
+    assert findPatientsWhoNeedFollowUp(patients) == expected
+
+
+def testSubscribersSeeStatusChanges(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    flagged = findPatientsWhoNeedFollowUp(patients)
+    healthy = next(patientId for patientId in patients if patientId not in flagged)
+    events = []
+
+    def callback(patientId, needsFollowUp):
+        events.append((patientId, needsFollowUp))
+
+    patients.followUp.subscribe(callback)
+
+    addPatientData(patients, healthy, *FEBRILE, patientsFile)
+    addPatientData(patients, healthy, *FEBRILE, patientsFile)  # no change of status
+    addPatientData(patients, healthy, *NORMAL, patientsFile)
+    deleteAllVisitsOfPatient(patients, flagged[0], patientsFile)
+    assert events == [(healthy, True), (healthy, False), (flagged[0], False)]
+
+    patients.followUp.unsubscribe(callback)
+    addPatientData(patients, healthy, *FEBRILE, patientsFile)
+    assert len(events) == 3
+    assert healthy in findPatientsWhoNeedFollowUp(patients)
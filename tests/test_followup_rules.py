@@ -0,0 +1,95 @@
+import json
+import os
+import random
+
+import pytest
+
+from followup import needsFollowUp
+from followup_rules import DEFAULT_RULES, SEVERITIES, RuleSet, TrendRule, loadRules
+from visit_store import VisitStore
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'followup_rules.json')
+
+
+def randomPatients(rng):
+    patients = {}
+    for patientId in rng.sample(range(1, 500), rng.randint(1, 60)):
+        patients[patientId] = [['2020-01-%02d' % day, round(rng.uniform(34.5, 40.0), 1), rng.randint(40, 140),
+                                rng.randint(8, 30), rng.randint(80, 190), rng.randint(50, 125), rng.randint(85, 100)]
+                               for day in range(1, rng.randint(2, 7))]
+    return patients
+
+
+def screenedOneByOne(rules, patients, minSeverity):
+    lowest = SEVERITIES.index(minSeverity or SEVERITIES[0])
+    screened = []
+    for patientId, visits in patients.items():
+        levels = [SEVERITIES.index(rule.severity) for rule in rules.rules
+                  if rule.matches(visits) and SEVERITIES.index(rule.severity) >= lowest]
+        if levels:
+            screened.append((patientId, SEVERITIES[max(levels)]))
+    return screened
+
+
+@pytest.mark.parametrize('seed', range(10))
+def testScreenMatchesRulesOneByOne(seed):
+    rules = loadRules(RULES_FILE)
+    patients = randomPatients(random.Random(seed))
+    store = VisitStore.fromPatients(patients)
+    deleted = next(iter(patients))
+    del patients[deleted]
+    del store[deleted]
+
+    flagged = [patientId for patientId, visits in patients.items() if needsFollowUp(visits[-1])]
+    for collection in (patients, store):
+        assert DEFAULT_RULES.flagged(collection) == flagged
+        for minSeverity in (None,) + SEVERITIES:
+            assert rules.screen(collection, minSeverity) == screenedOneByOne(rules, patients, minSeverity)
+
+
+def testTrendRules():
+    rising = TrendRule('rising', 'temperature', 3, 1.0, monotonic=True)
+    falling = TrendRule('falling', 'spo2', 3, -3)
+    visits = [['2020-01-01', 36.3, 70, 16, 120, 80, 97], ['2020-01-02', 36.8, 70, 16, 120, 80, 99],
+              ['2020-01-03', 37.3, 70, 16, 120, 80, 94]]
+    # 37.3 - 36.3 falls just short of 1.0 in floating point
+    assert rising.matches(visits) and falling.matches(visits)
+    assert not rising.matches(visits[:2]) and not falling.matches(visits[1:])
+
+    visits[1][1] = 37.5
+    assert not rising.matches(visits)
+    assert TrendRule('rising', 'temperature', 3, 1.0).matches(visits)
+
+    patients = {1: visits, 2: visits[:2], 3: visits[::-1]}
+    rules = RuleSet([rising, falling])
+    assert rules.screen(patients) == [(1, 'medium')]
+    assert rules.screen(VisitStore.fromPatients(patients)) == [(1, 'medium')]
+    assert rules.matchedRules(visits) == ['falling'] and rules.severityOf(visits[::-1]) is None
+
+
+@pytest.mark.parametrize('config, message', [
+    ({'rules': [{'name': 'fever'}]}, "Rule 1 needs a vital sign"),
+    ({'rules': [{'vital': 'pulse', 'max': 100}]}, "Unknown vital sign 'pulse'"),
+    ({'rules': [{'vital': 'spo2', 'min': 90, 'severity': 'urgent'}]}, "Unknown severity 'urgent'"),
+    ({'rules': [{'name': 'fever', 'vital': 'temperature'}]}, "Rule 'fever' needs a minimum or a maximum"),
+    ({'rules': [{'vital': 'spo2', 'trend': {'visits': 1, 'change': -3}}]}, "needs a window of at least 2 visits"),
+    ({'rules': [{'name': 'a', 'vital': 'spo2', 'min': 90}, {'name': 'a', 'vital': 'spo2', 'min': 95}]},
+     "Rule names must be unique"),
+    ([], "should hold an object with a list of rules"),
+])
+def testInvalidRulesFilesAreRejected(tmp_path, config, message):
+    fileName = str(tmp_path / 'rules.json')
+    with open(fileName, 'w') as file:
+        json.dump(config, file)
+    with pytest.raises(ValueError, match=message):
+        loadRules(fileName)
+
+
+def testUnreadableRulesFilesAreRejected(tmp_path):
+    fileName = str(tmp_path / 'rules.json')
+    with open(fileName, 'w') as file:
+        file.write('{"rules": [')
+    with pytest.raises(ValueError, match="is not valid JSON"):
+        loadRules(fileName)
+    with pytest.raises(ValueError, match="could not be found"):
+        loadRules(str(tmp_path / 'missing.json'))
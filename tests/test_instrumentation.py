@@ -0,0 +1,86 @@
+import json
+import threading
+
+import pytest
+
+from bulk_ingest import parseLines
+from instrumentation import METRICS_ENV, Metrics, entryPoint, metrics, timed
+from main_22BECD87 import readPatientsFromFile
+
+
+@pytest.fixture
+def enabledMetrics():
+    """
+    The module-level metrics, enabled and empty, disabled again afterwards.
+    """
+    metrics.reset()
+    metrics.enable()
+    yield metrics
+    metrics.disable()
+    metrics.reset()
+
+
+def rejectedCounts(counters):
+    return {name: value for name, value in counters.items() if '.rejected.' in name}
+
+
+def testRejectedLinesAreCountedByReason(patientsFile, enabledMetrics, capsys):
+    readPatientsFromFile(patientsFile)
+    assert rejectedCounts(enabledMetrics.counters) == {
+        'load.rejected.number of fields': 2,
+        'load.rejected.unreadable value': 2,
+        'load.rejected.date': 2,
+        'load.rejected.temperature': 1,
+        'load.rejected.oxygen saturation': 1,
+    }
+    assert enabledMetrics.counters['load.lines'] == 2008
+    assert enabledMetrics.counters['load.visits'] == 2000
+
+    # A value too large for the column arrays sends the block through the line by line parser
+    enabledMetrics.reset()
+    parseLines(["1,2022-01-05,37.0,99999,16,120,80,97", "2,2022-01-05,37.0,70,16", "3,2022-01-05,37.0,70,16,120,80,97"])
+    assert rejectedCounts(enabledMetrics.counters) == {'load.rejected.heart rate': 1,
+                                                       'load.rejected.number of fields': 1}
+
+
+def testNothingIsCountedWhileDisabled(patientsFile, capsys):
+    metrics.reset()
+    readPatientsFromFile(patientsFile)
+    assert not metrics.counters and not metrics.timers
+
+
+def testResetWaitsForRecordingThreads():
+    recorded = Metrics(enabled=True)
+    recorded.count('visits')
+    with recorded._lock:
+        resetting = threading.Thread(target=recorded.reset)
+        resetting.start()
+        resetting.join(0.05)
+        assert resetting.is_alive() and recorded.counters['visits'] == 1
+    resetting.join()
+    assert not recorded.counters
+
+
+def testEntryPointWritesMetrics(tmp_path, monkeypatch):
+    @timed('work')
+    def work(amount):
+        metrics.count('work.items', amount)
+        return amount
+
+    @entryPoint
+    def program():
+        return work(2) + work(3)
+
+    assert program() == 5 and not metrics.enabled
+
+    fileName = str(tmp_path / 'metrics.json')
+    monkeypatch.setenv(METRICS_ENV, fileName)
+    try:
+        assert program() == 5
+    finally:
+        metrics.disable()
+    with open(fileName) as file:
+        snapshot = json.load(file)
+    metrics.reset()
+    assert snapshot['counters'] == {'work.items': 5}
+    assert snapshot['timers']['work']['calls'] == 2
@@ -0,0 +1,46 @@
+import pytest
+
+from followup import needsFollowUp
+from main_22BECD87 import addPatientData, deleteAllVisitsOfPatient, readPatientsFromFile
+from monthly_rollups import vitalTrends
+from visit_store import loadVisitStore
+
+
+def asLists(patients):
+    return {patientId: list(visits) for patientId, visits in patients.items()}
+
+
+def trends(patients, monthly):
+    return [(period, rollup.asDict()) for period, rollup in vitalTrends(patients, 2018, 2024, monthly)]
+
+
+@pytest.mark.parametrize('monthly', [False, True])
+def testTrendsMatchVisits(patientsFile, monthly, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    visits = [visit for patientVisits in patients.values() for visit in patientVisits]
+    for period, rollup in vitalTrends(patients, 2018, 2024, monthly):
+        inPeriod = [visit for visit in visits if visit[0].startswith(period)]
+        assert rollup.count == len(inPeriod)
+        assert rollup.followUps == sum(map(needsFollowUp, inPeriod))
+        assert rollup.maximums[0] == max(visit[1] for visit in inPeriod)
+        assert rollup.means()[1] == pytest.approx(sum(visit[2] for visit in inPeriod) / len(inPeriod))
+    assert sum(rollup.count for _, rollup in vitalTrends(patients, 2018, 2024, monthly)) == len(visits)
+    with pytest.raises(ValueError):
+        vitalTrends(patients, 2024, 2018)
+
+
+@pytest.mark.parametrize('loader', [readPatientsFromFile, loadVisitStore])
+def testRollupsFollowChanges(loader, patientsFile, capsys):
+    patients = loader(patientsFile)
+    trends(patients, True)
+    first, second, third = list(patients)[:3]
+
+    addPatientData(patients, first, '2019-07-04', 38.5, 70, 16, 120, 80, 97, patientsFile)
+    deleteAllVisitsOfPatient(patients, second, patientsFile)
+    assert trends(patients, True) == trends(asLists(patients), True)
+
+    # Changes through the mapping API tell no index about themselves
+    patients[first].append(['2020-01-15', 36.5, 70, 16, 120, 80, 97])
+    del patients[third]
+    assert trends(patients, True) == trends(asLists(patients), True)
+    assert trends(patients, False) == trends(asLists(patients), False)
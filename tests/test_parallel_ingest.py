@@ -0,0 +1,46 @@
+import os
+from functools import partial
+
+import pytest
+
+import parallel_ingest
+from conftest import INVALID_LINES, load, writeLines
+from main_22BECD87 import readPatientsFromFile
+from parallel_ingest import loadVisitStoreParallel, readPatientsParallel, splitFile
+
+
+@pytest.fixture
+def smallChunks(monkeypatch):
+    # Lets the small test files be cut into several chunks, parsed by worker processes
+    monkeypatch.setattr(parallel_ingest, 'MIN_CHUNK_SIZE', 4096)
+
+
+def testChunksEndAtLineBoundaries(patientsFile, smallChunks):
+    ranges = splitFile(patientsFile, 5)
+    assert len(ranges) == 5
+    assert ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(patientsFile)
+    with open(patientsFile, 'rb') as file:
+        data = file.read()
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[start - 1:start] == b'\n'
+
+
+@pytest.mark.parametrize('loader', [readPatientsParallel, loadVisitStoreParallel])
+def testParallelLoadersAgreeWithDictLoader(loader, patientsFile, smallChunks, capsys):
+    expected = load(readPatientsFromFile, patientsFile, capsys)
+    assert load(partial(loader, workers=3), patientsFile, capsys) == expected
+
+
+def testShardsLoadAsOneFile(patientsFile, tmp_path, smallChunks, capsys):
+    with open(patientsFile) as file:
+        lines = file.read().split('\n')
+    shards = [str(tmp_path / 'clinic1.txt'), str(tmp_path / 'clinic2.txt')]
+    writeLines(shards[0], lines[:1000])
+    writeLines(shards[1], lines[1000:] + [INVALID_LINES[0][0]])
+
+    expected, messages = load(readPatientsFromFile, patientsFile, capsys)
+    patients, reported = load(partial(readPatientsParallel, workers=2), shards, capsys)
+    assert patients == expected
+    line = len(lines) - 1000 + 1
+    assert reported[-1] == f"{shards[1]}: Invalid number of fields (7) in line: {line}"
+    assert [message.split(': ', 1)[1] for message in reported[:4]] == messages[:4]
@@ -0,0 +1,42 @@
+import random
+
+import patient_index
+from conftest import visitLine
+from main_22BECD87 import addPatientData, deleteAllVisitsOfPatient, readPatientsFromFile
+from patient_index import IndexedPatients, PatientIndex, buildIndex
+
+
+def testLookupsAfterAppends(patientsFile, monkeypatch, capsys):
+    # A small threshold makes the appends below cross it, so merges are covered too
+    monkeypatch.setattr(patient_index, 'MERGE_THRESHOLD', 8)
+    buildIndex(patientsFile)
+    rng = random.Random(2)
+    for number in range(30):
+        with open(patientsFile, 'a') as file:
+            file.write('\n' + visitLine(rng, rng.choice((3, 7, 500 + number))))
+        index = PatientIndex.open(patientsFile)
+        assert len(index._appendedIds) <= 8
+        index.close()
+
+    expected = readPatientsFromFile(patientsFile)
+    index = PatientIndex.open(patientsFile)
+    assert index.patientIds() == sorted(expected)
+    for patientId in expected:
+        assert index.readVisits(patientId) == expected[patientId]
+    assert index.readVisits(10_000) == []
+    index.close()
+
+
+def testIndexedPatientsSeeWrites(patientsFile, capsys):
+    buildIndex(patientsFile)
+    patients = IndexedPatients(patientsFile)
+    addPatientData(patients, 3, '2024-02-29', 37.0, 70, 16, 120, 80, 97, patientsFile)
+    deleteAllVisitsOfPatient(patients, 7, patientsFile)
+    patients.close()
+
+    expected = readPatientsFromFile(patientsFile)
+    patients = IndexedPatients(patientsFile)
+    assert 7 not in patients
+    assert patients[3] == expected[3]
+    assert patients[3][-1][0] == '2024-02-29'
+    patients.close()
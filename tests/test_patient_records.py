@@ -0,0 +1,83 @@
+from main_22BECD87 import addPatientData, deleteAllVisitsOfPatient, findPatientsWhoNeedFollowUp, findVisitsByDate, \
+    readPatientsFromFile
+from patient_records import PatientRecords
+from visit_record import Visit
+
+FEBRILE = Visit('2024-03-01', 39.5, 70, 16, 120, 80, 97)
+
+
+def plain(patients):
+    """
+    Returns a copy of a PatientRecords as a plain dictionary, which the functions
+    of main_22BECD87 scan instead of using indexes.
+    """
+    return {patientId: list(visits) for patientId, visits in patients.items()}
+
+
+def assertIndexesCurrent(patients):
+    expected = plain(patients)
+    assert findPatientsWhoNeedFollowUp(patients) == findPatientsWhoNeedFollowUp(expected)
+    for year in (2018, 2021, 2024):
+        assert findVisitsByDate(patients, year) == findVisitsByDate(expected, year)
+    assert patients.aggregates.merged().count == sum(map(len, expected.values()))
+
+
+def testIndexedChangesStayIncremental(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    addPatientData(patients, 3, '2024-03-01', 39.5, 70, 16, 120, 80, 97, patientsFile)
+    deleteAllVisitsOfPatient(patients, 5, patientsFile)
+    assert not patients._unindexed and not patients._stale
+    assertIndexesCurrent(patients)
+
+
+def testPlainDictChangesAreNoticed(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    patientIds = list(patients)
+    changes = (
+        lambda: patients.__delitem__(patientIds[0]),
+        lambda: patients[patientIds[1]].append(FEBRILE),
+        lambda: patients.pop(patientIds[2]),
+        lambda: patients.__setitem__(patientIds[3], [FEBRILE]),
+        lambda: patients.__setitem__(10_000, [FEBRILE]),
+        lambda: patients[patientIds[4]].insert(0, FEBRILE),
+        lambda: patients[patientIds[5]].pop(),
+        lambda: patients.update({10_001: [FEBRILE]}),
+        lambda: patients.setdefault(10_002, []).append(FEBRILE),
+        lambda: patients.popitem(),
+        lambda: patients.clear(),
+    )
+    for change in changes:
+        assertIndexesCurrent(patients)
+        change()
+        assertIndexesCurrent(patients)
+
+
+def testRecordsFromDictionary():
+    patients = PatientRecords({1: [FEBRILE], 2: [Visit('2024-03-02', 37.0, 70, 16, 120, 80, 97)]})
+    assert findPatientsWhoNeedFollowUp(patients) == [1]
+    patients[2].append(FEBRILE)
+    assert findPatientsWhoNeedFollowUp(patients) == [1, 2]
+
+
+def testIndexesAreBuiltOnFirstQuery(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    assert len(patients.indexes) == 1
+    findVisitsByDate(patients, 2021)
+    assert patients.dateIndex in patients.indexes
+    assert len(patients.indexes) == 2
+    findPatientsWhoNeedFollowUp(patients)
+    assert patients.followUp in patients.indexes
+
+
+def testDateIndexMatchesScans(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    # A date that is not 'yyyy-mm-dd' still has a year
+    patients[3].append(Visit('2021-7-04', 37.0, 70, 16, 120, 80, 97))
+    expected = plain(patients)
+    assert (3, patients[3][-1]) in findVisitsByDate(patients, 2021)
+    for year in range(2017, 2026):
+        assert findVisitsByDate(patients, year) == findVisitsByDate(expected, year)
+        for month in (1, 7, 12):
+            assert findVisitsByDate(patients, year, month) == findVisitsByDate(expected, year, month)
+    for month in range(1, 13):
+        assert findVisitsByDate(patients, month=month) == findVisitsByDate(expected, month=month)
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from conftest import asLists
+from query_server import QueryServer
+from storage import openPatients
+from tail_follow import TailFollower
+
+
+class FailingStorage:
+    """
+    A storage whose every save fails, as on a full disk.
+    """
+
+    def saveVisits(self, visits):
+        raise OSError("No space left on device")
+
+    def deletePatient(self, patientId):
+        raise OSError("No space left on device")
+
+
+def openServer(fileName, follow):
+    if follow:
+        follower = TailFollower(fileName)
+        return QueryServer(follower.patients, fileName, follower=follower)
+    return QueryServer(openPatients(fileName), fileName)
+
+
+def answers(server, *requests):
+    async def handleAll():
+        return [await server.handle(request) for request in requests]
+    return asyncio.run(handleAll())
+
+
+def rounded(value):
+    """
+    Rounds the floats in a response, which differ in their last bits with the order of summing.
+    """
+    if isinstance(value, float):
+        return round(value, 9)
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [rounded(item) for item in value]
+    return value
+
+
+def reads(server, patientIds):
+    """
+    Returns the results of the read requests the indexes answer, for comparing.
+    """
+    responses = answers(server, {'op': 'followUp'}, {'op': 'findVisits', 'year': 2024},
+                        {'op': 'trends', 'monthly': True}, {'op': 'stats'},
+                        *({'op': 'stats', 'patientId': patientId} for patientId in patientIds))
+    assert all(response['ok'] for response in responses)
+    results = rounded([response['result'] for response in responses])
+    results[0].sort()
+    results[1].sort()
+    return results
+
+
+def addRequest(patientId, date='2024-02-29', temp=38.5):
+    return {'op': 'add', 'patientId': patientId, 'date': date, 'temp': temp, 'hr': 70, 'rr': 16, 'sbp': 120,
+            'dbp': 80, 'spo2': 97}
+
+
+@pytest.mark.parametrize('follow', [False, True])
+def testWritesReachFileAndReads(patientsFile, follow, capsys):
+    server = openServer(patientsFile, follow)
+    server.warm()
+    first, second = list(server.patients)[:2]
+
+    responses = answers(server, addRequest(first), addRequest(500, '2023-02-28'), {'op': 'delete', 'patientId': second},
+                        {'op': 'delete', 'patientId': second}, addRequest(501, '2023-02-29'))
+    assert [response['ok'] for response in responses] == [True, True, True, False, False]
+    assert responses[3]['error'] == f"No data found for patient with ID {second}"
+    assert responses[4]['error'] == "Invalid date. Please enter a valid date."
+
+    patients = asLists(server.patients)
+    assert patients[first][-1] == ['2024-02-29', 38.5, 70, 16, 120, 80, 97]
+    assert second not in patients and 501 not in patients
+    assert asLists(openPatients(patientsFile)) == patients
+    assert reads(server, [first, 500]) == reads(QueryServer(patients, patientsFile), [first, 500])
+
+
+@pytest.mark.parametrize('follow', [False, True])
+def testFailedSavesAreRolledBack(patientsFile, follow, capsys):
+    server = openServer(patientsFile, follow)
+    server.warm()
+    first, second = list(server.patients)[:2]
+    before = asLists(server.patients)
+    expected = reads(server, [first, second])
+
+    server.storage = FailingStorage()
+    responses = answers(server, addRequest(first), addRequest(500), {'op': 'delete', 'patientId': second})
+    assert [response['error'] for response in responses] == ["An unexpected error occurred: No space left on device"] * 3
+
+    assert asLists(server.patients) == before
+    assert reads(server, [first, second]) == expected
@@ -0,0 +1,37 @@
+import os
+import random
+
+from conftest import asLists, load, visitLine, writeLines
+from main_22BECD87 import readPatientsFromFile
+from snapshot import loadPatients, snapshotPath
+
+
+def testSnapshotAgreesWithDictLoader(patientsFile, capsys):
+    expected, messages = load(readPatientsFromFile, patientsFile, capsys)
+    assert load(loadPatients, patientsFile, capsys) == (expected, messages)
+    assert os.path.exists(snapshotPath(patientsFile))
+    # Loaded from the snapshot, the invalid lines are not read again
+    assert load(loadPatients, patientsFile, capsys) == (expected, [])
+
+
+def testSnapshotFollowsTextFile(patientsFile, capsys):
+    loadPatients(patientsFile)
+    rng = random.Random(3)
+
+    # Lines appended since the snapshot was written are parsed on top of it
+    with open(patientsFile, 'a') as file:
+        file.write('\n' + '\n'.join(visitLine(rng, patientId) for patientId in (3, 500)))
+    assert asLists(loadPatients(patientsFile)) == asLists(readPatientsFromFile(patientsFile))
+    assert 500 in loadPatients(patientsFile)
+
+    # A rewritten file is loaded in full
+    writeLines(patientsFile, [visitLine(rng, patientId) for patientId in (1, 2, 1)])
+    patients = loadPatients(patientsFile)
+    assert asLists(patients) == asLists(readPatientsFromFile(patientsFile))
+    assert list(patients) == [1, 2]
+
+
+def testMissingFileIsReported(tmp_path, capsys):
+    fileName = str(tmp_path / 'missing.txt')
+    assert len(loadPatients(fileName)) == 0
+    assert capsys.readouterr().out.splitlines() == [f"The file '{fileName}' could not be found."]
@@ -0,0 +1,46 @@
+import pytest
+
+from conftest import asLists, load
+from main_22BECD87 import (addPatientData, deleteAllVisitsOfPatient, findPatientsWhoNeedFollowUp, findVisitsByDate,
+                           readPatientsFromFile)
+from sqlite_store import SqliteStore
+
+
+def importSqlite(fileName):
+    store = SqliteStore(fileName + '.db')
+    store.importTextFile(fileName)
+    return store
+
+
+def testImportAgreesWithDictLoader(patientsFile, capsys):
+    expected, messages = load(readPatientsFromFile, patientsFile, capsys)
+    patients, reported = load(importSqlite, patientsFile, capsys)
+    assert patients == expected
+    assert reported == messages
+
+
+@pytest.mark.parametrize('year, month', [(2020, None), (2020, 6), (None, 6), (None, None), (202, None), (20, None),
+                                         (2, 2), (9999, None)])
+def testDateQueriesAgreeWithDictLoader(patientsFile, year, month, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    store = importSqlite(patientsFile)
+    expected = findVisitsByDate(asLists(patients), year, month)
+    assert findVisitsByDate(store, year, month) == expected
+    assert bool(expected) == (year in (2020, None))
+
+
+def testChangesAreSaved(patientsFile, capsys):
+    store = importSqlite(patientsFile)
+    first, second = list(store)[:2]
+    addPatientData(store, first, '2024-02-29', 38.5, 70, 16, 120, 80, 97, patientsFile)
+    addPatientData(store, 500, '9999-12-31', 37.0, 70, 16, 120, 80, 97, patientsFile)
+    deleteAllVisitsOfPatient(store, second, patientsFile)
+    expected = asLists(store)
+    followUp = findPatientsWhoNeedFollowUp(store)
+    store.close()
+
+    store = SqliteStore(patientsFile + '.db')
+    assert asLists(store) == expected
+    assert findPatientsWhoNeedFollowUp(store) == followUp == findPatientsWhoNeedFollowUp(expected)
+    assert findVisitsByDate(store, 9999) == [(500, ['9999-12-31', 37.0, 70, 16, 120, 80, 97])]
+    store.close()
@@ -0,0 +1,96 @@
+import os
+
+from conftest import asLists
+from main_22BECD87 import addPatientData, deleteAllVisitsOfPatient, findPatientsWhoNeedFollowUp, findVisitsByDate
+from snapshot import loadPatients
+from tail_follow import TailFollower
+from visit_log import appendTombstone
+
+
+def append(fileName, text):
+    """
+    Appends text to a file, as another program would.
+    """
+    with open(fileName, 'a') as file:
+        file.write(text)
+
+
+def inLists(pair):
+    patientId, visit = pair
+    return patientId, list(visit)
+
+
+def assertInStep(follower, capsys):
+    """
+    Checks that the followed collection and its indexes match a full load of the file.
+    """
+    capsys.readouterr()
+    loaded = asLists(loadPatients(follower.fileName))
+    capsys.readouterr()
+    assert asLists(follower.patients) == loaded
+    assert findPatientsWhoNeedFollowUp(follower.patients) == findPatientsWhoNeedFollowUp(loaded)
+    assert sorted(map(inLists, findVisitsByDate(follower.patients, 2024))) == \
+        sorted(map(inLists, findVisitsByDate(loaded, 2024)))
+
+
+def testRefreshAddsAppendedVisitsAndDeletions(patientsFile, capsys):
+    reported = []
+    follower = TailFollower(patientsFile, report=reported.append)
+    first, second = list(follower.patients)[:2]
+    lines = follower.lines
+    assert not follower.refresh()
+
+    append(patientsFile, f"\n{first},2024-02-29,38.5,70,16,120,80,97\n500,2024-03-01,37.0,70,16,120,80,97")
+    appendTombstone(patientsFile, second)
+    append(patientsFile, f"\n{second},2024-03-02,37.0,70,16,120,80,97\n501,2024-02-30,37.0,70,16,120,80,97")
+    assert follower.refresh()
+    assert reported == [f"Invalid date value (2024-02-30) in line: {lines + 4}"]
+    assert follower.patients[second] == [['2024-03-02', 37.0, 70, 16, 120, 80, 97]]
+    assert follower.reloads == 0 and follower.lines == lines + 4
+    assertInStep(follower, capsys)
+
+    # Another program's addPatientData completes the last line with its newline
+    addPatientData({}, 502, '2024-03-03', 37.0, 70, 16, 120, 80, 97, patientsFile)
+    deleteAllVisitsOfPatient({first: []}, first, patientsFile)
+    assert follower.refresh() and follower.reloads == 0
+    assert 502 in follower.patients and first not in follower.patients
+    assertInStep(follower, capsys)
+
+
+def testOwnChangesAreNotReadBack(patientsFile, capsys):
+    follower = TailFollower(patientsFile)
+    patients = follower.patients
+    first = next(iter(patients))
+    count = len(patients[first])
+
+    append(patientsFile, "\n500,2024-03-01,37.0,70,16,120,80,97")
+    addPatientData(patients, first, '2024-02-29', 38.5, 70, 16, 120, 80, 97, patientsFile)
+    assert 500 in patients and len(patients[first]) == count + 1
+    deleteAllVisitsOfPatient(patients, 500, patientsFile)
+    assert not follower.refresh() and follower.reloads == 0
+    assertInStep(follower, capsys)
+
+
+def testChangedFilesAreLoadedAgain(patientsFile, capsys):
+    follower = TailFollower(patientsFile)
+
+    # A last line still being written when it was read
+    append(patientsFile, "\n500,2024-03-01,37.0,70,16,120,80,9")
+    follower.refresh()
+    append(patientsFile, "7")
+    assert follower.refresh() and follower.reloads == 1
+    assert follower.patients[500] == [['2024-03-01', 37.0, 70, 16, 120, 80, 97]]
+
+    # A file replaced by another one
+    with open(patientsFile + '.new', 'w') as file:
+        file.write("7,2024-03-01,37.0,70,16,120,80,97")
+    os.replace(patientsFile + '.new', patientsFile)
+    assert follower.refresh() and follower.reloads == 2
+    assert asLists(follower.patients) == {7: [['2024-03-01', 37.0, 70, 16, 120, 80, 97]]}
+
+    # A deletion followed by a new visit of the patient, both new to the follower
+    appendTombstone(patientsFile, 7)
+    append(patientsFile, "\n7,2024-03-02,37.0,70,16,120,80,97")
+    assert follower.refresh() and follower.reloads == 2
+    assert follower.patients[7] == [['2024-03-02', 37.0, 70, 16, 120, 80, 97]]
+    assertInStep(follower, capsys)
@@ -0,0 +1,56 @@
+import os
+
+import storage
+from conftest import asLists
+from main_22BECD87 import addPatientData, deleteAllVisitsOfPatient, readPatientsFromFile
+from snapshot import loadPatients
+from visit_log import appendTombstone, compactPatientsFile, logPath, readTombstones
+
+
+def testDeleteCompactReload(patientsFile, capsys):
+    patients = loadPatients(patientsFile)
+    expected = asLists(readPatientsFromFile(patientsFile))
+    deleted = list(patients)[:5]
+    for patientId in deleted:
+        deleteAllVisitsOfPatient(patients, patientId, patientsFile)
+        del expected[patientId]
+    # A visit added after the deletion of its patient stays
+    addPatientData(patients, deleted[0], '2024-02-29', 37.0, 70, 16, 120, 80, 97, patientsFile)
+    expected[deleted[0]] = list(patients[deleted[0]])
+    assert asLists(patients) == expected
+    assert os.path.exists(logPath(patientsFile))
+
+    # The deletion log is replayed by every loader, from the snapshot or the text file
+    assert asLists(loadPatients(patientsFile)) == expected
+    assert asLists(readPatientsFromFile(patientsFile)) == expected
+
+    assert compactPatientsFile(patientsFile) > 0
+    assert not os.path.exists(logPath(patientsFile))
+    assert asLists(loadPatients(patientsFile)) == expected
+    assert asLists(readPatientsFromFile(patientsFile)) == expected
+
+
+def testFileIsCompactedAtThreshold(patientsFile, monkeypatch, capsys):
+    monkeypatch.setattr(storage, 'COMPACTION_THRESHOLD', 3)
+    patients = readPatientsFromFile(patientsFile)
+    size = os.path.getsize(patientsFile)
+    for count, patientId in enumerate(list(patients)[:3], start=1):
+        deleteAllVisitsOfPatient(patients, patientId, patientsFile)
+        assert os.path.exists(logPath(patientsFile)) == (count < 3)
+    assert os.path.getsize(patientsFile) < size
+    assert asLists(readPatientsFromFile(patientsFile)) == asLists(patients)
+
+
+def testStaleOrTornLogIsIgnored(patientsFile, capsys):
+    assert appendTombstone(patientsFile, 3) == 1
+    with open(logPath(patientsFile), 'ab') as log:
+        log.write(b'7,10')  # a record cut short by a crash
+    cutoffs, size = readTombstones(patientsFile)
+    assert list(cutoffs) == [3] and size > 0
+
+    # A log left behind by an interrupted compaction names the replaced file
+    with open(patientsFile) as source, open(patientsFile + '.new', 'w') as target:
+        target.write(source.read())
+    os.replace(patientsFile + '.new', patientsFile)
+    assert readTombstones(patientsFile) == ({}, 0)
+    assert 3 in readPatientsFromFile(patientsFile)
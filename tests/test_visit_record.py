@@ -0,0 +1,42 @@
+import pickle
+
+import pytest
+
+import visit_record
+from visit_record import Visit, VisitDate, visitDate
+
+
+def testVisitBehavesLikeList():
+    fields = ['2024-02-29', 37.0, 70, 16, 120, 80, 97]
+    visit = Visit(*fields)
+    assert visit == fields and list(visit) == fields and visit[1:3] == [37.0, 70] and visit[-1] == 97
+    assert visit.date is visitDate('2024-02-29') and (visit.year, visit.month) == (2024, 2)
+    assert pickle.loads(pickle.dumps(visit)) == visit
+
+    visit[0] = '2024-03-01'
+    visit[2:4] = (72, 18)
+    fields[0], fields[2:4] = '2024-03-01', [72, 18]
+    assert visit == fields and type(visit.date) is VisitDate and visit.month == 3
+    visit[:] = ['2023-12-31', 36.5, 60, 12, 110, 70, 99]
+    assert visit.date is visitDate(20231231) and visit.vitals() == (36.5, 60, 12, 110, 70, 99)
+
+    with pytest.raises(ValueError, match="cannot assign 3 values to a slice of 2"):
+        visit[1:3] = [37.0, 70, 16]
+    with pytest.raises(ValueError, match="cannot assign 1 values to a slice of 7"):
+        visit[:] = [37.0]
+    with pytest.raises(IndexError):
+        visit[7] = 1
+    assert visit == ['2023-12-31', 36.5, 60, 12, 110, 70, 99]
+
+
+def testDateCachesAreBounded(monkeypatch):
+    monkeypatch.setattr(visit_record, 'DATE_CACHE_SIZE', 4)
+    monkeypatch.setattr(visit_record, '_DATES', {})
+    monkeypatch.setattr(visit_record, '_PACKED_DATES', {})
+    first = visitDate('2024-01-01')
+    assert visitDate(20240101) is first
+
+    days = [visitDate('2024-01-%02d' % day) for day in range(1, 11)]
+    assert len(visit_record._DATES) == 4 and len(visit_record._PACKED_DATES) == 1
+    assert visitDate('2024-01-10') is days[-1] and visitDate('2024-01-01') is not first
+    assert visitDate('2024-01-01') == first and visitDate('2024-01-01').ordinal == first.ordinal
@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+from contextlib import redirect_stdout
+
+from main_22BECD87 import findVisitsByDate, readPatientsFromFile
+from visit_render import CSV_HEADER, FORMAT_CSV, FORMAT_JSONL, renderPatients, renderVisitList
+from visit_store import loadVisitStore
+
+
+def printedPatients(patients):
+    """
+    Prints the visits of all patients with the print calls displayPatientData used to make.
+    """
+    for patient_id, visits in patients.items():
+        print(f"Patient ID: {patient_id}")
+        for visit in visits:
+            print(" Visit Date:", visit[0])
+            print(" " * 2, "Temperature:", "%.2f" % visit[1], "C")
+            print(" " * 2, "Heart Rate:", visit[2], "bpm")
+            print(" " * 2, "Respiratory Rate:", visit[3], "bpm")
+            print(" " * 2, "Systolic Blood Pressure:", visit[4], "mmHg")
+            print(" " * 2, "Diastolic Blood Pressure:", visit[5], "mmHg")
+            print(" " * 2, "Oxygen Saturation:", visit[6], "%")
+            print()
+
+
+def printedVisitList(visits):
+    """
+    Prints (patientId, visit) pairs with the print calls of the old option 5 listing.
+    """
+    for visit in visits:
+        print("Patient ID:", visit[0])
+        print(" Visit Date:", visit[1][0])
+        print("  Temperature:", "%.2f" % visit[1][1], "C")
+        print("  Heart Rate:", visit[1][2], "bpm")
+        print("  Respiratory Rate:", visit[1][3], "bpm")
+        print("  Systolic Blood Pressure:", visit[1][4], "mmHg")
+        print("  Diastolic Blood Pressure:", visit[1][5], "mmHg")
+        print("  Oxygen Saturation:", visit[1][6], "%")
+
+
+def printed(function, *args):
+    out = io.StringIO()
+    with redirect_stdout(out):
+        function(*args)
+    return out.getvalue()
+
+
+def testTextMatchesOldPrints(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    assert renderPatients(patients, chunkVisits=7) == printed(printedPatients, patients)
+    assert renderPatients(loadVisitStore(patientsFile)) == renderPatients(patients)
+
+    found = findVisitsByDate(patients, 2021)
+    assert renderVisitList(found, chunkVisits=7) == printed(printedVisitList, found)
+
+    out = io.StringIO()
+    assert renderPatients(patients, [3, 10_000, 7], out=out) is None
+    assert out.getvalue() == printed(printedPatients, {3: patients[3], 7: patients[7]})
+
+
+def testPagesCoverEveryVisit(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    pages = [renderPatients(patients, fmt=FORMAT_CSV, offset=offset, limit=300, header=False)
+             for offset in range(0, 2000, 300)]
+    assert CSV_HEADER + ''.join(pages) == renderPatients(patients, fmt=FORMAT_CSV)
+    assert renderPatients(patients, offset=2000) == ''
+
+    found = findVisitsByDate(patients, 2022)
+    assert renderVisitList(found, offset=5, limit=10) == printed(printedVisitList, found[5:15])
+
+
+def testCsvAndJsonLinesHoldTheVisits(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    expected = [[patientId, *visit] for patientId, visits in patients.items() for visit in visits]
+
+    rows = list(csv.reader(io.StringIO(renderPatients(patients, fmt=FORMAT_CSV))))
+    assert rows[0] == CSV_HEADER.strip().split(',')
+    assert [[int(row[0]), row[1], float(row[2]), *map(int, row[3:])] for row in rows[1:]] == expected
+
+    records = [json.loads(line) for line in renderPatients(patients, fmt=FORMAT_JSONL).splitlines()]
+    fields = ('date', 'temperature', 'heartRate', 'respiratoryRate', 'systolicBP', 'diastolicBP', 'spo2')
+    assert [[record['patientId'], *map(record.__getitem__, fields)] for record in records] == expected
@@ -0,0 +1,43 @@
+from conftest import asLists, load
+from main_22BECD87 import readPatientsFromFile
+from visit_store import VisitStore, loadVisitStore, packDate, unpackDate
+
+
+def testStoreAgreesWithDictLoader(patientsFile, capsys):
+    expected, messages = load(readPatientsFromFile, patientsFile, capsys)
+    patients, reported = load(loadVisitStore, patientsFile, capsys)
+    assert patients == expected
+    assert reported == messages
+
+
+def testStoreBehavesLikeDictionary(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    store = VisitStore.fromPatients(patients)
+    assert list(store) == list(patients)
+    assert asLists(store) == asLists(patients)
+
+    patientId = list(store)[0]
+    store[patientId].append(['2024-02-29', 37.0, 70, 16, 120, 80, 97])
+    assert store[patientId][-1] == ['2024-02-29', 37.0, 70, 16, 120, 80, 97]
+    assert len(store[patientId]) == len(patients[patientId]) + 1
+    assert store[patientId][:2] == patients[patientId][:2]
+    store[10_000] = [['2020-01-01', 36.5, 60, 12, 110, 70, 99]]
+    assert store.visitCount() == sum(map(len, patients.values())) + 2
+    del store[patientId]
+    assert patientId not in store and 10_000 in store
+    assert packDate('2024-02-29') == 20240229 and unpackDate(20240229) == '2024-02-29'
+
+
+def testStoreCompactionKeepsVisits(patientsFile, capsys):
+    patients = loadVisitStore(patientsFile)
+    for patientId in list(patients)[::3]:
+        del patients[patientId]
+    patients.append(list(patients)[0], '2024-01-01', 37.0, 70, 16, 120, 80, 97)
+    expected = asLists(patients)
+    byDate = patients.dateIndex.find(2024)
+    assert not patients.isCompact()
+
+    patients.compact()
+    assert patients.isCompact()
+    assert asLists(patients) == expected
+    assert patients.dateIndex.find(2024) == byDate
@@ -0,0 +1,51 @@
+from functools import partial
+
+import pytest
+
+from conftest import asLists, load
+from main_22BECD87 import findPatientsWhoNeedFollowUp, findVisitsByDate, readPatientsFromFile
+from visit_stream import (average_vitals, filter_abnormal, filter_date_range, filter_patients, filter_year_month,
+                          iter_visits, patients_needing_follow_up)
+from vital_stats import vitalMeans
+
+
+def readStream(fileName):
+    patients = {}
+    for patientId, visit in iter_visits(fileName):
+        patients.setdefault(patientId, []).append(visit)
+    return patients
+
+
+def quietStream(fileName):
+    return iter_visits(fileName, report=lambda message: None)
+
+
+def inPatientOrder(pairs, patients):
+    order = {patientId: rank for rank, patientId in enumerate(patients)}
+    return sorted(pairs, key=lambda pair: order[pair[0]])
+
+
+def testStreamAgreesWithDictLoader(patientsFile, capsys):
+    assert load(readStream, patientsFile, capsys) == load(readPatientsFromFile, patientsFile, capsys)
+
+
+def testFiltersAndAggregatesMatchQueries(patientsFile, capsys):
+    patients = asLists(readPatientsFromFile(patientsFile))
+    capsys.readouterr()
+    stream = partial(quietStream, patientsFile)
+
+    # The stream is in file order, the query in patient order
+    found = inPatientOrder(filter_year_month(stream(), 2021, 5), patients)
+    assert found and found == list(findVisitsByDate(patients, 2021, 5))
+    inRange = list(filter_date_range(stream(), '2020-03-01', '2020-06-30'))
+    assert inRange and all('2020-03-01' <= visit[0] <= '2020-06-30' for _, visit in inRange)
+    assert {patientId for patientId, _ in filter_patients(stream(), {3, 7})} == {3, 7} & set(patients)
+    assert all(patientId in patients for patientId, _ in filter_abnormal(stream()))
+
+    count, averages = average_vitals(stream())
+    expectedCount, expectedAverages = vitalMeans(patients)
+    assert count == expectedCount
+    assert averages == pytest.approx(expectedAverages)
+    assert sorted(patients_needing_follow_up(stream())) == sorted(findPatientsWhoNeedFollowUp(patients))
+    assert average_vitals(iter([])) == (0, [None] * 6)
+    assert capsys.readouterr().out == ''
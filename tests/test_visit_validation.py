@@ -0,0 +1,59 @@
+import datetime
+import os
+
+import pytest
+
+from conftest import INVALID_LINES, load, writeLines
+from main_22BECD87 import addPatientData, readPatientsFromFile
+from patient_parser import parsePatientLine
+from visit_store import loadVisitStore
+from visit_validation import isCalendarDay
+from visit_writer import validateVisit
+
+INVALID_DATE = "Invalid date. Please enter a valid date."
+INVALID_FORMAT = "Invalid date format. Please enter date in the format 'yyyy-mm-dd'."
+
+
+def testEveryInvalidLineIsRejected(tmp_path, capsys):
+    fileName = str(tmp_path / 'patients.txt')
+    for line, message in INVALID_LINES:
+        writeLines(fileName, [line, "2,2024-02-29,37.0,70,16,120,80,97"])
+        for loader in (readPatientsFromFile, loadVisitStore):
+            patients, reported = load(loader, fileName, capsys)
+            assert list(patients) == [2]
+            assert reported == [message]
+        with pytest.raises(ValueError) as error:
+            parsePatientLine(line, 1)
+        assert str(error.value) == message
+
+
+def testCalendarDays():
+    day = datetime.date(1896, 1, 1)
+    while day.year < 2105:
+        assert isCalendarDay(day.year * 10000 + day.month * 100 + day.day)
+        day += datetime.timedelta(days=1)
+    for packed in (19000229, 20230229, 21000229, 20240230, 20240431, 20241301, 20240001, 20240100, 101):
+        assert not isCalendarDay(packed)
+
+
+@pytest.mark.parametrize('date, message', [
+    ('2024-02-29', None), ('2000-02-29', None), ('1900-01-01', None),
+    ('2023-02-29', INVALID_DATE), ('1900-02-29', INVALID_DATE), ('2024-04-31', INVALID_DATE),
+    ('1899-12-31', INVALID_DATE),
+    ('2024-2-29', INVALID_FORMAT), ('2024/02/29', INVALID_FORMAT), ('２０２４-02-29', INVALID_FORMAT),
+])
+def testWriterChecksCalendar(date, message, patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    size = os.path.getsize(patientsFile)
+    capsys.readouterr()
+    addPatientData(patients, 500, date, 37.0, 70, 16, 120, 80, 97, patientsFile)
+    if message is None:
+        assert validateVisit(500, date, 37.0, 70, 16, 120, 80, 97)[1][0] == date
+        assert capsys.readouterr().out == "Visit is saved successfully for Patient #500\n"
+        assert readPatientsFromFile(patientsFile)[500] == [[date, 37.0, 70, 16, 120, 80, 97]]
+    else:
+        with pytest.raises(ValueError) as error:
+            validateVisit(500, date, 37.0, 70, 16, 120, 80, 97)
+        assert str(error.value) == message
+        assert capsys.readouterr().out == message + "\n"
+        assert 500 not in patients and os.path.getsize(patientsFile) == size
@@ -0,0 +1,72 @@
+import os
+import shutil
+
+import pytest
+
+import visit_writer
+from conftest import asLists
+from main_22BECD87 import addPatientData, deleteAllVisitsOfPatient, readPatientsFromFile
+from visit_log import compactPatientsFile
+from visit_writer import DURABILITY_BATCH, DURABILITY_CLOSE, DURABILITY_NONE, VisitWriter
+
+VISITS = [(3, '2024-02-29', 37.0, 70, 16, 120, 80, 97), (500, '2024-03-01', 38.5, 70, 16, 120, 80, 97),
+          ('3', '2024-03-02', '36.5', '65', '14', '115', '75', '98'), (7, '2024-03-03', 37.2, 72, 18, 125, 82, 96),
+          (8, '2024-03-04', 37.1, 71, 17, 121, 81, 95)]
+
+
+def testBatchesWriteWhatSingleAddsWrite(patientsFile, capsys):
+    copy = patientsFile + '.copy'
+    shutil.copy(patientsFile, copy)
+    single = readPatientsFromFile(copy)
+    for visit in VISITS:
+        addPatientData(single, *visit, copy)
+
+    batched = readPatientsFromFile(patientsFile)
+    with VisitWriter(batched, patientsFile, batchSize=2) as writer:
+        assert writer.addMany(VISITS[:3]) == 3
+        # Visits reach the collection with their batch, once the file holds them
+        assert writer.written == 2 and 500 in batched and len(batched[3]) == len(single[3]) - 1
+        writer.addMany(VISITS[3:])
+    assert writer.written == len(VISITS)
+    with open(patientsFile) as file, open(copy) as expected:
+        assert file.read() == expected.read()
+    assert asLists(batched) == asLists(single)
+    assert asLists(readPatientsFromFile(patientsFile)) == asLists(single)
+
+
+def testRejectedVisitsAreReportedNotWritten(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    size = os.path.getsize(patientsFile)
+    messages = []
+    with VisitWriter(patients, patientsFile, report=messages.append) as writer:
+        assert not writer.add(3, '2024-02-30', 37.0, 70, 16, 120, 80, 97)
+        assert not writer.add(-1, '2024-02-29', 37.0, 70, 16, 120, 80, 97)
+        assert not writer.add(3, '2024-02-29', 'warm', 70, 16, 120, 80, 97)
+    assert writer.rejected == 3 and writer.written == 0
+    assert messages == ["Invalid date. Please enter a valid date.",
+                        "Invalid patient ID. Please enter a positive integer.",
+                        "Invalid temperature. Please enter a temperature between 35.0 and 42.0 Celsius."]
+    assert os.path.getsize(patientsFile) == size
+
+
+@pytest.mark.parametrize('durability, syncs', [(DURABILITY_NONE, 0), (DURABILITY_BATCH, 3), (DURABILITY_CLOSE, 1)])
+def testDurabilityPolicies(durability, syncs, patientsFile, monkeypatch, capsys):
+    synced = []
+    monkeypatch.setattr(visit_writer.os, 'fsync', synced.append)
+    patients = readPatientsFromFile(patientsFile)
+    with VisitWriter(patients, patientsFile, durability=durability, batchSize=2) as writer:
+        writer.addMany(VISITS)
+    assert len(synced) == syncs
+    with pytest.raises(ValueError):
+        VisitWriter(patients, patientsFile, durability='sometimes')
+
+
+def testBatchesAfterDeletionSurviveCompaction(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    deleteAllVisitsOfPatient(patients, 3, patientsFile)
+    with VisitWriter(patients, patientsFile, batchSize=2) as writer:
+        writer.addMany(VISITS)
+    assert compactPatientsFile(patientsFile) > 0
+    reloaded = asLists(readPatientsFromFile(patientsFile))
+    assert reloaded == asLists(patients)
+    assert [visit[0] for visit in reloaded[3]] == ['2024-02-29', '2024-03-02']
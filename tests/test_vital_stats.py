@@ -0,0 +1,63 @@
+import random
+import statistics
+
+import pytest
+
+from main_22BECD87 import displayStats, readPatientsFromFile
+from visit_store import VITAL_NAMES, loadVisitStore
+from vital_stats import computeStats, summarize, vitalMeans
+
+
+def assertSummarizes(summary, values):
+    assert summary.count == len(values)
+    assert summary.mean == pytest.approx(statistics.fmean(values))
+    assert summary.stdev == pytest.approx(statistics.pstdev(values))
+    assert (summary.minimum, summary.maximum) == (min(values), max(values))
+    quantiles = statistics.quantiles(values, n=100, method='inclusive')
+    for q, value in summary.percentiles.items():
+        assert value == pytest.approx(quantiles[q - 1])
+
+
+@pytest.mark.parametrize('loader', [readPatientsFromFile, loadVisitStore])
+def testStatsMatchVisits(loader, patientsFile, capsys):
+    patients = loader(patientsFile)
+    patientIds = [3, 7, 3, 10_000, 11]
+    everyVisit = [visit for visits in patients.values() for visit in visits]
+    selected = [visit for patientId in (3, 7, 11) for visit in patients[patientId]]
+    reports = ((computeStats(patients), everyVisit, len(patients)), (computeStats(patients, patientIds), selected, 3))
+    for report, visits, patientCount in reports:
+        assert (report.patientCount, report.visitCount) == (patientCount, len(visits))
+        for position, name in enumerate(VITAL_NAMES, start=1):
+            assertSummarizes(report[name], [visit[position] for visit in visits])
+
+    count, means = vitalMeans(patients, patientIds)
+    assert count == len(selected)
+    assert means == pytest.approx([report[name].mean for name in VITAL_NAMES])
+
+
+def testColumnsWithManyDistinctValues():
+    rng = random.Random(4)
+    values = [rng.uniform(35, 42) for _ in range(1001)]
+    assertSummarizes(summarize(values, (1, 50, 99)), values)
+    single = summarize([37.5])
+    assert (single.count, single.mean, single.stdev) == (1, 37.5, 0.0)
+    assert set(single.percentiles.values()) == {37.5}
+
+
+def testNoVisits(patientsFile, capsys):
+    report = computeStats(readPatientsFromFile(patientsFile), [10_000])
+    assert (report.patientCount, report.visitCount) == (0, 0)
+    assert report['temps'].asDict()['mean'] is None
+    assert vitalMeans({}) == (0, [None] * 6)
+
+
+def testDisplayStatsPrintsMeans(patientsFile, capsys):
+    patients = readPatientsFromFile(patientsFile)
+    capsys.readouterr()
+    displayStats(patients, 3)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "Vital Signs for Patient 3:"
+    means = [float(line.split(':')[1].split()[0]) for line in lines[1:]]
+    assert means == pytest.approx(vitalMeans(patients, [3])[1], abs=0.005)
+    displayStats(patients, 10_000)
+    assert capsys.readouterr().out == "Patient with ID 10000 not found.\n"
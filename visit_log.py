@@ -0,0 +1,140 @@
+"""
+Deletion log for a patients file.
+
+Deleting a patient appends one tombstone line to patients.txt.log instead of rewriting
+patients.txt. A tombstone "patientId,offset" removes every line of that patient that
+starts before byte offset, which is the size patients.txt had when the patient was
+deleted. Visits appended afterwards by addPatientData land after the offset and stay
+visible, so additions need no log records of their own and keep going straight to the
+text file where other tools can read them.
+
+Loaders replay the log when they read the text file. compactPatientsFile rewrites the
+text file without the deleted lines (to a temporary file that is then renamed over it)
+and removes the log. The first line of the log names the inode of the text file it
+applies to; a log left behind by a compaction interrupted after the rename no longer
+matches and is ignored, as is a log pointing past the end of a file that was truncated.
+"""
+import os
+
+LOG_SUFFIX = '.log'
+
+# Number of tombstones after which deleteAllVisitsOfPatient compacts the file
+COMPACTION_THRESHOLD = 100
+
+
+def logPath(fileName):
+    """
+    Returns the name of the deletion log of a patients file.
+    """
+    return fileName + LOG_SUFFIX
+
+
+def _fileIdentity(fileName):
+    """
+    Returns a string identifying the current version of a file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(fileName)
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_dev}:{stat.st_ino}"
+
+
+def readTombstones(fileName, start=0):
+    """
+    Reads the deletion log of a patients file.
+
+    fileName: The name of the patients file.
+    start: The byte offset in the log to start reading from, to read only new tombstones.
+    return: A tuple (cutoffs, log size), where cutoffs maps each deleted patient ID to the
+            offset before which its lines are deleted. The log size is 0 if there is no log
+            or it belongs to an earlier version of the file.
+    """
+    try:
+        with open(logPath(fileName), 'rb') as log:
+            header = log.readline()
+            if header.decode().split()[1:] != [_fileIdentity(fileName)]:
+                return {}, 0
+            if start > log.tell():
+                log.seek(start)
+            cutoffs = {}
+            for record in log:
+                if not record.endswith(b'\n'):
+                    break  # a record cut short by a crash
+                patientId, offset = map(int, record.split(b','))
+                cutoffs[patientId] = max(offset, cutoffs.get(patientId, 0))
+            if cutoffs and max(cutoffs.values()) > os.path.getsize(fileName):
+                return {}, 0  # the file was truncated or rewritten in place
+            return cutoffs, log.tell()
+    except (FileNotFoundError, ValueError, IndexError):
+        return {}, 0
+
+
+def appendTombstone(fileName, patientId):
+    """
+    Records the deletion of all current visits of a patient.
+
+    fileName: The name of the patients file.
+    patientId: The ID of the patient to delete.
+    return: The number of tombstones now in the log.
+    """
+    identity = _fileIdentity(fileName)
+    if identity is None:
+        return 0
+    offset = os.path.getsize(fileName)
+    cutoffs, size = readTombstones(fileName)
+    mode = 'ab' if size else 'wb'
+    with open(logPath(fileName), mode) as log:
+        if not size:
+            log.write(f"#patients-log {identity}\n".encode())
+        log.write(f"{patientId},{offset}\n".encode())
+        log.flush()
+        os.fsync(log.fileno())
+    cutoffs[patientId] = offset
+    return len(cutoffs)
+
+
+def isDeleted(cutoffs, patientId, offset):
+    """
+    Returns True if the line of a patient starting at offset is removed by the tombstones.
+    """
+    cutoff = cutoffs.get(patientId)
+    return cutoff is not None and offset < cutoff
+
+
+def compactPatientsFile(fileName):
+    """
+    Rewrites a patients file without the lines removed by its deletion log, then removes the log.
+
+    The new contents are written to a temporary file, flushed to disk and renamed over the
+    original, so a crash leaves either the old file and log or the new file.
+    Lines that cannot be attributed to a patient are kept as they are.
+
+    fileName: The name of the patients file.
+    return: The number of lines removed.
+    """
+    cutoffs, size = readTombstones(fileName)
+    if not size:
+        if os.path.exists(logPath(fileName)):
+            os.remove(logPath(fileName))
+        return 0
+
+    removed = 0
+    temp_name = fileName + '.tmp'
+    with open(fileName, 'rb') as source, open(temp_name, 'wb') as target:
+        offset = 0
+        for line in source:
+            try:
+                patientId = int(line.split(b',', 1)[0])
+            except ValueError:
+                patientId = None
+            if isDeleted(cutoffs, patientId, offset):
+                removed += 1
+            else:
+                target.write(line)
+            offset += len(line)
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(temp_name, fileName)
+    os.remove(logPath(fileName))
+    return removed
@@ -0,0 +1,184 @@
+"""
+The Visit record: one visit of a patient, with its date parsed once.
+
+Visits used to be lists [date, temperature, heart rate, respiratory rate, systolic blood
+pressure, diastolic blood pressure, oxygen saturation] whose date was a string that
+every query sliced again. A Visit keeps the same seven fields in named slots, and its
+date is a VisitDate: a str, so it prints, compares and serializes as before, that also
+carries its ordinal, year, month and packed yyyymmdd day, parsed when the date is first
+seen. VisitDates are shared, so all visits of the same day refer to one object instead
+of a string each; a Visit takes about half the memory of the list it replaces.
+
+A Visit still behaves like that list: visit[0] is the date and visit[1] to visit[6] the
+vital signs, slices return lists and can be assigned as many values as they hold, it
+iterates and unpacks into its seven fields, and it compares equal to a list or tuple of
+the same values. Positional access runs Python code, though, so loops over many visits
+read the named fields, for example with map(attrgetter('temperature'), visits), which
+runs in C.
+"""
+import datetime
+from operator import attrgetter
+
+# Names of the fields of a Visit, in the order of the list it replaces
+VISIT_FIELDS = ('date', 'temperature', 'heartRate', 'respiratoryRate', 'systolicBP', 'diastolicBP', 'spo2')
+
+# Names of the vital sign fields, in visit order
+VITAL_FIELDS = VISIT_FIELDS[1:]
+
+# Getters of the vital sign fields, in visit order
+VITAL_GETTERS = tuple(map(attrgetter, VITAL_FIELDS))
+
+# Names of the vital sign columns of a VisitStore (see visit_store), in visit order
+VITAL_NAMES = ('temps', 'heartRates', 'respRates', 'systolic', 'diastolic', 'spo2')
+
+
+class VisitDate(str):
+    """
+    A visit date string that carries its parsed fields:
+
+        ordinal   the day number of datetime.date.toordinal, or None if it is not a calendar date
+        year      the year, or None if the date does not start with four digits
+        month     the month, or None if the date does not have two digits at the month position
+        packed    the date as a yyyymmdd integer, or None if it is not in the format 'yyyy-mm-dd'
+    """
+
+    def __new__(cls, date):
+        self = super().__new__(cls, date)
+        year, month, day = date[:4], date[5:7], date[8:]
+        self.year = int(year) if len(year) == 4 and year.isascii() and year.isdigit() else None
+        self.month = int(month) if len(month) == 2 and month.isascii() and month.isdigit() else None
+        self.packed = None
+        self.ordinal = None
+        if (self.year is not None and self.month is not None and len(day) == 2 and day.isascii()
+                and day.isdigit() and date[4] == '-' and date[7] == '-'):
+            self.packed = self.year * 10000 + self.month * 100 + int(day)
+            try:
+                self.ordinal = datetime.date(self.year, self.month, int(day)).toordinal()
+            except ValueError:
+                pass
+        return self
+
+
+# Number of distinct dates whose VisitDates are kept for sharing, by date string and by
+# packed day: more than 170 years of days
+DATE_CACHE_SIZE = 1 << 16
+
+# The VisitDates created most recently, by date string and by packed day. Once full, the
+# oldest entry is dropped for each new date; lookups stay plain dictionary lookups, which
+# the constructor of Visit relies on.
+_DATES = {}
+_PACKED_DATES = {}
+
+
+def _remember(cache, key, value):
+    """
+    Adds a VisitDate to a cache, dropping its oldest entry if the cache is full.
+    """
+    if len(cache) >= DATE_CACHE_SIZE:
+        del cache[next(iter(cache))]
+    cache[key] = value
+    return value
+
+
+def visitDate(date):
+    """
+    Returns the shared VisitDate of a date.
+
+    date: A date string, or a packed yyyymmdd integer.
+    """
+    if isinstance(date, int):
+        value = _PACKED_DATES.get(date)
+        if value is None:
+            value = _remember(_PACKED_DATES, date,
+                              visitDate("%04d-%02d-%02d" % (date // 10000, date // 100 % 100, date % 100)))
+        return value
+    value = _DATES.get(date)
+    if value is None:
+        value = _remember(_DATES, date, VisitDate(str(date)))
+    return value
+
+
+class Visit:
+    """
+    A visit: its date (a VisitDate) and its six vital signs.
+    """
+
+    __slots__ = VISIT_FIELDS
+
+    def __init__(self, date, temperature, heartRate, respiratoryRate, systolicBP, diastolicBP, spo2):
+        day = _DATES.get(date)
+        self.date = day if day is not None else visitDate(date)
+        self.temperature = temperature
+        self.heartRate = heartRate
+        self.respiratoryRate = respiratoryRate
+        self.systolicBP = systolicBP
+        self.diastolicBP = diastolicBP
+        self.spo2 = spo2
+
+    @property
+    def ordinal(self):
+        return self.date.ordinal
+
+    @property
+    def year(self):
+        return self.date.year
+
+    @property
+    def month(self):
+        return self.date.month
+
+    def vitals(self):
+        """
+        Returns the six vital signs as a tuple, in visit order.
+        """
+        return (self.temperature, self.heartRate, self.respiratoryRate,
+                self.systolicBP, self.diastolicBP, self.spo2)
+
+    def __getitem__(self, index):
+        return [self.date, self.temperature, self.heartRate, self.respiratoryRate,
+                self.systolicBP, self.diastolicBP, self.spo2][index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            names = VISIT_FIELDS[index]
+            values = list(value)
+            if len(values) != len(names):
+                raise ValueError(f"A Visit has a fixed number of fields: cannot assign {len(values)} values "
+                                 f"to a slice of {len(names)}")
+            for name, value in zip(names, values):
+                setattr(self, name, visitDate(value) if name == 'date' else value)
+            return
+        name = VISIT_FIELDS[index]
+        setattr(self, name, visitDate(value) if name == 'date' else value)
+
+    def __len__(self):
+        return 7
+
+    def __iter__(self):
+        return iter((self.date, self.temperature, self.heartRate, self.respiratoryRate,
+                     self.systolicBP, self.diastolicBP, self.spo2))
+
+    def __eq__(self, other):
+        if isinstance(other, (Visit, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return Visit, (str(self.date),) + self.vitals()
+
+    def __repr__(self):
+        return f"Visit({', '.join(map(repr, self))})"
+
+
+def vitalColumns(visits):
+    """
+    Returns the six vital sign columns of a list of visits, in visit order.
+
+    visits: A list of Visits, or of visits as lists or tuples.
+    """
+    try:
+        return [list(map(getter, visits)) for getter in VITAL_GETTERS]
+    except AttributeError:
+        return list(zip(*visits))[1:7] or [()] * 6
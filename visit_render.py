@@ -0,0 +1,178 @@
+"""
+Bulk rendering of visits as plain text, CSV or JSON Lines.
+
+displayPatientData used to call print eight times per visit. The renderers here fill a
+precompiled %-template for all visits of a patient at once (the per-visit template is
+repeated and filled from the flattened visit values in a single % operation), collect
+the text of many patients in a buffer, and write it out in large chunks.
+
+Two layouts exist for plain text, matching the original output exactly:
+
+    renderPatients     the per-patient listing of displayPatientData (menu options 1 and 2)
+    renderVisitList    the (patientId, visit) listing of findVisitsByDate results (option 5)
+
+Both take an offset and a limit counted in visits for paging, and write to a file
+object or return the text.
+"""
+import json
+import re
+from itertools import chain, groupby, islice
+from operator import itemgetter
+
+FORMAT_TEXT = 'text'
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+FORMATS = (FORMAT_TEXT, FORMAT_CSV, FORMAT_JSONL)
+
+# Number of visits rendered before the buffer is written out
+CHUNK_VISITS = 20000
+
+CSV_HEADER = "patient_id,date,temperature,heart_rate,respiratory_rate,systolic_bp,diastolic_bp,spo2\n"
+
+# Per-visit templates; the patient-specific prefix is added by _patientTemplate
+_PATIENT_HEADER = "Patient ID: %s\n"
+_VISIT_TEXT = (" Visit Date: %s\n"
+               "   Temperature: %.2f C\n"
+               "   Heart Rate: %s bpm\n"
+               "   Respiratory Rate: %s bpm\n"
+               "   Systolic Blood Pressure: %s mmHg\n"
+               "   Diastolic Blood Pressure: %s mmHg\n"
+               "   Oxygen Saturation: %s %%\n"
+               "\n")
+_LISTED_VISIT_TEXT = (" Visit Date: %s\n"
+                      "  Temperature: %.2f C\n"
+                      "  Heart Rate: %s bpm\n"
+                      "  Respiratory Rate: %s bpm\n"
+                      "  Systolic Blood Pressure: %s mmHg\n"
+                      "  Diastolic Blood Pressure: %s mmHg\n"
+                      "  Oxygen Saturation: %s %%\n")
+_VISIT_CSV = "%s,%r,%s,%s,%s,%s,%s\n"
+_VISIT_JSONL = ('"date": "%s", "temperature": %r, "heartRate": %s, "respiratoryRate": %s, '
+                '"systolicBP": %s, "diastolicBP": %s, "spo2": %s}\n')
+
+# Characters that must be escaped inside a JSON string
+_JSON_UNSAFE = re.compile(r'["\\\x00-\x1f]')
+
+
+def _patientTemplate(patientId, fmt, listed=False):
+    """
+    Returns the template of one visit of a patient, with the patient ID filled in.
+    """
+    if fmt == FORMAT_CSV:
+        return f"{patientId}," + _VISIT_CSV
+    if fmt == FORMAT_JSONL:
+        return '{"patientId": %s, ' % patientId + _VISIT_JSONL
+    if listed:
+        return _PATIENT_HEADER.replace('%s', str(patientId).replace('%', '%%')) + _LISTED_VISIT_TEXT
+    return _VISIT_TEXT
+
+
+def _renderGroup(patientId, visits, fmt, listed=False):
+    """
+    Renders the visits of one patient with a single % operation.
+    """
+    if not visits:
+        return _PATIENT_HEADER % patientId if fmt == FORMAT_TEXT and not listed else ''
+    if fmt == FORMAT_JSONL and any(_JSON_UNSAFE.search(str(visit[0])) for visit in visits):
+        visits = [[_jsonEscape(visit[0])] + list(visit[1:7]) for visit in visits]
+    text = (_patientTemplate(patientId, fmt, listed) * len(visits)) % tuple(chain.from_iterable(visits))
+    if fmt == FORMAT_TEXT and not listed:
+        return _PATIENT_HEADER % patientId + text
+    return text
+
+
+def _jsonEscape(value):
+    """
+    Escapes a string for use between the quotes of a JSON string.
+    """
+    return json.dumps(str(value))[1:-1]
+
+
+def _pageGroups(groups, offset, limit):
+    """
+    Skips the first offset visits of (patientId, visits) groups and keeps at most limit
+    of the rest. A patient whose visits are cut keeps its remaining visits.
+    """
+    for patientId, visits in groups:
+        count = len(visits)
+        if offset >= count:
+            offset -= count
+            continue
+        if limit is not None and limit <= 0:
+            return
+        end = count if limit is None else min(count, offset + limit)
+        if offset or end < count:
+            visits = visits[offset:end]
+        if limit is not None:
+            limit -= end - offset
+        offset = 0
+        yield patientId, visits
+
+
+def _emit(groups, fmt, out, header, listed, chunkVisits):
+    """
+    Renders (patientId, visits) groups and writes them to out in chunks of about
+    chunkVisits visits, or returns the text if out is None.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown output format: {fmt}")
+    parts = [CSV_HEADER] if fmt == FORMAT_CSV and header else []
+    pieces = []
+    pending = 0
+    for patientId, visits in groups:
+        pieces.append(_renderGroup(patientId, visits, fmt, listed))
+        pending += len(visits)
+        if out is not None and pending >= chunkVisits:
+            out.write(''.join(parts + pieces))
+            parts = []
+            pieces = []
+            pending = 0
+    if out is None:
+        return ''.join(parts + pieces)
+    if parts or pieces:
+        out.write(''.join(parts + pieces))
+    return None
+
+
+def renderPatients(patients, patientIds=None, fmt=FORMAT_TEXT, out=None, offset=0, limit=None,
+                   header=True, chunkVisits=CHUNK_VISITS):
+    """
+    Renders the visits of all patients or of some of them, patient by patient.
+
+    The text format is the one displayPatientData prints.
+
+    patients: A dictionary of patient IDs to lists of visits, or a VisitStore.
+    patientIds: The IDs of the patients to render, or None for all patients.
+                IDs that are not in patients are skipped.
+    fmt: One of FORMATS.
+    out: A file object to write to, or None to return the text.
+    offset: The number of visits to skip, for paging.
+    limit: The largest number of visits to render, or None for all.
+    header: Whether to start CSV output with a header line.
+    chunkVisits: The number of visits rendered between writes to out.
+    Returns the rendered text if out is None.
+    """
+    if patientIds is None:
+        groups = patients.items()
+    else:
+        groups = ((patientId, patients[patientId]) for patientId in patientIds if patientId in patients)
+    if offset or limit is not None:
+        groups = _pageGroups(groups, offset, limit)
+    return _emit(groups, fmt, out, header, False, chunkVisits)
+
+
+def renderVisitList(visits, fmt=FORMAT_TEXT, out=None, offset=0, limit=None, header=True,
+                    chunkVisits=CHUNK_VISITS):
+    """
+    Renders a list of (patientId, visit) pairs, such as the result of findVisitsByDate.
+
+    The text format is the listing option 5 of the menu prints.
+
+    visits: An iterable of (patientId, visit) pairs.
+    fmt, out, offset, limit, header, chunkVisits: As for renderPatients.
+    Returns the rendered text if out is None.
+    """
+    if offset or limit is not None:
+        visits = islice(visits, offset, None if limit is None else offset + limit)
+    groups = ((patientId, [visit for _, visit in run]) for patientId, run in groupby(visits, key=itemgetter(0)))
+    return _emit(groups, fmt, out, header, True, chunkVisits)
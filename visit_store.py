@@ -0,0 +1,496 @@
+from array import array
+from collections import Counter
+from collections.abc import MutableMapping, Sequence
+from operator import itemgetter, ne
+
+from aggregate_cache import AggregateCache
+from bulk_ingest import readColumns
+from date_index import DateIndex
+from followup import FollowUpTracker
+from monthly_rollups import MonthlyRollups
+from patient_records import Acknowledgement
+from visit_record import VITAL_NAMES, Visit, visitDate
+
+# Array type code of every column
+COLUMN_TYPECODES = {'dates': 'i', 'temps': 'd', 'heartRates': 'h', 'respRates': 'h',
+                    'systolic': 'h', 'diastolic': 'h', 'spo2': 'h'}
+
+
+def packDate(date):
+    """
+    Packs a 'yyyy-mm-dd' date string into an integer day number (yyyymmdd).
+
+    date: The date string to pack.
+    Returns the packed date as an integer, e.g. '2022-05-01' -> 20220501.
+    Raises ValueError if the date is not in the format 'yyyy-mm-dd'.
+    """
+    parts = date.split('-')
+    if len(parts) != 3 or len(parts[0]) != 4 or len(parts[1]) != 2 or len(parts[2]) != 2:
+        raise ValueError(f"Invalid date format ({date}). Expected 'yyyy-mm-dd'.")
+    year, month, day = map(int, parts)
+    return year * 10000 + month * 100 + day
+
+
+def unpackDate(day):
+    """
+    Converts a packed yyyymmdd day number back to a 'yyyy-mm-dd' string.
+
+    day: The packed date.
+    Returns the date as a string.
+    """
+    return "%04d-%02d-%02d" % (day // 10000, day // 100 % 100, day % 100)
+
+
+def packDates(dates):
+    """
+    Packs a list of 'yyyy-mm-dd' date strings into an array of yyyymmdd day numbers.
+
+    The format of every date is checked on the whole list at once, and the digits are
+    converted in one pass, so this is much faster than calling packDate per date.
+
+    dates: The list of date strings.
+    Returns an array('i') of packed dates.
+    Raises ValueError if any date is not in the format 'yyyy-mm-dd'.
+    """
+    if not dates:
+        return array('i')
+    digits = ''.join(dates).replace('-', '')
+    if (set(map(len, dates)) != {10} or set(map(itemgetter(4, 7), dates)) != {('-', '-')}
+            or len(digits) != 8 * len(dates) or not digits.isdigit()):
+        raise ValueError("Invalid date format. Expected 'yyyy-mm-dd'.")
+    return array('i', map(int, '\n'.join(dates).replace('-', '').split('\n')))
+
+
+def _take(column, order):
+    """
+    Returns a new array with the values of column at the positions listed in order.
+    """
+    if len(order) < 2:
+        return array(column.typecode, [column[row] for row in order])
+    return array(column.typecode, itemgetter(*order)(column))
+
+
+class PatientVisits(Sequence):
+    """
+    A list-like view of the visits of one patient inside a VisitStore.
+
+    Each visit is returned as a Visit (see visit_record), the same record
+    readPatientsFromFile uses, so existing code keeps working on a VisitStore.
+    """
+
+    __slots__ = ('_store', '_patientId')
+
+    def __init__(self, store, patientId):
+        self._store = store
+        self._patientId = patientId
+
+    def _rows(self):
+        return self._store.patientRows(self._patientId)
+
+    def __len__(self):
+        return sum(length for _, length in self._store._extents.get(self._patientId, ()))
+
+    def __getitem__(self, index):
+        rows = list(self._rows())
+        if isinstance(index, slice):
+            return [self._store.visitAt(row) for row in rows[index]]
+        return self._store.visitAt(rows[index])
+
+    def __iter__(self):
+        visitAt = self._store.visitAt
+        for row in self._rows():
+            yield visitAt(row)
+
+    def append(self, visit):
+        self._store.append(self._patientId, *visit)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class VisitStore(MutableMapping):
+    """
+    Columnar, array-backed storage for patient visits.
+
+    Every vital sign is kept in its own contiguous typed array and dates are kept as
+    packed yyyymmdd integers, so a visit costs a few bytes per column instead of a list
+    and seven Python objects. Each patient ID maps to a list of [offset, length] extents
+    into the columns; visits loaded from a file are contiguous (a single extent), and
+    visits appended later add or grow an extent at the end of the columns.
+
+    The store is also a mutable mapping of patient ID -> list-like visits, so it can be
+    passed anywhere the dictionary returned by readPatientsFromFile is expected.
+    """
+
+    def __init__(self):
+        self.dates = array('i')
+        self.temps = array('d')
+        self.heartRates = array('h')
+        self.respRates = array('h')
+        self.systolic = array('h')
+        self.diastolic = array('h')
+        self.spo2 = array('h')
+        self._extents = {}
+        self._deadRows = 0
+        self._mapping = None
+        self._dateIndex = None
+        self._followUp = None
+        self._aggregates = None
+        self._rollups = None
+        # Number of visits appended and patients deleted the indexes were not told
+        # about, as in a PatientRecords
+        self._unindexed = 0
+        self._stale = False
+        self.indexes = [Acknowledgement(self)]
+
+    @classmethod
+    def fromBuffers(cls, columns, extents, mapping=None):
+        """
+        Builds a VisitStore directly on top of existing column buffers, such as
+        memoryviews of a memory-mapped snapshot, without copying them.
+
+        columns: A dictionary of column name (see COLUMN_TYPECODES) to a buffer of that type.
+        extents: An iterable of (patientId, offset, length) tuples.
+        mapping: The object backing the buffers, kept open for the lifetime of the store.
+        Returns a new VisitStore. Its columns are copied into arrays on the first change.
+        """
+        store = cls()
+        for name, column in columns.items():
+            setattr(store, name, column)
+        store._extents = {patientId: [[offset, length]] for patientId, offset, length in extents}
+        store._mapping = mapping
+        return store
+
+    def isCompact(self):
+        """
+        Tells whether the store holds no deleted visits and every patient has exactly one
+        extent, so that patientExtents and liveColumns do not compact it.
+        """
+        return not self._deadRows and all(len(extents) == 1 for extents in self._extents.values())
+
+    def patientExtents(self):
+        """
+        Returns an iterator of (patientId, offset, length) tuples, compacting the store
+        first so that every patient has exactly one extent.
+        """
+        if not self.isCompact():
+            self.compact()
+        return ((patientId, extents[0][0], extents[0][1]) for patientId, extents in self._extents.items())
+
+    def _ensureWritable(self):
+        """
+        Copies columns that are views of a snapshot into arrays before they are changed.
+        """
+        if self._mapping is None:
+            return
+        for name, typecode in COLUMN_TYPECODES.items():
+            column = array(typecode)
+            column.frombytes(getattr(self, name).cast('B'))
+            setattr(self, name, column)
+        self._mapping = None
+
+    @classmethod
+    def fromPatients(cls, patients):
+        """
+        Builds a VisitStore from a dictionary of patient IDs to lists of visits.
+
+        patients: A dictionary of patient IDs, where each patient has a list of visits.
+        Returns a new VisitStore holding the same visits.
+        """
+        store = cls()
+        for patientId, visits in patients.items():
+            for visit in visits:
+                store.append(patientId, *visit)
+        return store
+
+    @classmethod
+    def fromColumns(cls, columns):
+        """
+        Builds a VisitStore from parsed VisitColumns, grouping each patient's visits
+        into one contiguous extent.
+
+        columns: The VisitColumns to build the store from.
+        Returns a new VisitStore.
+        """
+        packed = packDates(columns.dates)
+
+        # Stable sort of row numbers by the order each patient first appears in,
+        # skipped when the file already lists each patient's visits together
+        rank = {}
+        keys = [rank.setdefault(patientId, len(rank)) for patientId in columns.ids]
+        store = cls()
+        if sum(map(ne, keys[1:], keys[:-1])) + 1 == len(rank) or not keys:
+            store.dates = packed
+            for name, column in zip(VITAL_NAMES, columns.vitals()):
+                setattr(store, name, array(getattr(store, name).typecode, column))
+        else:
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            store.dates = _take(packed, order)
+            for name, column in zip(VITAL_NAMES, columns.vitals()):
+                setattr(store, name, _take(array(getattr(store, name).typecode, column), order))
+
+        counts = Counter(columns.ids)
+        offset = 0
+        for patientId in rank:
+            store._extents[patientId] = [[offset, counts[patientId]]]
+            offset += counts[patientId]
+        return store
+
+    def columns(self):
+        """
+        Returns the vital sign columns in visit order: temperature, heart rate,
+        respiratory rate, systolic and diastolic blood pressure, oxygen saturation.
+        """
+        return (self.temps, self.heartRates, self.respRates,
+                self.systolic, self.diastolic, self.spo2)
+
+    def append(self, patientId, date, temp, hr, rr, sbp, dbp, spo2):
+        """
+        Appends a visit for a patient.
+
+        patientId: The ID of the patient.
+        date: The date of the visit, either 'yyyy-mm-dd' or a packed yyyymmdd integer.
+        temp, hr, rr, sbp, dbp, spo2: The vital signs of the visit.
+        """
+        self._ensureWritable()
+        row = len(self.dates)
+        self.dates.append(date if isinstance(date, int) else packDate(date))
+        self.temps.append(float(temp))
+        self.heartRates.append(int(hr))
+        self.respRates.append(int(rr))
+        self.systolic.append(int(sbp))
+        self.diastolic.append(int(dbp))
+        self.spo2.append(int(spo2))
+
+        extents = self._extents.get(patientId)
+        if extents is None:
+            self._extents[patientId] = [[row, 1]]
+        elif extents[-1][0] + extents[-1][1] == row:
+            extents[-1][1] += 1
+        else:
+            extents.append([row, 1])
+        self._unindexed += 1
+        if self._dateIndex is not None:
+            self._dateIndex.add(patientId, self.dates[row], row)
+
+    def appendMany(self, visits):
+        """
+        Appends (patientId, visit) pairs, updating the date index once for the whole batch.
+        """
+        index, self._dateIndex = self._dateIndex, None
+        first = len(self.dates)
+        try:
+            for patientId, visit in visits:
+                self.append(patientId, *visit)
+        finally:
+            self._dateIndex = index
+            if index is not None:
+                dates = self.dates
+                rows = range(first, len(dates))
+                index.addMany((patientId, dates[row], row) for (patientId, _), row in zip(visits, rows))
+
+    def patientRows(self, patientId):
+        """
+        Returns an iterator over the column row numbers of a patient's visits, in visit order.
+        """
+        for offset, length in self._extents.get(patientId, ()):
+            yield from range(offset, offset + length)
+
+    def lastRow(self, patientId):
+        """
+        Returns the column row number of a patient's most recent visit.
+        """
+        offset, length = self._extents[patientId][-1]
+        return offset + length - 1
+
+    def visitAt(self, row):
+        """
+        Returns the visit stored at a row as a Visit.
+        """
+        return Visit(visitDate(self.dates[row]), self.temps[row], self.heartRates[row],
+                     self.respRates[row], self.systolic[row], self.diastolic[row], self.spo2[row])
+
+    def visitCount(self):
+        """
+        Returns the number of live visits in the store.
+        """
+        return len(self.dates) - self._deadRows
+
+    def compact(self):
+        """
+        Rewrites the columns so that deleted visits are dropped and every patient's
+        visits are contiguous again.
+        """
+        self._ensureWritable()
+        order = array('l')
+        extents = {}
+        for patientId, patientExtents in self._extents.items():
+            start = len(order)
+            for offset, length in patientExtents:
+                order.extend(range(offset, offset + length))
+            extents[patientId] = [[start, len(order) - start]]
+        if self._dateIndex is not None:
+            # The new row of every old one; rows of deleted patients are not looked up
+            rows = [-1] * len(self.dates)
+            for row, oldRow in enumerate(order):
+                rows[oldRow] = row
+            self._dateIndex.renumber(rows)
+        self.dates = _take(self.dates, order)
+        for name in VITAL_NAMES:
+            setattr(self, name, _take(getattr(self, name), order))
+        self._extents = extents
+        self._deadRows = 0
+
+    def liveColumns(self):
+        """
+        Returns the vital sign columns with deleted visits removed, compacting the
+        store first if any patient has been deleted.
+        """
+        if self._deadRows:
+            self.compact()
+        return self.columns()
+
+    def patientColumns(self, patientIds):
+        """
+        Gathers the vital sign columns of some patients' visits into new arrays, copying
+        each run of rows at once. Unknown patient IDs are skipped.
+
+        patientIds: An iterable of patient IDs.
+        Returns a list of six arrays, in the order of columns().
+        """
+        views = [memoryview(column) for column in self.columns()]
+        gathered = [array(view.format) for view in views]
+        for patientId in patientIds:
+            for offset, length in self._extents.get(patientId, ()):
+                for target, view in zip(gathered, views):
+                    target.frombytes(view[offset:offset + length].cast('B'))
+        return gathered
+
+    def vitalSums(self, patientId=0):
+        """
+        Sums every vital sign column for all patients or for one patient.
+
+        patientId: The ID of the patient to sum visits for. If 0, all visits are summed.
+        Returns a tuple (number of visits, [temp sum, hr sum, rr sum, sbp sum, dbp sum, spo2 sum]).
+        """
+        if patientId == 0:
+            columns = self.liveColumns()
+            return len(self.dates), [sum(column) for column in columns]
+        count = 0
+        sums = [0] * 6
+        for offset, length in self._extents[patientId]:
+            for i, column in enumerate(self.columns()):
+                sums[i] += sum(column[offset:offset + length])
+            count += length
+        return count, sums
+
+    def rebuildIndexes(self):
+        """
+        Rebuilds every index registered in indexes from the current contents of the store.
+        """
+        for index in self.indexes:
+            index.rebuild(self)
+
+    def _currentIndexes(self):
+        """
+        Rebuilds the indexes if visits were appended or patients deleted without them
+        being told, for example through store[patientId].append or del store[patientId].
+        The date index is kept up to date by the store itself.
+        """
+        if self._unindexed:
+            self.rebuildIndexes()
+
+    @property
+    def dateIndex(self):
+        """
+        The DateIndex over the packed date column, built on first use and kept up to
+        date by append, delete and compact.
+        """
+        if self._dateIndex is None:
+            index = DateIndex(self.visitAt)
+            dates = self.dates
+            index.load((patientId, dates[row], row) for patientId in self._extents
+                       for row in self.patientRows(patientId))
+            self._dateIndex = index
+        return self._dateIndex
+
+    @property
+    def followUp(self):
+        """
+        The FollowUpTracker for this store, built on first use and registered in indexes
+        so that addPatientData and deleteAllVisitsOfPatient keep it current.
+        """
+        self._currentIndexes()
+        if self._followUp is None:
+            self._followUp = FollowUpTracker()
+            self._followUp.rebuild(self)
+            self.indexes.append(self._followUp)
+        return self._followUp
+
+    @property
+    def aggregates(self):
+        """
+        The AggregateCache of per-patient vital sign aggregates for this store, created
+        on first use and registered in indexes like followUp.
+        """
+        self._currentIndexes()
+        if self._aggregates is None:
+            self._aggregates = AggregateCache(self)
+            self.indexes.append(self._aggregates)
+        return self._aggregates
+
+    @property
+    def rollups(self):
+        """
+        The MonthlyRollups of the visits of each month in this store, built on first use
+        and registered in indexes like followUp.
+        """
+        self._currentIndexes()
+        if self._rollups is None:
+            self._rollups = MonthlyRollups(self)
+            self.indexes.append(self._rollups)
+        return self._rollups
+
+    def __getitem__(self, patientId):
+        if patientId not in self._extents:
+            raise KeyError(patientId)
+        return PatientVisits(self, patientId)
+
+    def __setitem__(self, patientId, visits):
+        visits = list(visits)
+        if patientId in self._extents:
+            del self[patientId]
+        for visit in visits:
+            self.append(patientId, *visit)
+
+    def __delitem__(self, patientId):
+        extents = self._extents.pop(patientId)
+        self._deadRows += sum(length for _, length in extents)
+        self._unindexed += 1
+        if self._dateIndex is not None:
+            self._dateIndex.patientDeleted(patientId)
+
+    def __contains__(self, patientId):
+        return patientId in self._extents
+
+    def __iter__(self):
+        return iter(self._extents)
+
+    def __len__(self):
+        return len(self._extents)
+
+    def __repr__(self):
+        return f"VisitStore({len(self)} patients, {self.visitCount()} visits)"
+
+
+def loadVisitStore(fileName):
+    """
+    Reads patient data from a plaintext file into a VisitStore.
+
+    fileName: The name of the file to read patient data from.
+    Returns a VisitStore. Invalid lines are reported and skipped, as in readPatientsFromFile.
+    """
+    return VisitStore.fromColumns(readColumns(fileName))
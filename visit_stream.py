@@ -0,0 +1,126 @@
+"""
+Streaming access to a patients file.
+
+iter_visits yields one (patientId, visit) pair at a time, reading the file in blocks,
+so a pipeline built from it needs memory for one block rather than the whole dataset.
+Filters take and return such an iterator, and aggregates consume one, for example:
+
+    average_vitals(filter_year_month(iter_visits('patients.txt'), 2023, 5))
+    patients_needing_follow_up(filter_patients(iter_visits('patients.txt'), {1, 2, 3}))
+"""
+from bulk_ingest import BLOCK_SIZE, iterColumnBlocks
+from followup import needsFollowUp
+from visit_record import Visit, visitDate
+
+
+def iter_visits(fileName, blockSize=BLOCK_SIZE, report=print):
+    """
+    Yields the valid visits of a patients file in file order.
+
+    fileName: The name of the file to read patient data from.
+    blockSize: The number of bytes to read per block.
+    report: A function called with each error message, as printed by readPatientsFromFile.
+    Yields tuples (patientId, Visit).
+    """
+    try:
+        for columns in iterColumnBlocks(fileName, blockSize, report):
+            yield from columns.visits()
+    except FileNotFoundError:
+        report(f"The file '{fileName}' could not be found.")
+
+
+def filter_date_range(visits, start=None, end=None):
+    """
+    Keeps visits dated between start and end, both inclusive.
+
+    visits: An iterable of (patientId, visit) pairs.
+    start: The first date to keep, as 'yyyy-mm-dd', or None for no lower bound.
+    end: The last date to keep, as 'yyyy-mm-dd', or None for no upper bound.
+    """
+    for patientId, visit in visits:
+        if (start is None or visit[0] >= start) and (end is None or visit[0] <= end):
+            yield patientId, visit
+
+
+def filter_year_month(visits, year=None, month=None):
+    """
+    Keeps visits in a year, a month (of any year), or both, like findVisitsByDate.
+
+    visits: An iterable of (patientId, visit) pairs.
+    year: The year to filter by, or None.
+    month: The month to filter by, or None.
+    """
+    year = int(year) if year is not None else None
+    month = int(month) if month is not None else None
+    for patientId, visit in visits:
+        date = visit.date if type(visit) is Visit else visitDate(visit[0])
+        if (year is None or date.year == year) and (month is None or date.month == month):
+            yield patientId, visit
+
+
+def filter_patients(visits, patientIds):
+    """
+    Keeps visits of the given patients.
+
+    visits: An iterable of (patientId, visit) pairs.
+    patientIds: A collection of patient IDs to keep.
+    """
+    patientIds = set(patientIds)
+    for patientId, visit in visits:
+        if patientId in patientIds:
+            yield patientId, visit
+
+
+def filter_abnormal(visits, predicate=needsFollowUp):
+    """
+    Keeps visits with abnormal vital signs.
+
+    visits: An iterable of (patientId, visit) pairs.
+    predicate: A function of a visit that returns True for abnormal visits.
+    """
+    for patientId, visit in visits:
+        if predicate(visit):
+            yield patientId, visit
+
+
+def average_vitals(visits):
+    """
+    Averages every vital sign over a stream of visits.
+
+    visits: An iterable of (patientId, visit) pairs.
+    return: A tuple (number of visits, [average temp, hr, rr, sbp, dbp, spo2]).
+            The averages are None if there are no visits.
+    """
+    count = 0
+    sums = [0] * 6
+    for _, visit in visits:
+        count += 1
+        for i, value in enumerate(visit[1:7]):
+            sums[i] += value
+    if count == 0:
+        return 0, [None] * 6
+    return count, [total / count for total in sums]
+
+
+def last_visits(visits):
+    """
+    Collects the most recent visit of each patient; memory grows with patients, not visits.
+
+    visits: An iterable of (patientId, visit) pairs in file order.
+    return: A dictionary of patient ID to that patient's last visit.
+    """
+    last = {}
+    for patientId, visit in visits:
+        last[patientId] = visit
+    return last
+
+
+def patients_needing_follow_up(visits, predicate=needsFollowUp):
+    """
+    Finds patients whose last visit is abnormal, like findPatientsWhoNeedFollowUp.
+
+    visits: An iterable of (patientId, visit) pairs in file order.
+    predicate: A function of a visit that returns True for abnormal visits.
+    return: A list of patient IDs.
+    """
+    return [patientId for patientId, visit in last_visits(visits).items() if predicate(visit)]
@@ -0,0 +1,259 @@
+"""
+The rules a visit must follow, shared by the loaders and the writers.
+
+The vital sign ranges are defined once, in VITAL_RANGES. Checks return a rejection code
+(VALID, or the reason a visit is rejected) instead of raising, so a dirty file costs one
+comparison per rejected line rather than an exception each:
+
+    checkVisit      one visit given to addPatientData or a VisitWriter
+    parseFields     one line of a patients file, already split at commas
+    convertColumn   a column of fields of a block of lines, converted at once
+    dateCodes       the date column of a block, checked once per distinct date
+    rangeCodes      the vital sign columns of a block, checked at once
+
+The callers turn the codes into messages: rejectionMessage gives the messages the
+loaders have always reported for a line, and visit_writer those shown to a user.
+"""
+from array import array
+
+from visit_record import Visit
+
+# Rejection codes
+VALID = 0
+WRONG_FIELD_COUNT = 1
+NOT_A_NUMBER = 2
+INVALID_PATIENT_ID = 3
+INVALID_DATE_FORMAT = 4
+INVALID_DATE = 5
+INVALID_TEMPERATURE = 6
+INVALID_HEART_RATE = 7
+INVALID_RESPIRATORY_RATE = 8
+INVALID_SYSTOLIC_BP = 9
+INVALID_DIASTOLIC_BP = 10
+INVALID_SPO2 = 11
+
+# Valid range of each vital sign, in visit order: (low, high, label)
+VITAL_RANGES = (
+    (35.0, 42.0, "temperature"),
+    (30, 180, "heart rate"),
+    (5, 40, "respiratory rate"),
+    (70, 200, "systolic blood pressure"),
+    (40, 120, "diastolic blood pressure"),
+    (70, 100, "oxygen saturation"),
+)
+
+# Rejection code of each vital sign out of range, in visit order
+VITAL_CODES = (INVALID_TEMPERATURE, INVALID_HEART_RATE, INVALID_RESPIRATORY_RATE,
+               INVALID_SYSTOLIC_BP, INVALID_DIASTOLIC_BP, INVALID_SPO2)
+
+# Short name of the reason each rejection code stands for, e.g. for counting rejected lines
+REJECTION_REASONS = {
+    WRONG_FIELD_COUNT: 'number of fields',
+    NOT_A_NUMBER: 'unreadable value',
+    INVALID_PATIENT_ID: 'patient ID',
+    INVALID_DATE_FORMAT: 'date',
+    INVALID_DATE: 'date',
+}
+REJECTION_REASONS.update((code, label) for code, (_, _, label) in zip(VITAL_CODES, VITAL_RANGES))
+
+# Type of each vital sign, in visit order
+VITAL_TYPES = (float, int, int, int, int, int)
+
+# Number of values convertColumn and rangeCodes handle at once in a column with an invalid one
+CHUNK_SIZE = 1024
+
+# Earliest year of a visit added by a writer
+FIRST_YEAR = 1900
+
+# Number of days of each month of a common year, indexed by month number
+_MONTH_DAYS = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def isCalendarDay(day):
+    """
+    Tells whether a packed yyyymmdd day is a day of the calendar, e.g. not 20230229.
+    """
+    year, month, day = day // 10000, day // 100 % 100, day % 100
+    if year < 1 or not 1 <= month <= 12 or day < 1:
+        return False
+    if day <= _MONTH_DAYS[month]:
+        return True
+    return month == 2 and day == 29 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def dateCode(date, firstYear=1):
+    """
+    Checks a visit date.
+
+    date: The date, which must be a 'yyyy-mm-dd' string.
+    firstYear: The earliest valid year.
+    return: VALID, INVALID_DATE_FORMAT, or INVALID_DATE if the date is not a day of the
+            calendar or is before firstYear.
+    """
+    if not isinstance(date, str) or len(date) != 10 or date[4] != '-' or date[7] != '-':
+        return INVALID_DATE_FORMAT
+    digits = date[:4] + date[5:7] + date[8:]
+    if not (digits.isascii() and digits.isdigit()):
+        return INVALID_DATE_FORMAT
+    day = int(digits)
+    if day // 10000 < firstYear or not isCalendarDay(day):
+        return INVALID_DATE
+    return VALID
+
+
+def checkVisit(patientId, date, temp, hr, rr, sbp, dbp, spo2):
+    """
+    Checks and converts the values of a new visit, as given to addPatientData. Numbers
+    may also be given as strings.
+
+    return: A tuple (code, patient ID as an integer, Visit); the ID and the Visit are None
+            unless the code is VALID.
+    """
+    if type(patientId) is not int:
+        patientId = str(patientId)
+        if not (patientId.isascii() and patientId.isdigit()):
+            return INVALID_PATIENT_ID, None, None
+        patientId = int(patientId)
+    if patientId <= 0:
+        return INVALID_PATIENT_ID, None, None
+
+    code = dateCode(date, FIRST_YEAR)
+    if code:
+        return code, None, None
+
+    vitals = []
+    for value, convert, (low, high, _), code in zip((temp, hr, rr, sbp, dbp, spo2), VITAL_TYPES,
+                                                      VITAL_RANGES, VITAL_CODES):
+        if type(value) is not convert:
+            try:
+                value = convert(value)
+            except (TypeError, ValueError):
+                return code, None, None
+        if not low <= value <= high:
+            return code, None, None
+        vitals.append(value)
+    return VALID, patientId, Visit(date, *vitals)
+
+
+def parseFields(fields):
+    """
+    Converts and checks the fields of one line of a patients file: the field count, then
+    the conversion of every number, then the date, then the range of every vital sign.
+    The date is kept as a string.
+
+    fields: The line split at commas.
+    return: A tuple (code, detail). For VALID, detail is the tuple (patientId, date,
+            temperature, heart rate, respiratory rate, systolic blood pressure, diastolic
+            blood pressure, oxygen saturation); otherwise it is what rejectionMessage
+            reports: the number of fields, the conversion error, the date, or the value
+            out of range.
+    """
+    if len(fields) != 8:
+        return WRONG_FIELD_COUNT, len(fields)
+    try:
+        values = (int(fields[0]), fields[1], float(fields[2]), int(fields[3]), int(fields[4]),
+                  int(fields[5]), int(fields[6]), int(fields[7]))
+    except ValueError as e:
+        return NOT_A_NUMBER, str(e)
+    code = dateCode(values[1])
+    if code:
+        return code, values[1]
+    for value, (low, high, _), code in zip(values[2:], VITAL_RANGES, VITAL_CODES):
+        if not low <= value <= high:
+            return code, value
+    return VALID, values
+
+
+def rejectionMessage(code, detail, lineNumber):
+    """
+    Returns the message the loaders report for a rejected line.
+
+    code: The rejection code.
+    detail: The detail returned by parseFields, or the rejected date or vital sign value.
+    lineNumber: The number of the line in the patients file.
+    """
+    if code == WRONG_FIELD_COUNT:
+        return f"Invalid number of fields ({detail}) in line: {lineNumber}"
+    if code == NOT_A_NUMBER:
+        return detail
+    if code in (INVALID_DATE_FORMAT, INVALID_DATE):
+        return f"Invalid date value ({detail}) in line: {lineNumber}"
+    return f"Invalid {VITAL_RANGES[VITAL_CODES.index(code)][2]} value ({detail}) in line: {lineNumber}"
+
+
+def convertColumn(fields, convert, typecode):
+    """
+    Converts a column of fields into an array, in one pass unless some are not numbers;
+    then only the chunks of CHUNK_SIZE fields holding those are converted field by field.
+
+    fields: The fields of the column, one per line.
+    convert: int or float.
+    typecode: The type code of the array.
+    return: A tuple (array, dictionary of row number -> conversion error of the fields
+            that are not numbers). The array holds 0 at those rows.
+    Raises OverflowError if a value does not fit the array.
+    """
+    try:
+        # An array fills faster from a list than from an iterator
+        return array(typecode, list(map(convert, fields))), {}
+    except ValueError:
+        pass
+    values = array(typecode)
+    errors = {}
+    for start in range(0, len(fields), CHUNK_SIZE):
+        chunk = fields[start:start + CHUNK_SIZE]
+        try:
+            values.extend(array(typecode, map(convert, chunk)))
+            continue
+        except ValueError:
+            pass
+        for row, field in enumerate(chunk, start):
+            try:
+                values.append(convert(field))
+            except ValueError as e:
+                values.append(0)
+                errors[row] = str(e)
+    return values, errors
+
+
+def rangeCodes(columns):
+    """
+    Checks whole vital sign columns against VITAL_RANGES. A column is only looked at
+    value by value in the chunks of CHUNK_SIZE values whose minimum or maximum is out of
+    range (a NaN temperature makes the sum of its chunk NaN, so it is caught the same way).
+
+    columns: The six vital sign columns, in visit order, as arrays of equal length.
+    return: A dictionary of row number -> rejection code of the first vital sign out of
+            range, for the rows with one.
+    """
+    codes = {}
+    if not len(columns[0]):
+        return codes
+    for column, (low, high, _), code in zip(columns, VITAL_RANGES, VITAL_CODES):
+        isFloat = column.typecode == 'd'
+        total = sum(column) if isFloat else 0
+        if min(column) >= low and max(column) <= high and total == total:
+            continue
+        for start in range(0, len(column), CHUNK_SIZE):
+            chunk = column[start:start + CHUNK_SIZE]
+            total = sum(chunk) if isFloat else 0
+            if min(chunk) < low or max(chunk) > high or total != total:
+                for row, value in enumerate(chunk, start):
+                    if not low <= value <= high:
+                        codes.setdefault(row, code)
+    return codes
+
+
+def dateCodes(dates):
+    """
+    Checks a column of dates with dateCode.
+
+    dates: The list of date strings.
+    return: A dictionary of row number -> rejection code, for the rows with a date that
+            is not in the format 'yyyy-mm-dd' or is not a day of the calendar.
+    """
+    # Visits share few distinct dates, so each is checked once
+    checked = {date: dateCode(date) for date in set(dates)}
+    if not any(checked.values()):
+        return {}
+    return {row: checked[date] for row, date in enumerate(dates) if checked[date]}
@@ -0,0 +1,201 @@
+"""
+Batched writes of new visits to a patients file.
+
+addPatientData opens the file, writes one line and closes it for every visit. A
+VisitWriter keeps the file open for a whole session instead: visits are validated as
+they are added, buffered, and written batchSize at a time with a single writelines.
+The lines are the same addPatientData would have written, so a batch of visits leaves
+the file exactly as the same visits added one at a time.
+
+For a collection with its own storage (see storage), such as a SqliteStore, no file is
+opened: each batch is appended to the collection and saved by its storage at once.
+
+The durability policy decides when data written to a file is forced to disk with fsync:
+
+    DURABILITY_NONE   never; the data is handed to the operating system after each
+                      batch, like addPatientData does
+    DURABILITY_BATCH  after every batch, so a batch is on disk once flush returns
+    DURABILITY_CLOSE  once, when the session is closed
+"""
+import os
+
+from patient_records import notifyVisitAdded, notifyVisitsAdded
+from visit_validation import (INVALID_DATE, INVALID_DATE_FORMAT, INVALID_PATIENT_ID, VALID, VITAL_CODES,
+                              VITAL_RANGES, checkVisit)
+
+DURABILITY_NONE = 'none'
+DURABILITY_BATCH = 'batch'
+DURABILITY_CLOSE = 'close'
+DURABILITY_POLICIES = (DURABILITY_NONE, DURABILITY_BATCH, DURABILITY_CLOSE)
+
+# Number of visits a VisitWriter buffers before writing them out
+BATCH_SIZE = 10000
+
+# Units of the vital signs in the messages shown to a user, in visit order
+_UNITS = (" Celsius", " bpm", " bpm", " mmHg", " mmHg", "%")
+
+
+def _userMessage(code):
+    """
+    Returns the message shown to a user for a visit rejected with a rejection code.
+    """
+    if code == INVALID_PATIENT_ID:
+        return "Invalid patient ID. Please enter a positive integer."
+    if code == INVALID_DATE_FORMAT:
+        return "Invalid date format. Please enter date in the format 'yyyy-mm-dd'."
+    if code == INVALID_DATE:
+        return "Invalid date. Please enter a valid date."
+    vital = VITAL_CODES.index(code)
+    low, high, label = VITAL_RANGES[vital]
+    article = 'an' if label[0] in 'aeiou' else 'a'
+    return f"Invalid {label}. Please enter {article} {label} between {low} and {high}{_UNITS[vital]}."
+
+
+def validateVisit(patientId, date, temp, hr, rr, sbp, dbp, spo2):
+    """
+    Checks the values of a new visit, as entered for addPatientData (see checkVisit).
+
+    return: A tuple (patient ID as an integer, Visit).
+    Raises ValueError with a message for the user if any value is invalid.
+    """
+    code, patientId, visit = checkVisit(patientId, date, temp, hr, rr, sbp, dbp, spo2)
+    if code != VALID:
+        raise ValueError(_userMessage(code))
+    return patientId, visit
+
+
+def formatVisitLine(patientId, visit):
+    """
+    Returns the text addPatientData appends to the patients file for a visit.
+    """
+    return f"\n{patientId},{','.join(map(str, visit))}"
+
+
+def recordVisit(patients, patientId, visit):
+    """
+    Appends a visit to the patients collection and updates its indexes.
+    """
+    if patientId in patients:
+        patients[patientId].append(visit)
+    else:
+        patients[patientId] = [visit]
+    notifyVisitAdded(patients, patientId, visit)
+
+
+def recordVisits(patients, visits):
+    """
+    Appends (patientId, visit) pairs to the patients collection and updates its indexes
+    once for the whole batch.
+    """
+    if hasattr(patients, 'appendMany'):
+        patients.appendMany(visits)
+    else:
+        for patientId, visit in visits:
+            if patientId in patients:
+                patients[patientId].append(visit)
+            else:
+                patients[patientId] = [visit]
+    notifyVisitsAdded(patients, visits)
+
+
+class VisitWriter:
+    """
+    A session that appends validated visits to a patients file in batches.
+
+    Visits reach the patients collection when their batch has been written, so the
+    collection never holds a visit the file does not. Use it as a context manager, or
+    call close, to write the last batch.
+    """
+
+    def __init__(self, patients, fileName, durability=DURABILITY_NONE, batchSize=BATCH_SIZE, report=print):
+        """
+        patients: The patients collection to add the visits to.
+        fileName: The name of the file to append new data to.
+        durability: One of DURABILITY_POLICIES.
+        batchSize: The number of visits buffered before they are written.
+        report: A function called with the message of each rejected visit.
+        """
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError(f"Unknown durability policy: {durability}")
+        self.patients = patients
+        self.fileName = fileName
+        self.durability = durability
+        self.batchSize = batchSize
+        self.report = report
+        self.written = 0
+        self.rejected = 0
+        self._lines = []
+        self._visits = []
+        self._storage = getattr(patients, 'storage', None)
+        self._file = open(fileName, 'a') if self._storage is None else None
+
+    def add(self, patientId, date, temp, hr, rr, sbp, dbp, spo2):
+        """
+        Validates a visit and buffers it for writing.
+
+        return: True if the visit was accepted, False if it was rejected and reported.
+        """
+        try:
+            patientId, visit = validateVisit(patientId, date, temp, hr, rr, sbp, dbp, spo2)
+        except (ValueError, TypeError, AttributeError) as e:
+            self.rejected += 1
+            self.report(str(e))
+            return False
+        if self._file is not None:
+            self._lines.append(formatVisitLine(patientId, visit))
+        self._visits.append((patientId, visit))
+        if len(self._visits) >= self.batchSize:
+            self.flush()
+        return True
+
+    def addMany(self, visits):
+        """
+        Adds visits given as (patientId, date, temp, hr, rr, sbp, dbp, spo2) tuples.
+
+        return: The number of visits accepted.
+        """
+        accepted = 0
+        for visit in visits:
+            accepted += self.add(*visit)
+        return accepted
+
+    def flush(self):
+        """
+        Writes the buffered visits with one writelines and adds them to the patients collection.
+        """
+        if not self._visits:
+            return
+        if self._file is not None:
+            self._file.writelines(self._lines)
+            self._file.flush()
+            if self.durability == DURABILITY_BATCH:
+                os.fsync(self._file.fileno())
+        recordVisits(self.patients, self._visits)
+        if self._file is None:
+            self._storage.saveVisits(self._visits)
+        self.written += len(self._visits)
+        self._lines = []
+        self._visits = []
+
+    def close(self):
+        """
+        Writes the last batch and closes the file.
+        """
+        if self._file is None:
+            self.flush()
+            return
+        if self._file.closed:
+            return
+        try:
+            self.flush()
+            if self.durability == DURABILITY_CLOSE:
+                os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
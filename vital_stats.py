@@ -0,0 +1,216 @@
+"""
+Summary statistics of vital signs over all patients or a subset of them.
+
+computeStats gathers each vital sign into one column and reduces every column with one
+pass of a built-in (Counter), so the work per visit happens in C rather than in a Python
+loop; every statistic is then derived from the counts of the distinct values. For a
+VisitStore the columns already exist; for a dictionary of patients they are built with
+a single zip over the visits.
+The result is a StatsReport that callers can format however they like.
+"""
+import gc
+import math
+from bisect import bisect_right
+from collections import Counter
+from itertools import accumulate, chain
+from operator import mul
+
+from instrumentation import timed
+from visit_record import vitalColumns as visitVitalColumns
+from visit_store import VITAL_NAMES
+
+# Percentiles reported for every vital sign unless others are requested
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class VitalSummary:
+    """
+    Statistics of one vital sign: count, mean, minimum, maximum, population standard
+    deviation and the requested percentiles (a dictionary of percentile to value).
+    With no visits the statistics are None and there are no percentiles.
+    """
+
+    __slots__ = ('count', 'mean', 'minimum', 'maximum', 'stdev', 'percentiles')
+
+    def __init__(self, count=0, mean=None, minimum=None, maximum=None, stdev=None, percentiles=None):
+        self.count = count
+        self.mean = mean
+        self.minimum = minimum
+        self.maximum = maximum
+        self.stdev = stdev
+        self.percentiles = percentiles if percentiles is not None else {}
+
+    def asDict(self):
+        """
+        Returns the statistics as a dictionary, e.g. for JSON output.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return (f"VitalSummary(count={self.count}, mean={self.mean}, minimum={self.minimum}, "
+                f"maximum={self.maximum}, stdev={self.stdev})")
+
+
+class StatsReport:
+    """
+    Statistics of every vital sign over a set of patients.
+
+    patientCount: The number of patients the statistics cover.
+    visitCount: The number of visits the statistics cover.
+    vitals: A dictionary of vital sign name (see VITAL_NAMES) to VitalSummary.
+    """
+
+    __slots__ = ('patientCount', 'visitCount', 'vitals')
+
+    def __init__(self, patientCount, visitCount, vitals):
+        self.patientCount = patientCount
+        self.visitCount = visitCount
+        self.vitals = vitals
+
+    def __getitem__(self, name):
+        return self.vitals[name]
+
+    def asDict(self):
+        """
+        Returns the report as nested dictionaries, e.g. for JSON output.
+        """
+        return {'patientCount': self.patientCount, 'visitCount': self.visitCount,
+                'vitals': {name: summary.asDict() for name, summary in self.vitals.items()}}
+
+
+def _rankPosition(count, q):
+    """
+    Returns the two ranks a percentile falls between and the fraction of the way from the first.
+    """
+    position = (count - 1) * q / 100
+    low = math.floor(position)
+    return low, min(low + 1, count - 1), position - low
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile of sorted values, interpolating linearly between the
+    two nearest values (the default method of numpy.percentile).
+
+    values: A non-empty sorted sequence.
+    q: The percentile, between 0 and 100.
+    """
+    low, high, fraction = _rankPosition(len(values), q)
+    return values[low] + (values[high] - values[low]) * fraction
+
+
+def summarize(column, percentiles=DEFAULT_PERCENTILES):
+    """
+    Computes the statistics of one column of values.
+
+    Vital signs take few distinct values, so the column is first reduced to a count of
+    each distinct value in one pass, and every statistic is computed from those counts.
+    Columns with many distinct values are reduced directly instead.
+
+    column: A sequence of numbers, such as an array column of a VisitStore.
+    percentiles: The percentiles to compute.
+    Returns a VitalSummary.
+    """
+    count = len(column)
+    if count == 0:
+        return VitalSummary()
+    counts = Counter(column)
+    if len(counts) * 4 > count:
+        ordered = sorted(column)
+        total = math.fsum(ordered)
+        squares = math.fsum(map(mul, ordered, ordered))
+        values = {q: percentile(ordered, q) for q in percentiles}
+        return VitalSummary(count, total / count, ordered[0], ordered[-1],
+                            _stdev(total, squares, count), values)
+
+    distinct = sorted(counts)
+    weights = [counts[value] for value in distinct]
+    weighted = list(map(mul, distinct, weights))
+    total = math.fsum(weighted)
+    squares = math.fsum(map(mul, weighted, distinct))
+    ranks = list(accumulate(weights))
+
+    def valueAt(rank):
+        return distinct[bisect_right(ranks, rank)]
+
+    values = {}
+    for q in percentiles:
+        low, high, fraction = _rankPosition(count, q)
+        low_value = valueAt(low)
+        values[q] = low_value + (valueAt(high) - low_value) * fraction
+    return VitalSummary(count, total / count, distinct[0], distinct[-1],
+                        _stdev(total, squares, count), values)
+
+
+def _stdev(total, squares, count):
+    """
+    Returns the population standard deviation from the sum and the sum of squares of
+    count values. Both sums are exact (math.fsum), which keeps the subtraction from
+    losing the variance when it is small against the mean.
+    """
+    variance = squares / count - (total / count) ** 2
+    return math.sqrt(max(variance, 0.0))
+
+
+def vitalColumns(patients, patientIds=None):
+    """
+    Collects the vital sign columns of all patients or of some of them.
+
+    patients: A dictionary of patient IDs to lists of visits, or a VisitStore.
+    patientIds: The IDs of the patients to include, or None for all patients.
+                IDs that are not in patients are ignored.
+    Returns a tuple (number of patients, list of six columns in VITAL_NAMES order).
+    """
+    if patientIds is None:
+        patientCount = len(patients)
+    else:
+        patientIds = [patientId for patientId in dict.fromkeys(patientIds) if patientId in patients]
+        patientCount = len(patientIds)
+
+    if hasattr(patients, 'patientColumns'):
+        if patientIds is None:
+            return patientCount, list(patients.liveColumns())
+        return patientCount, patients.patientColumns(patientIds)
+
+    selected = patients.values() if patientIds is None else map(patients.__getitem__, patientIds)
+    # Transposed lists of visits are tracked by the garbage collector, which would
+    # otherwise make repeated passes over them while they are built
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return patientCount, visitVitalColumns(list(chain.from_iterable(selected)))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def vitalMeans(patients, patientIds=None):
+    """
+    Averages every vital sign over all patients or a subset of them, skipping the other
+    statistics computeStats would compute.
+
+    patients: A dictionary of patient IDs to lists of visits, or a VisitStore.
+    patientIds: The IDs of the patients to include, or None for all patients.
+    Returns a tuple (number of visits, [average temp, hr, rr, sbp, dbp, spo2]).
+    The averages are None if there are no visits.
+    """
+    _, columns = vitalColumns(patients, patientIds)
+    count = len(columns[0])
+    if count == 0:
+        return 0, [None] * len(columns)
+    return count, [sum(column) / count for column in columns]
+
+
+@timed()
+def computeStats(patients, patientIds=None, percentiles=DEFAULT_PERCENTILES):
+    """
+    Computes the statistics of every vital sign over all patients or a subset of them.
+
+    patients: A dictionary of patient IDs to lists of visits, or a VisitStore.
+    patientIds: The IDs of the patients to include, or None for all patients.
+    percentiles: The percentiles to compute for every vital sign.
+    Returns a StatsReport.
+    """
+    patientCount, columns = vitalColumns(patients, patientIds)
+    vitals = {name: summarize(column, percentiles) for name, column in zip(VITAL_NAMES, columns)}
+    return StatsReport(patientCount, len(columns[0]), vitals)